@@ -12,6 +12,8 @@ For now, it seems that would be an unnecessary level of overcomplication.
 
 import sys
 import signal
+import threading
+import time
 from flask import Flask
 from app.config import Config
 from flask_sqlalchemy import SQLAlchemy
@@ -42,19 +44,24 @@ from .dynconfig import DynConfig, MalformedConfigException
 
 def shutdown_handler(signum, frame):
     logger.info(f"Received signal {signum}. Shutting down...")
+    from app.persistence import MeasurementWriter
+    try:
+        MeasurementWriter.stop()
+    except Exception as e:
+        logger.error(f"Error flushing queued measurements: {e}")
+
     from app.hardware import deinitialize_hardware
+    from app.hardwareworker import HardwareWorker
     try:
         deinitialize_hardware(force=True)
         logger.info("Hardware de-initialized successfully.")
     except Exception as e:
         logger.error(f"Error de-initializing hardware: {e}")
+    HardwareWorker.stop()
     sys.exit(0)
 
-def initialize_backend(flask_app):
-    # Register signal handlers
-    signal.signal(signal.SIGINT, shutdown_handler)
-    signal.signal(signal.SIGTERM, shutdown_handler)
-
+def prepare_database():
+    """ Creates missing tables and the default user. Requires an app context. """
     db.create_all()
     # Create default user if none exists
     from app.models import User
@@ -68,16 +75,47 @@ def initialize_backend(flask_app):
     except Exception as e:
         logger.error(f"Error checking/creating default user: {e}")
 
-    # Fetch dynamic configuration from the database
-    DynConfig.fetch_config()
-    if not DynConfig.initialized:
-        logger.critical("Cannot fetch config from database. Aborting.")
-        sys.exit(1)
+def reconcile_with_database(flask_app):
+    """ Retries until the database can be reached, then switches to its configuration """
+    delay = 5.0
+    while True:
+        with flask_app.app_context():
+            try:
+                prepare_database()
+                if DynConfig.fetch_config():
+                    return
+            except Exception as e:
+                logger.error(f"Database not reachable yet: {e}")
+            finally:
+                db.session.remove()
+        time.sleep(delay)
+        delay = min(delay * 2, 300.0)
+
+def initialize_backend(flask_app):
+    # Register signal handlers
+    signal.signal(signal.SIGINT, shutdown_handler)
+    signal.signal(signal.SIGTERM, shutdown_handler)
+
+    if DynConfig.load_snapshot():
+        # Start from the local snapshot right away; the database catches up in the background
+        threading.Thread(target=reconcile_with_database, args=(flask_app,), name="Config Reconciliation", daemon=True).start()
+    else:
+        prepare_database()
+
+        # Fetch dynamic configuration from the database
+        DynConfig.fetch_config()
+        if not DynConfig.initialized:
+            logger.critical("Cannot fetch config from database. Aborting.")
+            sys.exit(1)
     
     # Initialize & configure hardware drivers
     from app.hardware import initialize_drivers, initialize_hardware, deinitialize_hardware
+    from app.hardwareworker import HardwareWorkerError
     try:
         initialize_drivers()
+    except HardwareWorkerError:
+        logger.critical("Cannot start the hardware worker process. Aborting.")
+        sys.exit(1)
     except ValueError:
         logger.critical("Cannot initialize hardware drivers. Aborting.")
         sys.exit(1)
@@ -130,14 +168,47 @@ def initialize_backend(flask_app):
         with flask_app.app_context():
             run_summary()
     
+    # Move closed months of measurements into the archive
+    from .archive import Archive
+    Archive.recover()
+    @scheduler.task('cron', id='archive', minute=30, hour=str(Config.ARCHIVE_RUN_HOUR))
+    def archive():
+        with flask_app.app_context():
+            try:
+                Archive.archive_closed_months()
+            except Exception as e:
+                logger.error(f"Error archiving measurements: {e}")
+
+    # Roll up any measurements recorded before the rollup tables existed
+    def rollup_backfill():
+        from .rollups import Rollups
+        with flask_app.app_context():
+            try:
+                Rollups.backfill_if_empty()
+            except Exception as e:
+                logger.error(f"Error backfilling measurement rollups: {e}")
+    scheduler.add_job(id='rollup_backfill', func=rollup_backfill, trigger='date', replace_existing=True)
+
     if not scheduler.running:
         scheduler.start()
 
+    # Start the write-behind persistence of measurements
+    from .persistence import MeasurementWriter
+    MeasurementWriter.start(flask_app)
+
+    # Resume (and then wait for) retroactive recalibration of stored measurements
+    from .recalibration import Recalibrator
+    Recalibrator.start(flask_app)
+
     # Get the sensor polling loop going
     from .hardwarestate import HardwareState
     HardwareState.sync_gfci_settings()
     HardwareState.schedule_sensor_polling(flask_app)
 
+    # Sample the host's own health alongside
+    from .hosthealth import HostHealth
+    HostHealth.schedule(flask_app)
+
     # Get the regulation loop going
     from .regulation import Regulator
     regulator = Regulator()
@@ -0,0 +1,164 @@
+""" Concurrent sensor acquisition
+
+Sensors that share a bus (see `BaseSensorDriver.bus`) are read by a single worker, one
+`read_batch` acquisition per driver type, while independent buses (e.g. the 1-Wire sysfs reads
+vs. the I2C Arduino) are read in parallel on a bounded thread pool. A poll then only takes as
+long as its slowest bus. With `acquisition_concurrent` off the buses are read one at a time,
+but each read still has its deadline, so a hung bus cannot stall sampling either way.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, Hashable, Type
+from loguru import logger
+
+from app.config import Config
+from app.hardware import group_sensors
+from app.hardware_constants import SensorId
+from drivers.base_driver import BaseSensorDriver
+
+
+@dataclass
+class AcquisitionResult:
+    """ The outcome of reading a single sensor """
+    value: Optional[float]       # None if the read failed or missed its deadline
+    duration: Optional[float]    # Seconds spent in the driver's read (None if it never finished)
+    timestamp: datetime = field(default_factory=lambda: datetime.now(Config.TIMEZONE))
+    timed_out: bool = False
+    error: Optional[str] = None
+    monotonic: float = field(default_factory=time.monotonic)  # time.monotonic() at the moment of acquisition
+
+    @property
+    def ok(self) -> bool:
+        return self.value is not None
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_workers: int = 0
+_executor_lock = threading.Lock()
+
+# Bus groups that still have a read in flight (e.g. a hung transaction from an earlier poll).
+# New reads are not queued behind them so that a stuck bus cannot exhaust the worker pool.
+_busy_groups: set[Hashable] = set()
+
+
+def _get_executor(max_workers: int) -> ThreadPoolExecutor:
+    """ Returns the shared worker pool, re-creating it if the configured size changed """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Acquisition")
+            _executor_workers = max_workers
+        return _executor
+
+
+def _read_batch(drivers: dict[SensorId, BaseSensorDriver], driver_type: Type[BaseSensorDriver],
+                sensor_ids: list[SensorId]) -> dict[SensorId, AcquisitionResult]:
+    """ Acquires a batch of same-type sensors on one bus; they all share the batch's timing """
+    start = time.monotonic()
+    try:
+        values = driver_type.read_batch([drivers[sensor_id] for sensor_id in sensor_ids])
+    except Exception as e:
+        logger.error(f"Error reading sensors {[s.name for s in sensor_ids]}: {e}")
+        duration = time.monotonic() - start
+        return {sensor_id: AcquisitionResult(None, duration, error=str(e)) for sensor_id in sensor_ids}
+
+    acquired = time.monotonic()
+    duration = acquired - start
+    timestamp = datetime.now(Config.TIMEZONE)
+    return {
+        sensor_id: AcquisitionResult(value, duration, timestamp, monotonic=acquired)
+        for sensor_id, value in zip(sensor_ids, values)
+    }
+
+
+def _read_group(key: Hashable, drivers: dict[SensorId, BaseSensorDriver],
+                batches: dict[Type[BaseSensorDriver], list[SensorId]], futures: dict[SensorId, Future]):
+    """ Reads every batch on one bus in turn, resolving each sensor's future as its batch completes """
+    try:
+        for driver_type, sensor_ids in batches.items():
+            for sensor_id, result in _read_batch(drivers, driver_type, sensor_ids).items():
+                futures[sensor_id].set_result(result)
+    finally:
+        with _executor_lock:
+            _busy_groups.discard(key)
+
+
+def _start_group(executor: ThreadPoolExecutor, key: Hashable, drivers: dict[SensorId, BaseSensorDriver],
+                 batches: dict[Type[BaseSensorDriver], list[SensorId]], read_timeout: float,
+                 results: dict[SensorId, AcquisitionResult]) -> list[tuple[SensorId, Future, float]]:
+    """ Submits the reads of one bus, unless it's still busy from an earlier poll. Returns each
+    sensor's future and deadline: `read_timeout` seconds per acquisition queued on the bus. """
+    sensor_ids = [sensor_id for ids in batches.values() for sensor_id in ids]
+    with _executor_lock:
+        busy = key in _busy_groups
+        if not busy:
+            _busy_groups.add(key)
+    if busy:
+        logger.warning(f"Bus {key} still busy from a previous poll; skipping {[s.name for s in sensor_ids]}")
+        for sensor_id in sensor_ids:
+            results[sensor_id] = AcquisitionResult(None, None, timed_out=True, error="bus busy")
+        return []
+
+    start = time.monotonic()
+    futures, pending = {}, []
+    for position, batch in enumerate(batches.values()):
+        for sensor_id in batch:
+            futures[sensor_id] = Future()
+            pending.append((sensor_id, futures[sensor_id], start + read_timeout * (position + 1)))
+    executor.submit(_read_group, key, drivers, batches, futures)
+    return pending
+
+
+def _collect(pending: list[tuple[SensorId, Future, float]], read_timeout: float,
+             results: dict[SensorId, AcquisitionResult]):
+    """ Waits for the submitted reads, reporting those that miss their deadline as timed out """
+    for sensor_id, future, deadline in pending:
+        try:
+            results[sensor_id] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            logger.error(f"Read of sensor {sensor_id.name} missed its {read_timeout}s deadline")
+            results[sensor_id] = AcquisitionResult(None, None, timed_out=True, error="timeout")
+
+
+def read_sequential(drivers: dict[SensorId, BaseSensorDriver], max_workers: int = 1,
+                    read_timeout: Optional[float] = None) -> dict[SensorId, AcquisitionResult]:
+    """ Reads every bus one after another.
+
+    Without `read_timeout` the reads run in the calling thread. With it, each bus is read on the
+    worker pool while the caller waits, with the same deadlines as `read_concurrent`, so a hung
+    read is reported as timed out and the next bus is still read.
+    """
+    results: dict[SensorId, AcquisitionResult] = {}
+    if read_timeout is None:
+        for batches in group_sensors(drivers).values():
+            for driver_type, sensor_ids in batches.items():
+                results.update(_read_batch(drivers, driver_type, sensor_ids))
+        return results
+
+    executor = _get_executor(max_workers)
+    for key, batches in group_sensors(drivers).items():
+        _collect(_start_group(executor, key, drivers, batches, read_timeout, results), read_timeout, results)
+    return results
+
+
+def read_concurrent(drivers: dict[SensorId, BaseSensorDriver], max_workers: int,
+                    read_timeout: float) -> dict[SensorId, AcquisitionResult]:
+    """ Reads all sensors, running independent buses in parallel.
+
+    Each acquisition gets its own deadline of `read_timeout` seconds, counted from when the
+    acquisitions queued ahead of it on the same bus were due. Sensors whose acquisition misses
+    its deadline are reported as timed out (value None); the worker finishes in the background.
+    """
+    executor = _get_executor(max_workers)
+    results: dict[SensorId, AcquisitionResult] = {}
+    pending: list[tuple[SensorId, Future, float]] = []
+    for key, batches in group_sensors(drivers).items():
+        pending += _start_group(executor, key, drivers, batches, read_timeout, results)
+    _collect(pending, read_timeout, results)
+    return results
@@ -1,89 +1,102 @@
-from flask import jsonify, request
+from flask import jsonify, request, Response, stream_with_context, after_this_request, current_app
 from app.api import bp
 from app.hardwarestate import HardwareState
-from app.hardware_constants import SensorId, RelayId
+from app.hardware_constants import SensorId, RelayId, HostMetricId
 from app.dynconfig import DynConfig
 from app.models import SystemConfig, CalibrationPoint, Measurement
 from app import db
 from app.regulation import Regulator
 from app.calibration import CalibrationRegistry
-from app.hardware import gfci_driver, initialize_hardware, deinitialize_hardware
-from drivers.real_drivers import ArduinoInterface
+from app.persistence import MeasurementWriter
+from app.recalibration import Recalibrator
+from app.archive import Archive
+from app.rollups import Rollups, RELAY_COLUMNS
+from app.downsampling import downsample_indices
+from app import seriescodec
+from app.historycache import HistoryCache, CachedResponse
+from app.derived import parse_definitions as parse_derived, evaluate as evaluate_derived
+from app.historystream import iso_timestamps, epoch_milliseconds, parse_cursor, iter_pages, ndjson_lines, csv_lines, PAGE_ROWS
+from app.hardwareworker import HardwareWorker
+from app.dbpools import DBPools
+from app.hosthealth import HostHealth
+from app.eventstream import StateStream, TOPICS, status_state, watchdog_state, parse_event_id
+from app.hardware import gfci_driver, initialize_hardware, deinitialize_hardware, single_flight_stats
+from drivers.real_drivers import ArduinoInterface, w1_registry
 from flask_login import login_required
 import os
+import time
 from datetime import datetime, timedelta
+from typing import Optional
 
 from app.watchdog import WatchdogTrigger
 from app.config import Config
 from loguru import logger
+import json
 import pandas as pd
+from sqlalchemy import select, delete, func, type_coerce, String
 import numpy as np
 
+MAINTENANCE_DELETE_ROWS = 1000  # Rows deleted per transaction by maintenance tasks
+DEFAULT_HISTORY_WINDOW = timedelta(hours=24)  # Served when /api/history is given no range
+DEFAULT_WINDOW_STEP_SECONDS = 60  # Its start moves in steps of this, so repeated requests share a cache entry
+
 @bp.route('/status', methods=['GET'])
 def get_status():
     """ Returns current system status including sensor readings and relay states """
-    
-    # Get sensor readings
-    readings = {}
-    for sensor_id, reading in HardwareState.cur_sensor_values.items():
-        if reading:
-            readings[sensor_id.name] = {
-                'raw': reading.raw,
-                'calibrated': reading.cald,
-                'timestamp': reading.timestamp.isoformat() if reading.timestamp else None
-            }
-        else:
-            readings[sensor_id.name] = None
+    return jsonify(status_state())
 
-    # Get relay states
-    relays = {}
-    for relay_id in RelayId:
-        relays[relay_id.name] = HardwareState.get_relay_state(relay_id)
-    
-    gfci_status = {
-        'ping': False,
-        'tripped': [False, False],
-        'enabled': DynConfig.gfci_enabled,
-        'threshold': DynConfig.gfci_trip_threshold_ma,
-        'error': None
+@bp.route('/diagnostics', methods=['GET'])
+@login_required
+def get_diagnostics():
+    """ Returns timing and health counters of the backend's internal machinery """
+    now = time.monotonic()
+    acquisition = {
+        'concurrent': DynConfig.acquisition_concurrent,
+        'last_poll_seconds': HardwareState.last_poll_duration,
+        'persist_period_seconds': HardwareState.persist_period(),
+        'sensors': {
+            sensor_id.name: {
+                'period_seconds': HardwareState.sample_period(sensor_id),
+                'age_seconds': now - result.monotonic,
+                'read_seconds': result.duration,
+                'timed_out': result.timed_out,
+                'error': result.error
+            }
+            for sensor_id, result in HardwareState.acquisition_results.items()
+        }
     }
-    if gfci_driver and DynConfig.gfci_enabled:
-        try:
-            gfci_status['ping'] = gfci_driver.ping()
-            gfci_status['tripped'] = [gfci_driver.is_tripped(1), gfci_driver.is_tripped(2)]
-        except Exception as e:
-            gfci_status['error'] = str(e)
 
     return jsonify({
-        'sensors': readings,
-        'relays': relays,
-        'is_day': Regulator()._is_light_out(), # _is_light_out returns True if it is day
-        'manual_mode': DynConfig.manual_mode,
-        'circuit_enables': DynConfig.circuit_states,
-        'watchdog_tripped': WatchdogTrigger.is_tripped(),
-        'regulator_status': Regulator().get_status_str(),
-        'gfci': gfci_status
+        'acquisition': acquisition,
+        'persistence': MeasurementWriter.stats(),
+        'w1': w1_registry.stats(),
+        'archive': Archive.stats(),
+        'history_cache': HistoryCache.stats(),
+        'stream': StateStream.stats(),
+        'hardware_worker': HardwareWorker.stats(),
+        'config': DynConfig.status(),
+        'db_pools': DBPools.stats(),
+        'host': HostHealth.stats(),
+        'single_flight': single_flight_stats()
     })
 
+@bp.route('/stream', methods=['GET'])
+@login_required
+def stream_state():
+    """ Server-Sent Events with the changes of the live state (see app.eventstream) """
+    topics = [t for t in request.args.get('topics', ','.join(TOPICS)).split(',') if t in TOPICS]
+    last_event_id = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    response = Response(StateStream.messages(current_app._get_current_object(), topics, last_event_id),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @bp.route('/watchdog', methods=['GET'])
 @login_required
 def get_watchdog_status():
     """ Get status of all watchdog triggers """
-    triggers = []
-    excludes = DynConfig.watchdog_excludes
-    
-    for trigger in WatchdogTrigger.all_triggers():
-        triggers.append({
-            'name': trigger.__name__,
-            'status': trigger.notify_state(),
-            'is_tripped': trigger.is_tripped(),
-            'enabled': trigger.__name__ not in excludes
-        })
-    
-    return jsonify({
-        'tripped': WatchdogTrigger.is_tripped(),
-        'triggers': triggers
-    })
+    return jsonify(watchdog_state())
 
 @bp.route('/watchdog/toggle/<name>', methods=['POST'])
 @login_required
@@ -385,12 +398,14 @@ def add_calibration_point():
     except KeyError:
         return jsonify({'error': 'Invalid sensor'}), 400
         
+    old_table = CalibrationRegistry.get_table(sensor)
     p = CalibrationPoint(sensor_id=sensor.value, measured_val=measured, actual_val=actual)
     db.session.add(p)
     db.session.commit()
     CalibrationRegistry.invalidate(sensor)
+    job = Recalibrator.calibration_changed(sensor, old_table)
     
-    return jsonify({'success': True, 'id': p.id})
+    return jsonify({'success': True, 'id': p.id, 'recalibration': Recalibrator.progress(job) if job else None})
 
 @bp.route('/calibration/<int:id>', methods=['DELETE'])
 @login_required
@@ -401,11 +416,110 @@ def delete_calibration_point(id):
         return jsonify({'error': 'Point not found'}), 404
         
     sensor = SensorId(p.sensor_id)
+    old_table = CalibrationRegistry.get_table(sensor)
     db.session.delete(p)
     db.session.commit()
     CalibrationRegistry.invalidate(sensor)
+    job = Recalibrator.calibration_changed(sensor, old_table)
     
-    return jsonify({'success': True})
+    return jsonify({'success': True, 'recalibration': Recalibrator.progress(job) if job else None})
+
+@bp.route('/calibration/recalibration', methods=['GET'])
+@login_required
+def get_recalibration_progress():
+    """ Progress of re-applying calibration changes to stored measurements """
+    return jsonify(Recalibrator.stats())
+
+
+def _raw_history_frame(start_local: Optional[datetime], end_local: Optional[datetime],
+                       sensor_names: list[str]) -> pd.DataFrame:
+    """ Every measurement in the range, from the live table and the archive.
+    Only the given sensors' calibrated columns and the relays are fetched, through SQLAlchemy Core
+    rather than the ORM, and loaded column by column into NumPy arrays. """
+    table = Measurement.__table__
+    cal_cols = [f"{name}_cal" for name in sensor_names]
+    timestamp = table.c.timestamp
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite stores ISO text; NumPy parses it in bulk far faster than one datetime per row
+        timestamp = type_coerce(timestamp, String)
+    stmt = select(timestamp, *[table.c[c] for c in cal_cols + RELAY_COLUMNS]).order_by(table.c.timestamp)
+    if start_local is not None:
+        stmt = stmt.where(table.c.timestamp >= start_local)
+    if end_local is not None:
+        stmt = stmt.where(table.c.timestamp <= end_local)
+    with DBPools.reading() as session:
+        columns = list(zip(*session.execute(stmt).all())) or [()] * (1 + len(cal_cols) + len(RELAY_COLUMNS))
+
+    # Older months live in the archive rather than the DB
+    archived = Archive.read(start_local, end_local, cal_cols + RELAY_COLUMNS)
+
+    timestamps = np.concatenate((archived['timestamp'], np.array(columns[0], dtype='datetime64[ms]')))
+    data = {}
+    for name, col, live in zip(sensor_names, cal_cols, columns[1:]):
+        data[name] = np.concatenate((archived[col], np.array(live, dtype=np.float64)))  # NULL -> NaN
+    for col, live in zip(RELAY_COLUMNS, columns[1 + len(cal_cols):]):
+        data[col] = np.concatenate((archived[col], np.nan_to_num(np.array(live, dtype=np.float64)) > 0))
+    return pd.DataFrame(data, index=pd.DatetimeIndex(timestamps.astype('datetime64[ns]'), name='timestamp'))
+
+
+def _stream_history(output_format: str, start_local: Optional[datetime], end_local: Optional[datetime],
+                    sensors_str: Optional[str]) -> Response:
+    """ Streams the calibrated values of the requested sensors and the relay states as NDJSON or CSV """
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = parse_cursor(request.args['cursor'])
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    limit = request.args.get('limit', type=int)
+    page_rows = min(max(request.args.get('page_rows', type=int, default=PAGE_ROWS), 1), 50000)
+
+    requested = set(sensors_str.split(',')) if sensors_str else None
+    names = {f"{s.value}_cal": s.name for s in SensorId if requested is None or s.name in requested}
+    names.update({col: col for col in RELAY_COLUMNS})
+    pages = iter_pages(start_local, end_local, list(names), after, page_rows)
+
+    if output_format == 'csv':
+        return Response(stream_with_context(csv_lines(pages, names, limit)), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=history.csv'})
+    return Response(stream_with_context(ndjson_lines(pages, names, limit)), mimetype='application/x-ndjson')
+
+
+def _binary_history(df: pd.DataFrame, requested_cols: set[str], resolution: Optional[int],
+                    derived_errors: dict[str, str]) -> Response:
+    """ The history response in the compact binary format of `app.seriescodec` """
+    cols = sorted(col for col in requested_cols if col in df.columns)
+    groups = {'sensors': {col: df[col].to_numpy(dtype=np.float64, na_value=np.nan) for col in cols}}
+    if resolution:
+        for stat in ('min', 'max'):
+            groups[f"sensors_{stat}"] = {
+                col: df[f"{col}_{stat}"].to_numpy(dtype=np.float64, na_value=np.nan)
+                for col in cols if f"{col}_{stat}" in df.columns
+            }
+    groups['relays'] = {
+        relay[len('relay_'):]: df[relay].to_numpy(dtype=bool) for relay in RELAY_COLUMNS if relay in df.columns
+    }
+    if resolution:
+        groups['relays_on_fraction'] = {
+            relay[len('relay_'):]: df[f"{relay}_frac"].to_numpy(dtype=np.float64)
+            for relay in RELAY_COLUMNS if f"{relay}_frac" in df.columns
+        }
+    payload = seriescodec.encode(epoch_milliseconds(df.index.values), groups, {
+        'sensor_names': {s.name: s.readable_name for s in SensorId},
+        'resolution': resolution,
+        'derived_errors': derived_errors,
+    })
+    return Response(payload, mimetype=seriescodec.MIMETYPE)
+
+
+def _local_time(value: Optional[str]) -> Optional[datetime]:
+    """ An ISO timestamp argument as naive local time for DB comparison (None if missing or invalid) """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(Config.TIMEZONE).replace(tzinfo=None)
+    except ValueError:
+        return None
 
 
 @bp.route('/history', methods=['GET'])
@@ -417,94 +531,77 @@ def get_history():
     sensors_str = request.args.get('sensors') # comma separated
     derived_defs_str = request.args.get('derived_defs') # JSON string
     downsample_factor = request.args.get('downsample_factor', type=int, default=1)
+    max_points = request.args.get('max_points', type=int)
 
-    query = Measurement.query
+    start_local = _local_time(start_str)
+    end_local = _local_time(end_str)
 
-    if start_str:
-        try:
-            start_utc = datetime.fromisoformat(start_str.replace('Z', '+00:00'))
-            # Convert to local time and make naive for DB comparison
-            start_local = start_utc.astimezone(Config.TIMEZONE).replace(tzinfo=None)
-            query = query.filter(Measurement.timestamp >= start_local)
-        except ValueError:
-            pass
-            
-    if end_str:
-        try:
-            end_utc = datetime.fromisoformat(end_str.replace('Z', '+00:00'))
-            # Convert to local time and make naive for DB comparison
-            end_local = end_utc.astimezone(Config.TIMEZONE).replace(tzinfo=None)
-            query = query.filter(Measurement.timestamp <= end_local)
-        except ValueError:
-            pass
+    # Streaming export: every row in the range, page by page
+    output_format = request.args.get('format', 'json')  # json, binary, ndjson or csv
+    if output_format in ('ndjson', 'csv'):
+        return _stream_history(output_format, start_local, end_local, sensors_str)
 
     # Limit results to prevent overload if no range specified
     if not start_str and not end_str:
-        query = query.filter(Measurement.timestamp >= datetime.now() - timedelta(hours=24))
-
-    query = query.order_by(Measurement.timestamp.asc())
-    results = query.all()
-
-    if not results:
-        return jsonify({'timestamps': [], 'sensors': {}, 'relays': {}, 'sensor_names': {s.name: s.readable_name for s in SensorId}})
-
-    # Convert to DataFrame
-    data = []
-    for m in results:
-        row = {
-            'timestamp': m.timestamp,
-            'relay_inside_1': m.relay_inside_1,
-            'relay_outside_1': m.relay_outside_1,
-            'relay_inside_2': m.relay_inside_2,
-            'relay_outside_2': m.relay_outside_2,
-        }
-        for s in SensorId:
-            col = f"{s.name}_cal"
-            row[s.name] = getattr(m, col, None)
-        data.append(row)
-        
-    df = pd.DataFrame(data)
-    df.set_index('timestamp', inplace=True)
+        now = datetime.now(Config.TIMEZONE).replace(tzinfo=None)
+        start_local = now - timedelta(seconds=now.timestamp() % DEFAULT_WINDOW_STEP_SECONDS) - DEFAULT_HISTORY_WINDOW
 
-    # Apply derived columns
+    # Derived series, each expression compiled once and cached by its text
+    derived, derived_errors, derived_key = {}, {}, ()
     if derived_defs_str:
-        import json
         try:
-            derived_defs = json.loads(derived_defs_str)
-            
-            # Safe evaluation environment
-            def integrate(series): return series.cumsum()
-            def differentiate(series): return series.diff()
-            
-            safe_locals = {
-                'integrate': integrate,
-                'differentiate': differentiate,
-                'diff': differentiate,
-                'np': np,
-                'pd': pd,
-            }
-            # Add numpy math functions
-            for name in ['sin', 'cos', 'tan', 'sqrt', 'abs', 'log', 'exp', 'power']:
-                safe_locals[name] = getattr(np, name)
-                
-            # Add columns to locals
-            for col in df.columns:
-                safe_locals[col] = df[col]
-                
-            for definition in derived_defs:
-                name = definition.get('name')
-                expr = definition.get('expr')
-                if name and expr:
-                    try:
-                        # Update locals with current df columns (in case one derived col depends on another)
-                        for col in df.columns:
-                            safe_locals[col] = df[col]
-                            
-                        df[name] = eval(expr, {"__builtins__": {}}, safe_locals)
-                    except Exception as e:
-                        logger.warning(f"Failed to derive {name}: {e}")
-        except Exception as e:
-            logger.error(f"Derived columns error: {e}")
+            definitions = json.loads(derived_defs_str)
+            derived, derived_errors = parse_derived(definitions)
+        except (ValueError, TypeError, AttributeError):
+            return jsonify({'error': 'Invalid derived_defs'}), 400
+        derived_key = tuple(sorted((d.get('name') or '', d.get('expr') or '') for d in definitions))
+
+    # Identical requests are answered from the cache until new or rewritten rows fall in their range
+    if end_local is not None and end_local >= datetime.now(Config.TIMEZONE).replace(tzinfo=None):
+        end_local = None  # Up to now, whatever the client's clock said
+    cache_key = (
+        start_local, end_local, tuple(sorted(sensors_str.split(','))) if sensors_str else None,
+        derived_key, request.args.get('filter_state'), request.args.get('resolution'),
+        request.args.get('points'), downsample_factor, max_points, output_format
+    )
+    cached = HistoryCache.get(cache_key)
+    if cached is not None:
+        return Response(cached.body, mimetype=cached.mimetype)
+    generation = HistoryCache.generation()
+
+    @after_this_request
+    def cache_response(response):
+        if response.status_code == 200:
+            HistoryCache.put(cache_key, CachedResponse(response.get_data(), response.mimetype, start_local, end_local), generation)
+        return response
+
+    # Long ranges are served from the rollups instead of every raw row, unless a derived
+    # expression depends on the sample spacing
+    resolution = None
+    needs_raw = any(expr.uses_spacing for expr in derived.values())
+    if request.args.get('resolution') != 'raw' and start_local is not None and not needs_raw:
+        points = request.args.get('points', type=int, default=DynConfig.history_target_points)
+        end = end_local or datetime.now(Config.TIMEZONE).replace(tzinfo=None)
+        resolution = Rollups.pick_resolution(start_local, end, points)
+
+    if resolution:
+        df = Rollups.history_frame(resolution, start_local, end_local)
+    else:
+        # Only load what was asked for and what the derived series read
+        requested = None
+        if sensors_str:
+            requested = set(sensors_str.split(',')).union(*(expr.names for expr in derived.values()))
+        df = _raw_history_frame(start_local, end_local,
+                                [s.name for s in SensorId if requested is None or s.name in requested])
+
+    if df.empty:
+        if output_format == 'binary':
+            return _binary_history(df, set(), resolution, derived_errors)
+        return jsonify({'timestamps': [], 'sensors': {}, 'relays': {}, 'sensor_names': {s.name: s.readable_name for s in SensorId},
+                        'derived_errors': derived_errors})
+
+    # Add the derived series
+    derived_errors.update(evaluate_derived(df, derived))
 
     # Filter by state
     filter_state = request.args.get('filter_state')
@@ -518,32 +615,41 @@ def get_history():
         elif filter_state == 'c2_off':
             df = df[~(df['relay_inside_2'] & df['relay_outside_2'])]
 
+    # Determine which columns to return
+    requested_cols = set(sensors_str.split(',')) if sensors_str else set([s.name for s in SensorId])
+    
+    # Also include any derived columns that were successfully created
+    requested_cols.update(name for name in derived if name in df.columns)
+
     # Downsample
     if downsample_factor > 1:
         df = df.iloc[::downsample_factor]
+    if max_points and max_points > 0:
+        # At most max_points rows in all, keeping the peaks of every series and the relay switches
+        series = sorted(col for col in requested_cols if col in df.columns)
+        df = df.iloc[downsample_indices(df, series, RELAY_COLUMNS, max_points)]
+
+    if output_format == 'binary':
+        return _binary_history(df, requested_cols, resolution, derived_errors)
 
     # Convert timestamps to aware ISO strings
-    timestamps = [ts.replace(tzinfo=Config.TIMEZONE).isoformat() for ts in df.index]
+    timestamps = iso_timestamps(df.index.values)
 
     # Prepare response data
     resp_sensors = {}
-    
-    # Determine which columns to return
-    requested_cols = set(sensors_str.split(',')) if sensors_str else set([s.name for s in SensorId])
-    
-    # Also include any derived columns that were successfully created
-    if derived_defs_str:
-        try:
-            derived_defs = json.loads(derived_defs_str)
-            for d in derived_defs:
-                if d['name'] in df.columns:
-                    requested_cols.add(d['name'])
-        except: pass
 
     for col in requested_cols:
         if col in df.columns:
             # Replace NaN with None for JSON compatibility
-            resp_sensors[col] = df[col].where(pd.notnull(df[col]), None).tolist()
+            resp_sensors[col] = df[col].astype(object).where(pd.notnull(df[col]), None).tolist()
+
+    # Rollups also carry the spread within each bucket
+    resp_min, resp_max = {}, {}
+    if resolution:
+        for col in requested_cols:
+            if f"{col}_min" in df.columns:
+                resp_min[col] = df[f"{col}_min"].astype(object).where(pd.notnull(df[f"{col}_min"]), None).tolist()
+                resp_max[col] = df[f"{col}_max"].astype(object).where(pd.notnull(df[f"{col}_max"]), None).tolist()
             
     resp_relays = {
         'inside_1': df['relay_inside_1'].tolist(),
@@ -551,12 +657,42 @@ def get_history():
         'inside_2': df['relay_inside_2'].tolist(),
         'outside_2': df['relay_outside_2'].tolist(),
     }
+    # ...and how much of each bucket the relays were on, which the majority vote above hides
+    resp_relay_fractions = {}
+    if resolution:
+        resp_relay_fractions = {
+            relay[len('relay_'):]: df[f"{relay}_frac"].tolist() for relay in RELAY_COLUMNS if f"{relay}_frac" in df.columns
+        }
 
     return jsonify({
         'timestamps': timestamps,
         'sensors': resp_sensors,
         'relays': resp_relays,
-        'sensor_names': {s.name: s.readable_name for s in SensorId}
+        'sensor_names': {s.name: s.readable_name for s in SensorId},
+        'resolution': resolution,
+        'sensors_min': resp_min,
+        'sensors_max': resp_max,
+        'relays_on_fraction': resp_relay_fractions,
+        'derived_errors': derived_errors
+    })
+
+@bp.route('/host_history', methods=['GET'])
+@login_required
+def get_host_history():
+    """ Get the host health samples in a time range (the last 24 hours by default) """
+    start_local = _local_time(request.args.get('start'))
+    end_local = _local_time(request.args.get('end'))
+    if start_local is None and end_local is None:
+        start_local = datetime.now(Config.TIMEZONE).replace(tzinfo=None) - timedelta(hours=24)
+
+    timestamps, metrics = HostHealth.history(start_local, end_local)
+    requested = request.args.get('metrics')  # comma separated
+    if requested:
+        metrics = {name: values for name, values in metrics.items() if name in requested.split(',')}
+    return jsonify({
+        'timestamps': iso_timestamps(np.array(timestamps, dtype='datetime64[ms]')),
+        'metrics': metrics,
+        'metric_names': {m.name: m.readable_name for m in HostMetricId}
     })
 
 @bp.route('/maintenance/downsample_db', methods=['POST'])
@@ -570,31 +706,25 @@ def downsample_db():
         return jsonify({'success': False, 'message': 'Factor must be > 1'})
         
     try:
-        # Construct SQL based on DB type
-        if 'sqlite' in Config.SQLALCHEMY_DATABASE_URI:
-             sql = f"""
-             DELETE FROM measurement 
-             WHERE id IN (
-                 SELECT id FROM (
-                     SELECT id, ROW_NUMBER() OVER (ORDER BY timestamp) as rn 
-                     FROM measurement
-                 ) 
-                 WHERE rn % {factor} != 0
-             )
-             """
-        else:
-             # Assume MySQL/MariaDB
-             sql = f"""
-             DELETE m FROM measurement m 
-             JOIN (
-                 SELECT id, ROW_NUMBER() OVER (ORDER BY timestamp) as rn 
-                 FROM measurement
-             ) t ON m.id = t.id 
-             WHERE t.rn % {factor} != 0
-             """
-             
-        db.session.execute(db.text(sql))
-        db.session.commit()
+        # Pick the doomed rows on a read-only connection, then delete them in short transactions
+        # so the measurement writer's commits can interleave instead of waiting for one huge DELETE
+        with DBPools.reading() as session:
+            ids = session.scalars(db.text("""
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (ORDER BY timestamp) AS rn
+                    FROM measurement
+                ) numbered
+                WHERE rn % :factor != 0
+            """), {'factor': factor}).all()
+            oldest = session.scalar(select(func.min(Measurement.timestamp)))
+            newest = session.scalar(select(func.max(Measurement.timestamp)))
+        for i in range(0, len(ids), MAINTENANCE_DELETE_ROWS):
+            with DBPools.writing() as session:
+                session.execute(delete(Measurement).where(Measurement.id.in_(ids[i:i + MAINTENANCE_DELETE_ROWS])))
+                session.commit()
+        HistoryCache.invalidate(oldest, None)
+        if ids:
+            Rollups.rebuild(oldest, newest)  # The rollups still count the deleted rows
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Database downsample failed: {e}")
@@ -604,7 +734,11 @@ def downsample_db():
 @login_required
 def reset_arduino():
     try:
-        ArduinoInterface().reset_arduino()
+        if HardwareWorker.running():
+            # The worker owns the bus; the reset takes a few seconds
+            HardwareWorker.call(('interface', 'arduino'), 'reset_arduino', timeout=30.0)
+        else:
+            ArduinoInterface().reset_arduino()
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Arduino reset failed: {e}")
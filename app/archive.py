@@ -0,0 +1,292 @@
+""" Columnar archive of old measurements
+
+Closed months of `Measurement` rows are moved out of the database into one partition directory
+per month under `Config.ARCHIVE_DIR`. A partition holds one .npy file per column:
+
+- `id`: the original measurement ids (int64), so re-archiving a month never duplicates rows
+- `t`: milliseconds since the partition's base time (uint32, sorted); the base is in meta.json
+- `<sensor>_raw` / `<sensor>_cal`: float32, NaN where the value was missing
+- `relays`: the four relay states packed into the bits of a uint8
+
+The files are deliberately left uncompressed so they can be memory-mapped: a query only pages
+in the slice of each column it needs (found by binary search on `t`), and partitions cost no
+memory while unused. Against a SQLite row of 8-byte floats plus row and index overhead, the
+narrow types alone make a partition several times smaller.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Any
+import numpy as np
+import pandas as pd
+from loguru import logger
+from sqlalchemy import select, delete, func
+
+from app import db
+from app.config import Config
+from app.dbpools import DBPools
+from app.models import Measurement
+from app.hardware_constants import SensorId
+from app.dynconfig import DynConfig
+from app.historycache import HistoryCache
+
+SWAP_RETRIES = 5  # Attempts to open a partition that is being swapped for its rewritten copy
+SENSOR_COLUMNS = [f"{s.value}_{kind}" for s in SensorId for kind in ("raw", "cal")]
+RELAY_COLUMNS = ['relay_inside_1', 'relay_inside_2', 'relay_outside_1', 'relay_outside_2']
+
+
+def _month_start(ts: datetime) -> datetime:
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(month: datetime) -> datetime:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+class Archive:
+    """ Moves closed months of measurements into memory-mapped columnar partitions """
+
+    _lock = threading.Lock()  # Serializes archiving runs
+    _mmaps: dict[str, dict[str, np.ndarray]] = {}  # Open partitions by name, replaced on rewrite
+
+    @staticmethod
+    def _dir() -> str:
+        return Config.ARCHIVE_DIR
+
+    @classmethod
+    def recover(cls):
+        """ Finishes or discards partition rewrites interrupted by a crash. Run once at startup. """
+        if not os.path.isdir(cls._dir()):
+            return
+        with cls._lock:
+            for name in os.listdir(cls._dir()):
+                path = os.path.join(cls._dir(), name)
+                if name.endswith('.old'):
+                    if os.path.exists(path[:-4]):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.replace(path, path[:-4])  # Stopped between moving it aside and swapping in the new copy
+                elif name.endswith('.tmp'):
+                    shutil.rmtree(path, ignore_errors=True)
+
+    @classmethod
+    def partitions(cls) -> list[str]:
+        """ Names (YYYY-MM) of the archived months, oldest first """
+        if not os.path.isdir(cls._dir()):
+            return []
+        return sorted(
+            name for name in os.listdir(cls._dir())
+            if len(name) == 7 and os.path.isfile(os.path.join(cls._dir(), name, 'meta.json'))
+        )
+
+    @classmethod
+    def _open(cls, name: str) -> Optional[dict[str, np.ndarray]]:
+        """ Memory-maps every column of a partition. None if it has gone missing (e.g. it was
+        deleted), after briefly waiting out a rewrite that is swapping it for its new copy. """
+        part = cls._mmaps.get(name)
+        if part is not None:
+            return part
+        path = os.path.join(cls._dir(), name)
+        for attempt in range(SWAP_RETRIES):
+            try:
+                with open(os.path.join(path, 'meta.json')) as f:
+                    meta = json.load(f)
+                part = {
+                    col: np.load(os.path.join(path, f"{col}.npy"), mmap_mode='r')
+                    for col in ['id', 't', 'relays'] + SENSOR_COLUMNS
+                }
+            except FileNotFoundError:
+                time.sleep(0.01 * (attempt + 1))
+                continue
+            part['base'] = np.datetime64(meta['base'], 'ms')
+            cls._mmaps = {**cls._mmaps, name: part}
+            return part
+        logger.warning(f"Archive partition {name} disappeared while being read")
+        return None
+
+    @classmethod
+    def _write_partition(cls, name: str, base: datetime, columns: dict[str, np.ndarray]):
+        """ Writes a partition next to the live one, then swaps it in """
+        path = os.path.join(cls._dir(), name)
+        tmp, old = path + '.tmp', path + '.old'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for col, values in columns.items():
+            np.save(os.path.join(tmp, f"{col}.npy"), values)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'base': base.isoformat(), 'rows': len(columns['id'])}, f)
+
+        cls._mmaps = {k: v for k, v in cls._mmaps.items() if k != name}
+        if os.path.exists(path):
+            shutil.rmtree(old, ignore_errors=True)
+            os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def archive_month(cls, month: datetime) -> int:
+        """ Moves the measurements of the month starting at `month` (naive, local time) into its
+        partition, merging with any rows archived earlier. Returns the number of rows moved. """
+        end = _next_month(month)
+        table = Measurement.__table__
+        with DBPools.reading() as session:
+            rows = session.execute(
+                select(table.c.id, table.c.timestamp, *[table.c[c] for c in RELAY_COLUMNS + SENSOR_COLUMNS])
+                .where(table.c.timestamp >= month, table.c.timestamp < end)
+                .order_by(table.c.id)
+            ).all()
+        if not rows:
+            return 0
+
+        n_relays = len(RELAY_COLUMNS)
+        data = list(zip(*rows))
+        timestamps = np.array(data[1], dtype='datetime64[ms]')
+        relays = np.zeros(len(rows), dtype=np.uint8)
+        for bit, states in enumerate(data[2:2 + n_relays]):
+            relays |= (np.array([bool(s) for s in states], dtype=np.uint8) << bit).astype(np.uint8)
+        new = {
+            'id': np.array(data[0], dtype=np.int64),
+            't': (timestamps - np.datetime64(month, 'ms')).astype(np.uint32),
+            'relays': relays,
+        }
+        for col, values in zip(SENSOR_COLUMNS, data[2 + n_relays:]):
+            new[col] = np.array([np.nan if v is None else v for v in values], dtype=np.float32)
+
+        name = month.strftime('%Y-%m')
+        if name in cls.partitions():
+            existing = cls._open(name)
+            new = {col: np.concatenate((np.asarray(existing[col]), values)) for col, values in new.items()}
+        _, unique = np.unique(new['id'], return_index=True)
+        order = unique[np.argsort(new['t'][unique], kind='stable')]
+        cls._write_partition(name, month, {col: values[order] for col, values in new.items()})
+
+        # Only now that the partition is safely on disk, drop the rows from the live table, on the
+        # writer connection and in short transactions so queued measurements can be written in between
+        ids = list(data[0])
+        for i in range(0, len(ids), 500):
+            with DBPools.writing() as session:
+                session.execute(delete(table).where(table.c.id.in_(ids[i:i + 500])))
+                session.commit()
+        HistoryCache.invalidate(month, end)  # The archive keeps values as float32
+        logger.info(f"Archived {len(rows)} measurement(s) from {name}")
+        return len(rows)
+
+    @classmethod
+    def archive_closed_months(cls) -> int:
+        """ Archives every month that ended more than `archive_after_days` ago. Requires an app context. """
+        days = DynConfig.archive_after_days
+        if not days:
+            return 0
+        with cls._lock:
+            oldest = db.session.scalar(select(func.min(Measurement.timestamp)))
+            if oldest is None:
+                return 0
+            cutoff = datetime.now(Config.TIMEZONE).replace(tzinfo=None) - timedelta(days=days)
+            moved = 0
+            month = _month_start(oldest)
+            while _next_month(month) <= cutoff:
+                moved += cls.archive_month(month)
+                month = _next_month(month)
+            return moved
+
+    @staticmethod
+    def _slice(part: dict[str, np.ndarray], lo: int, hi: int, columns: list[str]) -> dict[str, np.ndarray]:
+        """ Rows [lo, hi) of an open partition: 'timestamp' plus `columns` (which may include 'id') """
+        out = {'timestamp': part['base'] + part['t'][lo:hi].astype('timedelta64[ms]')}
+        for col in columns:
+            if col in RELAY_COLUMNS:
+                bit = RELAY_COLUMNS.index(col)
+                out[col] = ((part['relays'][lo:hi] >> bit) & 1).astype(bool)
+            elif col == 'id':
+                out[col] = np.asarray(part['id'][lo:hi])
+            else:
+                out[col] = np.asarray(part[col][lo:hi], dtype=np.float64)
+        return out
+
+    @classmethod
+    def _bounds(cls, name: str, start: Optional[datetime], end: Optional[datetime]) -> Optional[tuple[dict, int, int]]:
+        """ The open partition `name` and the range [lo, hi) of its rows within [start, end],
+        or None if the month lies outside the range (or the partition has gone) """
+        month = datetime.strptime(name, '%Y-%m')
+        if (end is not None and month > end) or (start is not None and _next_month(month) <= start):
+            return None
+        part = cls._open(name)
+        if part is None:
+            return None
+        t = part['t']
+        lo = 0 if start is None else np.searchsorted(t, max(0, (np.datetime64(start, 'ms') - part['base']).astype(np.int64)), 'left')
+        hi = len(t) if end is None else np.searchsorted(t, (np.datetime64(end, 'ms') - part['base']).astype(np.int64), 'right')
+        return part, int(lo), int(hi)
+
+    @classmethod
+    def read(cls, start: Optional[datetime], end: Optional[datetime],
+             columns: Optional[list[str]] = None) -> dict[str, np.ndarray]:
+        """ Archived measurements with start <= timestamp <= end (naive, local time), oldest first.
+        Returns 'timestamp' (datetime64[ms]) plus the requested sensor/relay columns. """
+        columns = columns if columns is not None else SENSOR_COLUMNS + RELAY_COLUMNS
+        chunks: dict[str, list[np.ndarray]] = {col: [] for col in ['timestamp'] + columns}
+        for name in cls.partitions():
+            bounds = cls._bounds(name, start, end)
+            if bounds is None or bounds[2] <= bounds[1]:
+                continue
+            for col, values in cls._slice(*bounds, columns).items():
+                chunks[col].append(values)
+
+        empty = {'timestamp': np.array([], dtype='datetime64[ms]'), 'id': np.array([], dtype=np.int64)}
+        return {
+            col: np.concatenate(parts) if parts else empty.get(col, np.array([], dtype=np.float64))
+            for col, parts in chunks.items()
+        }
+
+    @classmethod
+    def iter_chunks(cls, start: Optional[datetime], end: Optional[datetime], columns: list[str],
+                    after: Optional[tuple[datetime, int]] = None, size: int = 5000):
+        """ Like `read`, but yields the rows in chunks of at most `size`, each with an 'id' column,
+        so memory use doesn't grow with the range. With `after` = (timestamp, id), only rows
+        following that position in (timestamp, id) order are returned. """
+        columns = list(columns) + ([] if 'id' in columns else ['id'])
+        for name in cls.partitions():
+            bounds = cls._bounds(name, start, end)
+            if bounds is None:
+                continue
+            part, lo, hi = bounds
+            if after is not None:
+                t, after_t = part['t'], (np.datetime64(after[0], 'ms') - part['base']).astype(np.int64)
+                if after_t >= 0:
+                    # Within equal timestamps the rows are in id order
+                    first, last = np.searchsorted(t, after_t, 'left'), np.searchsorted(t, after_t, 'right')
+                    lo = max(lo, int(first + np.searchsorted(part['id'][first:last], after[1], 'right')))
+            for chunk_lo in range(lo, hi, size):
+                yield cls._slice(part, chunk_lo, min(chunk_lo + size, hi), columns)
+
+    @classmethod
+    def history_frame(cls, start: Optional[datetime], end: Optional[datetime]) -> pd.DataFrame:
+        """ Archived measurements shaped like /api/history's frame: calibrated values by sensor
+        name and the relay columns, indexed by timestamp """
+        data = cls.read(start, end, [f"{s.value}_cal" for s in SensorId] + RELAY_COLUMNS)
+        df = pd.DataFrame({
+            **{col: data[col] for col in RELAY_COLUMNS},
+            **{s.name: data[f"{s.value}_cal"] for s in SensorId},
+        }, index=pd.DatetimeIndex(data['timestamp'].astype('datetime64[ns]'), name='timestamp'))
+        return df
+
+    @classmethod
+    def stats(cls) -> dict[str, Any]:
+        parts = cls.partitions()
+        size = 0
+        rows = 0
+        for name in parts:
+            part = cls._open(name)
+            if part is None:
+                continue
+            path = os.path.join(cls._dir(), name)
+            try:
+                size += sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            except OSError:
+                pass  # Being swapped for its rewritten copy
+            rows += len(part['t'])
+        return {'partitions': parts, 'rows': rows, 'bytes': size}
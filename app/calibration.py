@@ -5,6 +5,10 @@ from app.models import CalibrationPoint
 from functools import cached_property
 from typing import Dict, List, Optional
 import datetime
+import threading
+import time
+from bisect import bisect_left
+import numpy as np
 from app.hardware_constants import SensorId
 from app.config import Config
 from dataclasses import dataclass
@@ -15,42 +19,111 @@ class CalPoint:
     measured_val: float
     actual_val: float
 
+class CompiledCalibration:
+    """
+    A sensor's calibration points compiled into contiguous sorted arrays.
+    Immutable once built, so it can be shared between threads without locking.
+    """
+    def __init__(self, points: List[CalPoint], version: int = 0):
+        self.points = points
+        self.version = version
+        self.measured = np.array([p.measured_val for p in points], dtype=np.float64)
+        self.actual = np.array([p.actual_val for p in points], dtype=np.float64)
+
+        # Slope of each segment [i, i+1]. Zero-width segments (duplicate measured values)
+        # get a slope of 0 so they evaluate to their lower point's actual value.
+        rise = np.diff(self.actual)
+        run = np.diff(self.measured)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.slopes = np.where(run != 0, rise / np.where(run != 0, run, 1), 0.0)
+
+        # Plain lists for the scalar path; bisect on a list beats NumPy's per-call overhead
+        self._measured_list = self.measured.tolist()
+        self._actual_list = self.actual.tolist()
+        self._slopes_list = self.slopes.tolist()
+
+    def __len__(self):
+        return len(self.points)
+
+    def apply(self, value):
+        """ Runs a scalar or an array through the interpolated cal table.
+        Values outside the table are linearly extrapolated from the first/last segment. """
+        n = len(self.points)
+        # If there aren't even enough points to form a single line, don't bother
+        # with the calibration at all:
+        if n < 2:
+            return value if np.isscalar(value) else np.asarray(value, dtype=np.float64)
+
+        if np.isscalar(value):
+            # Segment whose upper point is the first one at or above `value`
+            right = min(max(bisect_left(self._measured_list, value), 1), n - 1)
+            left = right - 1
+            return self._slopes_list[left] * (value - self._measured_list[left]) + self._actual_list[left]
+
+        values = np.asarray(value, dtype=np.float64)
+        left = np.clip(np.searchsorted(self.measured, values, side='left'), 1, n - 1) - 1
+        return self.slopes[left] * (values - self.measured[left]) + self.actual[left]
+
+
 class CalibrationRegistry:
     """
-    Singleton-like registry that holds cached calibration tables.
+    Singleton-like registry that holds compiled calibration tables.
+    The tables dict is only ever replaced as a whole, so readers never need the lock.
     """
-    _cache: Dict[SensorId, List[CalPoint]] = {}
+    _tables: Dict[SensorId, CompiledCalibration] = {}
+    _versions: Dict[SensorId, int] = {}  # Bumped on every invalidation
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_table(cls, sensor: SensorId) -> CompiledCalibration:
+        """
+        Returns the compiled table. If not in cache, compiles it from the DB.
+        """
+        table = cls._tables.get(sensor)
+        if table is not None:
+            return table
+
+        with cls._lock:
+            # Another thread may have compiled it while we waited
+            table = cls._tables.get(sensor)
+            if table is None:
+                version = cls._versions.get(sensor, 0)
+                db_points = CalibrationPoint.query\
+                    .filter_by(sensor_id=sensor.value)\
+                    .order_by(CalibrationPoint.measured_val)\
+                    .all()
+
+                # Convert to detached dataclasses to avoid DetachedInstanceError
+                table = CompiledCalibration([
+                    CalPoint(id=p.id, measured_val=p.measured_val, actual_val=p.actual_val)
+                    for p in db_points
+                ], version)
+                # An invalidation that raced with the query leaves the table uncached
+                if cls._versions.get(sensor, 0) == version:
+                    cls._tables = {**cls._tables, sensor: table}
+            return table
 
     @classmethod
     def get_points(cls, sensor: SensorId) -> List[CalPoint]:
         """
         Returns cached points. If not in cache, fetches from DB.
         """
-        if sensor not in cls._cache:
-            # print(f"Cache miss for {sensor.name}, fetching from DB...")
-            db_points = CalibrationPoint.query\
-                .filter_by(sensor_id=sensor.value)\
-                .order_by(CalibrationPoint.measured_val)\
-                .all()
-            
-            # Convert to detached dataclasses to avoid DetachedInstanceError
-            cls._cache[sensor] = [
-                CalPoint(id=p.id, measured_val=p.measured_val, actual_val=p.actual_val)
-                for p in db_points
-            ]
-            
-        return cls._cache[sensor]
+        return cls.get_table(sensor).points
+
+    @classmethod
+    def version(cls, sensor: SensorId) -> int:
+        """ Increases every time the sensor's calibration is invalidated """
+        return cls._versions.get(sensor, 0)
 
     @classmethod
     def invalidate(cls, sensor: Optional[SensorId] = None):
         """
         Clears the cache. Call this when the user updates calibration settings.
         """
-        if sensor:
-            if sensor in cls._cache:
-                del cls._cache[sensor]
-        else:
-            cls._cache.clear()
+        with cls._lock:
+            sensors = [sensor] if sensor else list(SensorId)
+            cls._versions = {**cls._versions, **{s: cls._versions.get(s, 0) + 1 for s in sensors}}
+            cls._tables = {s: t for s, t in cls._tables.items() if s not in sensors}
 
 class CalTable:
     """
@@ -63,47 +136,21 @@ class CalTable:
     def points(self) -> List[CalPoint]:
         return CalibrationRegistry.get_points(self.sensor)
 
-    def apply_cal(self, value: float) -> float:
-        """ Runs the given value through the interpolated cal table """
-        points = self.points
-
-        # If there aren't even enough points to form a single line, don't bother
-        # with the calibration at all:
-        if len(points) < 2:
-            return value
-
-        # Otherwise, find the two nearest points that bound this point:
-        # Perform a binary search (it's already ordered) to find the two
-        # datapoints that bound `value`
-        left, right = 0, len(points) - 1
-        while right - left > 1:
-            mid = (left + right) // 2
-            if points[mid].measured_val < value:
-                left = mid
-            else:
-                right = mid
-        lower_point = points[left]
-        upper_point = points[right]
-
-        # Now, interpolate along a straight line between `lower_point` and
-        # `upper_point`.
-        denom = (upper_point.measured_val - lower_point.measured_val)
-        if denom == 0:  # Avoid division by zero
-            # (theoretically very unlikely to have multiple points within
-            # float precision, but just to be safe)
-            return lower_point.actual_val
-            
-        slope = (upper_point.actual_val - lower_point.actual_val) / denom
-        return slope * (value - lower_point.measured_val) + lower_point.actual_val
+    def apply_cal(self, value):
+        """ Runs the given value (a float or a NumPy array) through the interpolated cal table """
+        return CalibrationRegistry.get_table(self.sensor).apply(value)
 
 
 class SensorReading:
     """
     A raw value and a cal'd value, based on a calibration table
     """
-    def __init__(self, measured_val: float, sensor_id: SensorId, timestamp: datetime.datetime | None = None):
+    def __init__(self, measured_val: float, sensor_id: SensorId, timestamp: datetime.datetime | None = None,
+                 monotonic: float | None = None):
         self.meas = measured_val
         self.sensor_id = sensor_id
+        # time.monotonic() when the value was acquired; unlike the timestamp, safe for measuring intervals
+        self.monotonic = time.monotonic() if monotonic is None else monotonic
         if timestamp is None:
             self.timestamp = datetime.datetime.now(Config.TIMEZONE)
         else:
@@ -112,7 +159,7 @@ class SensorReading:
     @cached_property
     def cald(self) -> float:
         """ The calibrated value """
-        return CalTable(self.sensor_id).apply_cal(self.meas)
+        return CalibrationRegistry.get_table(self.sensor_id).apply(self.meas)
     
     @cached_property
     def raw(self) -> float:
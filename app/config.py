@@ -14,6 +14,9 @@ class Config:
     # Paths
     # Allow overriding paths for database and logs (e.g. for external storage)
     DB_FILE_PATH = os.environ.get('DB_FILE_PATH') or os.path.join(os.path.abspath(os.path.dirname(__file__)), 'app.db')
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or os.path.join(os.path.dirname(DB_FILE_PATH), 'archive')
+    # Local copy of the dynamic configuration, so the system can start without the database
+    CONFIG_SNAPSHOT_PATH = os.environ.get('CONFIG_SNAPSHOT_PATH') or os.path.join(os.path.dirname(DB_FILE_PATH), 'config_snapshot.json')
     LOG_FILE_PATH = os.environ.get('LOG_FILE_PATH') or os.path.join(os.path.abspath(os.path.dirname(__file__)), 'app.log')
 
     # Database configuration
@@ -28,6 +31,7 @@ class Config:
     WATCDOG_PERIOD_SEC = 90
 
     SUMMARY_RUN_HOUR = 22
+    ARCHIVE_RUN_HOUR = 3
 
     COMMIT_SHA = _commit_sha
 
@@ -0,0 +1,150 @@
+""" Separate database connections for the acquisition writes and the web's reads
+
+Measurements are written over a dedicated single-connection writer pool, while history
+queries and other analytics go through a pool of read-only connections (`PRAGMA query_only`
+on SQLite, read-only transactions on MySQL). A long grapher query can then neither take the
+connection the measurement writer needs nor hold anything the writer has to wait for: on a
+SQLite database in WAL mode, a reader only works from its own snapshot of the file.
+
+Both pools are created on first use from the app's database URI. An in-memory SQLite database
+exists only on the app's own connection, so there both pools fall back to the app's session.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+from flask import current_app
+from sqlalchemy import create_engine, event, Engine
+from sqlalchemy.orm import Session
+
+from app import db
+from app.dynconfig import DynConfig
+
+SQLITE_BUSY_TIMEOUT_SECONDS = 30
+
+
+class _PoolMetrics:
+    """ Checkout and statement counters of one engine, kept by its event hooks """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.checkouts = 0
+        self.in_use = 0
+        self.statements = 0
+        self.statement_seconds = 0.0
+        self.max_statement_seconds = 0.0
+        self._lock = threading.Lock()
+        event.listen(engine, 'checkout', self._checkout)
+        event.listen(engine, 'checkin', self._checkin)
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+
+    def _checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.in_use -= 1
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_start'] = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info.pop('query_start', time.perf_counter())
+        with self._lock:
+            self.statements += 1
+            self.statement_seconds += duration
+            self.max_statement_seconds = max(self.max_statement_seconds, duration)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'size': self.engine.pool.size(),
+            'in_use': self.in_use,
+            'checkouts': self.checkouts,
+            'statements': self.statements,
+            'mean_statement_ms': 1000 * self.statement_seconds / self.statements if self.statements else None,
+            'max_statement_ms': 1000 * self.max_statement_seconds,
+        }
+
+
+def _sqlite_pragmas(*pragmas: str):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+    return on_connect
+
+
+def _mysql_read_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("SET SESSION TRANSACTION READ ONLY")
+    cursor.close()
+
+
+class DBPools:
+    """ The writer and reader connection pools """
+
+    _lock = threading.Lock()
+    _uri: str = None
+    _writer: _PoolMetrics = None
+    _reader: _PoolMetrics = None
+
+    @staticmethod
+    def _shared(uri: str) -> bool:
+        """ Whether the database only exists on the app's own connection """
+        return uri.startswith('sqlite') and (uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri)
+
+    @classmethod
+    def _engines(cls) -> tuple[_PoolMetrics, _PoolMetrics]:
+        uri = current_app.config['SQLALCHEMY_DATABASE_URI']
+        with cls._lock:
+            if cls._uri == uri:
+                return cls._writer, cls._reader
+            for pool in (cls._writer, cls._reader):
+                if pool is not None:
+                    pool.engine.dispose()
+
+            if uri.startswith('sqlite'):
+                connect_args = {'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_SECONDS}
+                writer = create_engine(uri, pool_size=1, max_overflow=0, connect_args=connect_args)
+                event.listen(writer, 'connect', _sqlite_pragmas("journal_mode=WAL", "synchronous=NORMAL"))
+                reader = create_engine(uri, pool_size=DynConfig.db_reader_pool_size, max_overflow=0, connect_args=connect_args)
+                event.listen(reader, 'connect', _sqlite_pragmas("query_only=ON"))
+            else:
+                writer = create_engine(uri, pool_size=1, max_overflow=0, pool_pre_ping=True)
+                reader = create_engine(uri, pool_size=DynConfig.db_reader_pool_size, max_overflow=0, pool_pre_ping=True)
+                event.listen(reader, 'connect', _mysql_read_only)
+            cls._uri, cls._writer, cls._reader = uri, _PoolMetrics(writer), _PoolMetrics(reader)
+            return cls._writer, cls._reader
+
+    @classmethod
+    @contextmanager
+    def writing(cls) -> Iterator[Session]:
+        """ A session on the writer connection; the caller commits. Requires an app context. """
+        if cls._shared(current_app.config['SQLALCHEMY_DATABASE_URI']):
+            yield db.session
+            return
+        with Session(cls._engines()[0].engine) as session:
+            yield session
+
+    @classmethod
+    @contextmanager
+    def reading(cls) -> Iterator[Session]:
+        """ A session on a read-only connection. Keep it short: on SQLite an open read
+        transaction holds back WAL checkpoints. Requires an app context. """
+        if cls._shared(current_app.config['SQLALCHEMY_DATABASE_URI']):
+            yield db.session
+            return
+        with Session(cls._engines()[1].engine) as session:
+            yield session
+
+    @classmethod
+    def stats(cls) -> dict[str, Any]:
+        return {
+            'writer': cls._writer.stats() if cls._writer else None,
+            'reader': cls._reader.stats() if cls._reader else None,
+        }
@@ -0,0 +1,159 @@
+""" Derived series for the grapher
+
+A derived series is a named expression over sensor columns and other derived series, e.g.
+`p1 = v1 * i1` or `e1 = integrate(p1) / 3600`. Each expression is parsed once into an AST that
+may only contain arithmetic, comparisons, numbers, column names and calls of whitelisted
+functions, compiled, and cached by its text, so repeated dashboard refreshes skip all of that.
+The series of a request are evaluated in dependency order and each failure is reported
+against the expression it belongs to.
+"""
+
+import ast
+import functools
+import graphlib
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any, Iterator
+import numpy as np
+import pandas as pd
+
+
+class DerivedExpressionError(ValueError):
+    pass
+
+
+def _integrate(series):
+    return series.cumsum()
+
+
+def _differentiate(series):
+    return series.diff()
+
+
+# Functions of the sample sequence rather than of each value, so they need the raw samples
+SPACING_FUNCTIONS = {'integrate': _integrate, 'differentiate': _differentiate, 'diff': _differentiate}
+NUMPY_FUNCTIONS = {'sin', 'cos', 'tan', 'sqrt', 'abs', 'log', 'exp', 'power', 'minimum', 'maximum', 'clip', 'where'}
+FUNCTIONS = {**SPACING_FUNCTIONS, **{name: getattr(np, name) for name in NUMPY_FUNCTIONS}}
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load, ast.Constant, ast.Attribute,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd,
+    ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq,
+)
+
+
+@dataclass(frozen=True)
+class CompiledExpression:
+    code: Any
+    names: frozenset[str]  # The columns / derived series it reads
+    uses_spacing: bool  # Calls a function such as integrate() that depends on the sample spacing
+
+
+def _function_name(node: ast.expr) -> str:
+    """ The whitelisted function a call refers to, as `f` or `np.f` """
+    if isinstance(node, ast.Name) and node.id in FUNCTIONS:
+        return node.id
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'np' \
+            and node.attr in NUMPY_FUNCTIONS:
+        return node.attr
+    raise DerivedExpressionError(f"Unsupported function '{ast.unparse(node)}'")
+
+
+@functools.lru_cache(maxsize=256)
+def compile_expression(expr: str) -> CompiledExpression:
+    """ Validates and compiles an expression. Raises DerivedExpressionError if it isn't allowed. """
+    try:
+        tree = ast.parse(expr.strip(), mode='eval')
+    except SyntaxError as e:
+        raise DerivedExpressionError(f"Syntax error: {e.msg}") from None
+
+    names, uses_spacing, callees = set(), False, set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise DerivedExpressionError(f"'{type(node).__name__}' is not allowed")
+        if isinstance(node, ast.Call):
+            if node.keywords:
+                raise DerivedExpressionError("Keyword arguments are not allowed")
+            uses_spacing |= _function_name(node.func) in SPACING_FUNCTIONS
+            callees.add(id(node.func))
+            if isinstance(node.func, ast.Attribute):
+                callees.add(id(node.func.value))
+        elif isinstance(node, ast.Attribute) and id(node) not in callees:
+            raise DerivedExpressionError(f"'{ast.unparse(node)}' is not allowed")
+        elif isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise DerivedExpressionError(f"Constant {node.value!r} is not a number")
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and id(node) not in callees:
+            names.add(node.id)
+    return CompiledExpression(compile(tree, '<derived>', 'eval'), frozenset(names), uses_spacing)
+
+
+class _Namespace(Mapping):
+    """ Resolves names to the frame's columns on lookup, so nothing is copied up front """
+
+    def __init__(self, df: pd.DataFrame):
+        self._df = df
+
+    def __getitem__(self, name: str):
+        if name in FUNCTIONS:
+            return FUNCTIONS[name]
+        if name == 'np':
+            return np
+        return self._df[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._df.columns)
+
+    def __len__(self) -> int:
+        return len(self._df.columns)
+
+
+def parse_definitions(definitions: list[dict[str, str]]) -> tuple[dict[str, CompiledExpression], dict[str, str]]:
+    """ Compiles `[{"name": ..., "expr": ...}]` definitions into ({name: expression}, {name: error}),
+    skipping entries without a name or expression """
+    compiled, errors = {}, {}
+    for definition in definitions:
+        name, expr = definition.get('name'), definition.get('expr')
+        if not name or not expr:
+            continue
+        if not name.isidentifier():
+            errors[name] = "Name must be an identifier"
+            continue
+        try:
+            compiled[name] = compile_expression(expr)
+        except DerivedExpressionError as e:
+            errors[name] = str(e)
+    return compiled, errors
+
+
+def evaluate(df: pd.DataFrame, compiled: dict[str, CompiledExpression]) -> dict[str, str]:
+    """ Adds the derived series to `df` in dependency order. Returns the errors by name. """
+    errors = {}
+    sorter = graphlib.TopologicalSorter({name: expr.names & compiled.keys() for name, expr in compiled.items()})
+    try:
+        order = list(sorter.static_order())
+    except graphlib.CycleError as e:
+        cycle = e.args[1]
+        for name in cycle:
+            errors[name] = f"Circular reference ({' -> '.join(cycle)})"
+        remaining = {name: expr for name, expr in compiled.items() if name not in errors}
+        return {**errors, **evaluate(df, remaining)}
+
+    namespace = _Namespace(df)
+    for name in order:
+        expr = compiled[name]
+        failed = sorted(expr.names & errors.keys())
+        missing = sorted(n for n in expr.names if n not in df.columns and n not in compiled)
+        if failed:
+            errors[name] = f"Depends on failed '{failed[0]}'"
+        elif missing:
+            errors[name] = f"Unknown name '{missing[0]}'"
+        else:
+            try:
+                with np.errstate(all='ignore'):
+                    result = eval(expr.code, {'__builtins__': {}}, namespace)
+                df[name] = result if isinstance(result, pd.Series) else pd.Series(result, index=df.index)
+            except Exception as e:
+                errors[name] = f"{type(e).__name__}: {e}"
+    return errors
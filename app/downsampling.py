@@ -0,0 +1,123 @@
+""" Shape-preserving downsampling of history series
+
+`lttb_indices` implements Largest-Triangle-Three-Buckets: the series is split into equal-count
+buckets and from each one the point forming the largest triangle with the point kept from the
+previous bucket and the mean of the next bucket is kept. Unlike taking every n-th sample this
+keeps spikes and dips, which are exactly the points that span large triangles.
+
+`downsample_indices` reduces a whole history frame to at most `max_points` rows. A share of
+the budget goes to relay transitions (both sides of each switch, thinned evenly if a relay
+switches more often than that allows), and the rest to a multi-series LTTB over buckets shared
+by all series: each bucket keeps the one row whose triangles, summed over the series scaled
+to their ranges, are largest. The rows are shared, so the response size doesn't grow with the
+number of series.
+"""
+
+import warnings
+from typing import Iterable
+import numpy as np
+import pandas as pd
+
+TRANSITION_SHARE = 4  # At most 1/TRANSITION_SHARE of the rows are spent on relay transitions
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """ Indices of the `n_out` points of (x, y) that LTTB keeps, ascending. NaNs must be removed. """
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1][:max(n_out, 0)], dtype=np.int64)
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    # n_out - 2 buckets between the fixed first and last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    counts = ends - starts
+    mean_x = np.add.reduceat(x[:n - 1], starts) / counts
+    mean_y = np.add.reduceat(y[:n - 1], starts) / counts
+    # The "next bucket" of the last bucket is the final point
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for b, (lo, hi) in enumerate(zip(starts.tolist(), ends.tolist())):
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - next_x[b]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (next_y[b] - ay))
+        a = lo + int(np.argmax(area))
+        keep[b + 1] = a
+    return keep
+
+
+def transition_indices(states: np.ndarray) -> np.ndarray:
+    """ Indices of the rows on both sides of every change of a state series """
+    changes = np.flatnonzero(states[1:] != states[:-1])
+    return np.union1d(changes, changes + 1)
+
+
+def lttb_indices_shared(x: np.ndarray, ys: np.ndarray, n_out: int) -> np.ndarray:
+    """ LTTB over several series at once: indices of the `n_out` rows of `ys` (one column per
+    series, NaN where missing) to keep, ascending. Each bucket keeps the row with the largest sum
+    of triangle areas over the series, each scaled by its range so that no series dominates. """
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1][:max(n_out, 0)], dtype=np.int64)
+
+    x = x.astype(np.float64)
+    ys = ys.astype(np.float64).reshape(n, -1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN series
+        spans = np.nanmax(ys, axis=0) - np.nanmin(ys, axis=0) if ys.size else np.empty(0)
+    spans = np.where(np.isfinite(spans) & (spans > 0), spans, 1.0)
+    ys = ys / spans
+    valid = ~np.isnan(ys)
+    filled = np.where(valid, ys, 0.0)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    mean_x = np.add.reduceat(x[:n - 1], starts) / (ends - starts)
+    with np.errstate(all='ignore'):
+        mean_y = np.add.reduceat(filled[:n - 1], starts, axis=0) / np.add.reduceat(valid[:n - 1], starts, axis=0)
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.vstack((mean_y[1:], ys[-1:]))
+
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for b, (lo, hi) in enumerate(zip(starts.tolist(), ends.tolist())):
+        ax, ay = x[a], ys[a]
+        with np.errstate(all='ignore'):
+            area = np.abs((ax - next_x[b]) * (ys[lo:hi] - ay) - (ax - x[lo:hi, None]) * (next_y[b] - ay))
+        a = lo + int(np.argmax(np.nansum(area, axis=1)))
+        keep[b + 1] = a
+    return keep
+
+
+def downsample_indices(df: pd.DataFrame, series: Iterable[str], states: Iterable[str], max_points: int) -> np.ndarray:
+    """ At most `max_points` rows of `df` to keep: the shape of the `series` by shared-bucket
+    LTTB, and the transitions of the `states` columns (all of them if they fit in their share
+    of the budget, otherwise an even selection). Always includes the first and last row. """
+    n = len(df)
+    if n <= max_points:
+        return np.arange(n)
+
+    changes = np.unique(np.concatenate(
+        [np.flatnonzero(df[col].to_numpy()[1:] != df[col].to_numpy()[:-1]) for col in states] or [np.empty(0, dtype=np.int64)]
+    )).astype(np.int64)
+    max_changes = (max_points // TRANSITION_SHARE) // 2
+    if len(changes) > max_changes:
+        changes = changes[np.unique(np.linspace(0, len(changes) - 1, max_changes).round().astype(np.int64))] \
+            if max_changes else changes[:0]
+    transitions = np.union1d(changes, changes + 1)
+
+    x = df.index.values.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    series = list(series)
+    ys = np.column_stack([df[col].to_numpy(dtype=np.float64, na_value=np.nan) for col in series]) \
+        if series else np.empty((n, 0))
+    shape = lttb_indices_shared(x, ys, max_points - len(transitions))
+    return np.union1d(shape, transitions)
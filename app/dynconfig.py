@@ -1,13 +1,25 @@
-""" Dynamic configuration from the database """
+""" Dynamic configuration from the database
 
+Every configuration fetched from the database is also kept in a local snapshot file
+(`Config.CONFIG_SNAPSHOT_PATH`), rewritten atomically and with a version number that goes up
+whenever the configuration changes. At startup the system can run from the snapshot straight
+away and catch up with the database once it can be reached.
+"""
+
+import json
+import os
+from datetime import datetime
 from app.config import Config
+from app import db
 from app.models import SystemConfig
-from app.hardware_constants import SensorId, RelayId
+from app.hardware_constants import SensorId, RelayId, HostMetricId
 from app.utils import classproperty
 from loguru import logger
-from typing import Callable, Any
+from typing import Callable, Any, Optional
 from enum import Enum
 
+SNAPSHOT_FORMAT = 1
+
 class MalformedConfigException(ValueError):
     pass
 
@@ -17,6 +29,8 @@ class ConfigCategory(Enum):
     GFCI = "GFCI Control"
     WATCHDOG = "Watchdog & Safety"
     NOTIFICATIONS = "Notifications"
+    ACQUISITION = "Data Acquisition"
+    CALIBRATION = "Calibration"
     DRIVERS = "Hardware Drivers"
     SYSTEM = "System"
     MISC = "Miscellaneous"
@@ -70,6 +84,10 @@ def conf_property_evald(key: str, default: str, description: str = "", category:
 class DynConfig:
     _confDict = None
     _definitions = _definitions  # Stores metadata about config properties
+    _source: Optional[str] = None  # Where the live config came from: 'database', 'snapshot' or 'defaults'
+    _version: int = 0  # Snapshot version of the live config
+    _loaded_at: Optional[datetime] = None
+    _db_error: Optional[str] = None  # Why the last fetch from the database failed, if it did
 
     @classmethod
     def validate(cls, key, value):
@@ -117,17 +135,88 @@ class DynConfig:
         return cls._confDict
 
     @classmethod
-    def fetch_config(cls):
-        # Grab latest config dictionary from the database
-        # This requires an active application context
+    def _use(cls, conf: dict[str, str], source: str, version: int):
+        cls._confDict = conf
+        cls._source, cls._version, cls._loaded_at = source, version, datetime.now(Config.TIMEZONE)
+
+    @classmethod
+    def _read_snapshot(cls) -> Optional[dict[str, Any]]:
+        try:
+            with open(Config.CONFIG_SNAPSHOT_PATH) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Unreadable config snapshot {Config.CONFIG_SNAPSHOT_PATH}: {e}")
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT \
+                or not isinstance(snapshot.get('config'), dict):
+            logger.error(f"Ignoring config snapshot {Config.CONFIG_SNAPSHOT_PATH} of an unknown format")
+            return None
+        return snapshot
+
+    @classmethod
+    def _save_snapshot(cls, conf: dict[str, str]) -> int:
+        """ Writes `conf` to the snapshot file, unless it's already there. Returns its version. """
+        snapshot = cls._read_snapshot()
+        if snapshot is not None and snapshot['config'] == conf:
+            return snapshot['version']
+        version = (snapshot['version'] if snapshot is not None else 0) + 1
+        path = Config.CONFIG_SNAPSHOT_PATH
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'format': SNAPSHOT_FORMAT, 'version': version, 'saved_at': datetime.now(Config.TIMEZONE).isoformat(),
+                           'config': conf}, f, indent=1, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)  # Readers see the old snapshot or the new one, never half of one
+        except OSError as e:
+            logger.error(f"Could not save config snapshot {path}: {e}")
+            return cls._version
+        return version
+
+    @classmethod
+    def load_snapshot(cls) -> bool:
+        """ Starts from the local snapshot of the config. False if there is no usable snapshot. """
+        snapshot = cls._read_snapshot()
+        if snapshot is None:
+            return False
+        cls._use(snapshot['config'], 'snapshot', snapshot['version'])
+        logger.info(f"Loaded dynamic configuration from snapshot version {snapshot['version']} ({snapshot.get('saved_at')})")
+        return True
+
+    @classmethod
+    def _fetch_from_db(cls) -> bool:
+        """ Makes the database's config the live one, snapshotting it. Requires an app context. """
         try:
             pairs = SystemConfig.query.all()
-            DynConfig._confDict = {pair.key: pair.value for pair in pairs}
+        except Exception as e:
+            cls._db_error = str(e)
+            try:
+                db.session.rollback()
+            except Exception:
+                pass
+            return False
+        conf = {pair.key: pair.value for pair in pairs}
+        cls._db_error = None
+        if cls._source == 'snapshot' and conf != cls._confDict:
+            logger.warning("The configuration in the database differs from the snapshot; switching to the database's")
+        cls._use(conf, 'database', cls._save_snapshot(conf))
+        return True
+
+    @classmethod
+    def fetch_config(cls) -> bool:
+        # Grab latest config dictionary from the database
+        # This requires an active application context
+        if cls._fetch_from_db():
             logger.info("Loaded dynamic configuration from the database")
-        except Exception:
-            logger.error("Error while loading dynamic configuration from the database")
+            return True
+        logger.error("Error while loading dynamic configuration from the database")
+        if cls._confDict is None and not cls.load_snapshot():
             # Fallback if DB is not ready or context missing (e.g. during tests setup)
-            DynConfig._confDict = {}
+            cls._use({}, 'defaults', 0)
+        return False
 
     @classproperty    
     def initialized(cls):
@@ -136,13 +225,21 @@ class DynConfig:
     @classmethod
     def reload(self):
         """Refreshes the configuration from the database."""
-        try:
-            pairs = SystemConfig.query.all()
-            DynConfig._confDict = {pair.key: pair.value for pair in pairs}
+        if DynConfig._fetch_from_db():
             logger.info("Re-loaded dynamic configuration from the database")
-        except Exception:
+        else:
             logger.error("Error while re-loading dynamic config from the database")
 
+    @classmethod
+    def status(cls) -> dict[str, Any]:
+        """ Which configuration is live """
+        return {
+            'source': cls._source,
+            'version': cls._version,
+            'loaded_at': cls._loaded_at.isoformat() if cls._loaded_at else None,
+            'db_error': cls._db_error,
+        }
+
     # NOTE: ALL TEMPERATURES ARE IN DEG F
 
     # Regulation
@@ -152,6 +249,10 @@ class DynConfig:
     target_temp_tank2_f = conf_property_evald("target_temp_tank2_f", "140.0", "Target temperature for Tank 2 (F)", ConfigCategory.REGULATION, lambda x: isinstance(x, (int, float)) and 0 <= x <= 212, "number")
     temp_hysteresis = conf_property_evald("temp_hysteresis", "2.0", "Temperature hysteresis (F)", ConfigCategory.REGULATION, lambda x: isinstance(x, (int, float)) and x > 0, "number")
     polling_rate_seconds = conf_property_evald("polling_rate_seconds", "60", "Sensor polling rate in seconds", ConfigCategory.REGULATION, lambda x: isinstance(x, int) and x > 0, "number")
+    regulation_window_seconds = conf_property_evald("regulation_window_seconds", "0", "Decide on tank temperatures over this many seconds instead of the latest reading (0 disables)", ConfigCategory.REGULATION, lambda x: isinstance(x, (int, float)) and x >= 0, "number")
+    regulation_statistic = conf_property("regulation_statistic", "median", "Statistic of the regulation window: median or trimmed_mean", ConfigCategory.REGULATION, lambda x: x in ("median", "trimmed_mean"), "text")
+    regulation_trim_proportion = conf_property_evald("regulation_trim_proportion", "0.2", "Proportion cut off each end for the trimmed mean", ConfigCategory.REGULATION, lambda x: isinstance(x, (int, float)) and 0 <= x < 0.5, "number")
+    regulation_min_dwell_seconds = conf_property_evald("regulation_min_dwell_seconds", "0", "Minimum time a circuit relay stays in a state before the thermostat switches it again", ConfigCategory.REGULATION, lambda x: isinstance(x, (int, float)) and x >= 0, "number")
 
     circuit_states = conf_property_evald("circuit_states", "[False, False]", "Manual circuit states [Circ1, Circ2]", ConfigCategory.REGULATION, lambda x: isinstance(x, list) and len(x) == 2, "json")
 
@@ -185,16 +286,45 @@ class DynConfig:
     notify_smtp_pass = conf_property("notify_smtp_pass", "", "SMTP Password", ConfigCategory.NOTIFICATIONS, lambda x: True, "text")
     notify_to_emails = conf_property("notify_to_emails", "john@example.com,bob@example.com", "Comma-separated list of notification emails", ConfigCategory.NOTIFICATIONS, lambda x: True, "text")
 
+    # Data acquisition
+    acquisition_concurrent = conf_property_evald("acquisition_concurrent", "True", "Read sensors on independent buses in parallel", ConfigCategory.ACQUISITION, lambda x: isinstance(x, bool), "boolean")
+    acquisition_max_workers = conf_property_evald("acquisition_max_workers", "4", "Maximum number of buses read at the same time", ConfigCategory.ACQUISITION, lambda x: isinstance(x, int) and x > 0, "number")
+    sensor_sample_periods = conf_property_evald("sensor_sample_periods", "{}", "Per-sensor sample periods in seconds, e.g. {'i1': 0.25, 't0': 300}. Sensors not listed use the polling rate", ConfigCategory.ACQUISITION, lambda x: isinstance(x, dict) and all(k in SensorId.__members__ and isinstance(v, (int, float)) and v > 0 for k, v in x.items()), "json")
+    persist_period_seconds = conf_property_evald("persist_period_seconds", "0", "Seconds between measurements saved to the DB (0 uses the polling rate)", ConfigCategory.ACQUISITION, lambda x: isinstance(x, (int, float)) and x >= 0, "number")
+    acquisition_read_timeout_seconds = conf_property_evald("acquisition_read_timeout_seconds", "5.0", "Deadline for a single sensor read (seconds)", ConfigCategory.ACQUISITION, lambda x: isinstance(x, (int, float)) and x > 0, "number")
+    host_health_period_seconds = conf_property_evald("host_health_period_seconds", "60", "Seconds between samples of the host's CPU temperature, load, memory, disk and throttling (0 disables)", ConfigCategory.ACQUISITION, lambda x: isinstance(x, (int, float)) and x >= 0, "number")
+    host_health_retention_days = conf_property_evald("host_health_retention_days", "90", "Days of host health samples kept in the DB", ConfigCategory.ACQUISITION, lambda x: isinstance(x, (int, float)) and x > 0, "number")
+
+    sensor_history_depth = conf_property_evald("sensor_history_depth", "3600", "Number of recent readings kept in memory per sensor", ConfigCategory.ACQUISITION, lambda x: isinstance(x, int) and x > 0, "number")
+
+    persist_batch_size = conf_property_evald("persist_batch_size", "50", "Number of queued measurements that triggers a DB write", ConfigCategory.ACQUISITION, lambda x: isinstance(x, int) and x > 0, "number")
+    persist_flush_interval_seconds = conf_property_evald("persist_flush_interval_seconds", "30.0", "Longest a measurement waits in memory before being written to the DB (seconds)", ConfigCategory.ACQUISITION, lambda x: isinstance(x, (int, float)) and x > 0, "number")
+    persist_queue_max = conf_property_evald("persist_queue_max", "10000", "Maximum measurements held in memory while the DB is unavailable (oldest are dropped)", ConfigCategory.ACQUISITION, lambda x: isinstance(x, int) and x > 0, "number")
+
+    archive_after_days = conf_property_evald("archive_after_days", "60", "Months that ended more than this many days ago are moved from the DB into the archive (0 disables)", ConfigCategory.SYSTEM, lambda x: isinstance(x, (int, float)) and x >= 0, "number")
+
+    stream_sample_seconds = conf_property_evald("stream_sample_seconds", "1.0", "How often live state is checked for changes to push to open pages (seconds)", ConfigCategory.SYSTEM, lambda x: isinstance(x, (int, float)) and x > 0, "number")
+    stream_max_clients = conf_property_evald("stream_max_clients", "2", "Most pages receiving pushed live updates at once (each holds a server thread, so never more than a third of gunicorn's --threads; more fall back to polling)", ConfigCategory.SYSTEM, lambda x: isinstance(x, int) and x >= 0, "number")
+    history_cache_mb = conf_property_evald("history_cache_mb", "32", "Memory for cached history responses (MB, 0 disables the cache)", ConfigCategory.SYSTEM, lambda x: isinstance(x, (int, float)) and x >= 0, "number")
+    history_target_points = conf_property_evald("history_target_points", "2000", "Points a history chart aims for; longer ranges are served from coarser rollups", ConfigCategory.SYSTEM, lambda x: isinstance(x, int) and x > 0, "number")
+    db_reader_pool_size = conf_property_evald("db_reader_pool_size", "4", "Read-only DB connections for history and analytics queries (the measurement writer has its own); takes effect on restart", ConfigCategory.SYSTEM, lambda x: isinstance(x, int) and x > 0, "number")
+
+    # Recalibration of stored measurements
+    recalibration_days = conf_property_evald("recalibration_days", "30", "How many days of stored measurements a calibration change is applied to", ConfigCategory.CALIBRATION, lambda x: isinstance(x, (int, float)) and x >= 0, "number")
+    recalibration_chunk_size = conf_property_evald("recalibration_chunk_size", "500", "Measurements recalibrated per DB transaction", ConfigCategory.CALIBRATION, lambda x: isinstance(x, int) and x > 0, "number")
+    recalibration_pause_seconds = conf_property_evald("recalibration_pause_seconds", "0.2", "Pause between recalibration transactions, leaving the DB to the measurement writer", ConfigCategory.CALIBRATION, lambda x: isinstance(x, (int, float)) and x >= 0, "number")
+
     # Drivers for things
     if Config.REAL_HARDWARE:
         _default_sensors = str({
             "t0": ("w1_temp_index", {"index": 1}),
             "t1": ("w1_temp_index", {"index": 0}),
             "t2": ("w1_temp_index", {"index": 2}),
-            "v1": ("arduino", {"command": 6}),
-            "v2": ("arduino", {"command": 7}),
-            "i1": ("arduino", {"command": 4}),
-            "i2": ("arduino", {"command": 5})
+            # Voltages barely move, so stop sampling once they settle; currents are sampled fast
+            "v1": ("arduino", {"command": 6, "tolerance": 2.0}),
+            "v2": ("arduino", {"command": 7, "tolerance": 2.0}),
+            "i1": ("arduino", {"command": 4, "sample_delay": 0.01}),
+            "i2": ("arduino", {"command": 5, "sample_delay": 0.01})
         })
         _default_relays = str({
             "circ1": ("arduino", {"on_command": 0, "off_command": 1}),
@@ -210,10 +340,23 @@ class DynConfig:
         _default_lcd = "(\"dummy\", {})"
         _default_gfci = "(\"dummy\", {})"
 
+    # The host health drivers only read files, so they are the same with or without real hardware
+    _default_host_metrics = str({
+        "cpu_temp": ("host_cpu_temp", {}),
+        "load_1m": ("host_loadavg", {"window": 1}),
+        "mem_used": ("host_memory", {}),
+        "disk_used": ("host_disk", {"path": os.path.dirname(Config.DB_FILE_PATH)}),  # The disk the DB fills up
+        "throttled": ("host_throttled", {})
+    })
+
     driver_sensors = conf_property_evald("driver_sensors", _default_sensors, "Sensor Driver Configuration; note that drivers do not update until restart.", ConfigCategory.DRIVERS, lambda x: isinstance(x, dict), "json")
     driver_relays = conf_property_evald("driver_relays", _default_relays, "Relay Driver Configuration", ConfigCategory.DRIVERS, lambda x: isinstance(x, dict), "json")
     driver_lcd = conf_property_evald("driver_lcd", _default_lcd, "LCD Driver Configuration", ConfigCategory.DRIVERS, lambda x: isinstance(x, tuple), "text")
     driver_gfci = conf_property_evald("driver_gfci", _default_gfci, "GFCI Driver Configuration", ConfigCategory.DRIVERS, lambda x: isinstance(x, tuple), "text")
+    driver_host_metrics = conf_property_evald("driver_host_metrics", _default_host_metrics, "Host health metric driver configuration; note that drivers do not update until restart.", ConfigCategory.DRIVERS, lambda x: isinstance(x, dict) and all(k in HostMetricId.__members__ for k in x), "json")
+    hardware_worker_enabled = conf_property_evald("hardware_worker_enabled", "True", "Run the sensor, relay and LCD drivers in a separate process that is killed and restarted if it hangs; takes effect on restart", ConfigCategory.DRIVERS, lambda x: isinstance(x, bool), "boolean")
+    hardware_call_timeout_seconds = conf_property_evald("hardware_call_timeout_seconds", "10.0", "Deadline for a single call into the hardware worker before it is restarted (seconds)", ConfigCategory.DRIVERS, lambda x: isinstance(x, (int, float)) and x > 0, "number")
+    hardware_worker_start_timeout_seconds = conf_property_evald("hardware_worker_start_timeout_seconds", "30.0", "How long the hardware worker may take to start and bring up the hardware (seconds)", ConfigCategory.DRIVERS, lambda x: isinstance(x, (int, float)) and x > 0, "number")
 
     # Misc
     lcd_status_period = conf_property_evald("lcd_status_period", "8", "Seconds for which each status screen is up on the status LCD", ConfigCategory.MISC, lambda x: isinstance(x, int), "number")
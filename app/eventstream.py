@@ -0,0 +1,303 @@
+""" Server-Sent Events push channel for live state
+
+Instead of every open page polling /api/status, /api/watchdog or /api/logs, one publisher
+thread samples the state once per `stream_sample_seconds` while anyone is subscribed, and
+publishes only what changed since the previous sample as a numbered delta event. Each
+connected client just waits for new events, so the cost of a sample does not grow with the
+number of viewers.
+
+A client first receives a `snapshot` event with the full state of its topics. After that it
+receives `delta` events holding only the changed keys, which it merges into its copy: nested
+objects are merged and everything else is replaced. A reconnecting client sends the id of
+the last event it saw, and the events it missed are replayed if they are still buffered;
+otherwise it gets a fresh snapshot. Event ids are `<epoch>-<number>`, the epoch being random per
+process, so an id from before a restart is never mistaken for one of the new numbering.
+
+Topics:
+- `status`: the /api/status document (sensors, relays, regulator, watchdog flag and GFCI)
+- `watchdog`: the /api/watchdog document
+- `logs`: the size of the log file, so the log page knows when to reload
+"""
+
+import json
+import os
+import shlex
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Optional, Iterator
+
+from app import hardware
+from app.config import Config
+from app.dynconfig import DynConfig
+from app.hardwarestate import HardwareState
+from app.hardware_constants import RelayId
+from app.regulation import Regulator
+from app.watchdog import WatchdogTrigger
+from loguru import logger
+
+TOPICS = ('status', 'watchdog', 'logs')
+HEARTBEAT_SECONDS = 15.0
+GFCI_SAMPLE_SECONDS = 5.0  # The GFCI is queried over HTTP, so less often than the rest
+MAX_CONNECTION_SECONDS = 300.0  # Clients reconnect (and resume) after this, freeing the worker thread
+REPLAY_EVENTS = 300
+STREAM_THREAD_SHARE = 3  # Streams may hold at most one in this many of the server's request threads
+EPOCH = uuid.uuid4().hex[:8]  # Prefix of this process's event ids
+
+
+def gfci_state() -> dict[str, Any]:
+    """ The GFCI part of /api/status (queries the GFCI controller) """
+    status = {
+        'ping': False,
+        'tripped': [False, False],
+        'enabled': DynConfig.gfci_enabled,
+        'threshold': DynConfig.gfci_trip_threshold_ma,
+        'error': None
+    }
+    if hardware.gfci_driver and DynConfig.gfci_enabled:
+        try:
+            status['ping'] = hardware.gfci_driver.ping()
+            status['tripped'] = [hardware.gfci_driver.is_tripped(1), hardware.gfci_driver.is_tripped(2)]
+        except Exception as e:
+            status['error'] = str(e)
+    return status
+
+
+def status_state(gfci: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+    """ The /api/status document; `gfci` reuses an earlier GFCI reading instead of querying it """
+    readings = {}
+    for sensor_id, reading in HardwareState.cur_sensor_values.items():
+        if reading:
+            readings[sensor_id.name] = {
+                'raw': reading.raw,
+                'calibrated': reading.cald,
+                'timestamp': reading.timestamp.isoformat() if reading.timestamp else None
+            }
+        else:
+            readings[sensor_id.name] = None
+
+    return {
+        'sensors': readings,
+        'relays': {relay_id.name: HardwareState.get_relay_state(relay_id) for relay_id in RelayId},
+        'is_day': Regulator()._is_light_out(),  # _is_light_out returns True if it is day
+        'manual_mode': DynConfig.manual_mode,
+        'circuit_enables': DynConfig.circuit_states,
+        'watchdog_tripped': WatchdogTrigger.is_tripped(),
+        'regulator_status': Regulator().get_status_str(),
+        'gfci': gfci if gfci is not None else gfci_state()
+    }
+
+
+def watchdog_state() -> dict[str, Any]:
+    """ The /api/watchdog document """
+    excludes = DynConfig.watchdog_excludes
+    return {
+        'tripped': WatchdogTrigger.is_tripped(),
+        'triggers': [
+            {
+                'name': trigger.__name__,
+                'status': trigger.notify_state(),
+                'is_tripped': trigger.is_tripped(),
+                'enabled': trigger.__name__ not in excludes
+            }
+            for trigger in WatchdogTrigger.all_triggers()
+        ]
+    }
+
+
+def logs_state() -> dict[str, Any]:
+    try:
+        return {'size': os.path.getsize(Config.LOG_FILE_PATH)}
+    except OSError:
+        return {'size': None}
+
+
+def server_threads(argv: Optional[list[str]] = None) -> Optional[int]:
+    """ The request threads of the gunicorn worker serving the app, from its command line and
+    GUNICORN_CMD_ARGS; None if not running under gunicorn or set in a config file instead """
+    argv = sys.argv if argv is None else argv
+    if not argv or 'gunicorn' not in os.path.basename(argv[0]):
+        return None
+    args = list(argv[1:]) + shlex.split(os.environ.get('GUNICORN_CMD_ARGS', ''))
+    threads = None
+    for i, arg in enumerate(args):
+        if arg == '--threads' and i + 1 < len(args):
+            threads = args[i + 1]
+        elif arg.startswith('--threads='):
+            threads = arg.split('=', 1)[1]
+        elif arg in ('-c', '--config') or arg.startswith('--config='):
+            return None if threads is None else int(threads)
+    return int(threads) if threads is not None else 1  # gunicorn's default
+
+
+def max_clients() -> int:
+    """ `stream_max_clients`, capped so that streams can't take over the server's request threads
+    (an older service file may still run gunicorn with only a few) """
+    threads = server_threads()
+    if threads is None:
+        return DynConfig.stream_max_clients
+    return min(DynConfig.stream_max_clients, threads // STREAM_THREAD_SHARE)
+
+
+def diff(old: Any, new: Any) -> Any:
+    """ The delta that turns `old` into `new` under the client's merge rule, or None if equal.
+    Keys that disappeared are sent as null. """
+    if isinstance(old, dict) and isinstance(new, dict):
+        delta = {}
+        for key in new.keys() | old.keys():
+            if key not in new:
+                delta[key] = None
+            elif key not in old:
+                delta[key] = new[key]
+            elif old[key] != new[key]:
+                changed = diff(old[key], new[key])
+                delta[key] = changed if isinstance(old[key], dict) and isinstance(new[key], dict) else new[key]
+        return delta or None
+    return None if old == new else new
+
+
+def parse_event_id(value: Optional[str]) -> Optional[int]:
+    """ The event number of a client's Last-Event-ID, or None unless this process issued it """
+    epoch, _, number = (value or '').rpartition('-')
+    if epoch != EPOCH or not number.isdigit():
+        return None
+    return int(number)
+
+
+def _format(event: str, data: dict[str, Any], event_id: Optional[int] = None) -> str:
+    lines = [f"id: {EPOCH}-{event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data)}"]
+    return '\n'.join(lines) + '\n\n'
+
+
+class StateStream:
+    """ Samples the live state and fans out deltas to the connected SSE clients """
+
+    _lock = threading.Condition()
+    _thread: Optional[threading.Thread] = None
+    _flask_app = None
+    _state: dict[str, Any] = {}
+    _seq: int = 0
+    _events: deque = deque(maxlen=REPLAY_EVENTS)  # (id, {topic: delta})
+    _subscribers: int = 0
+    _gfci: Optional[dict[str, Any]] = None
+    _gfci_sampled: float = 0.0
+
+    # Counters
+    samples: int = 0
+    events_published: int = 0
+
+    @classmethod
+    def _sample(cls) -> dict[str, Any]:
+        now = time.monotonic()
+        if cls._gfci is None or now - cls._gfci_sampled >= GFCI_SAMPLE_SECONDS:
+            cls._gfci, cls._gfci_sampled = gfci_state(), now
+        cls.samples += 1
+        return {'status': status_state(cls._gfci), 'watchdog': watchdog_state(), 'logs': logs_state()}
+
+    @classmethod
+    def publish(cls):
+        """ Samples the state once and publishes the changes, if any. Requires an app context. """
+        state = cls._sample()
+        with cls._lock:
+            delta = {topic: d for topic in TOPICS if (d := diff(cls._state.get(topic), state[topic])) is not None}
+            cls._state = state
+            if delta:
+                cls._seq += 1
+                cls._events.append((cls._seq, delta))
+                cls.events_published += 1
+                cls._lock.notify_all()
+
+    @classmethod
+    def _run(cls):
+        while True:
+            time.sleep(DynConfig.stream_sample_seconds)
+            with cls._lock:
+                if cls._subscribers == 0:
+                    cls._thread = None
+                    return
+            try:
+                with cls._flask_app.app_context():
+                    cls.publish()
+            except Exception as e:
+                logger.error(f"Error while sampling state for the event stream: {e}")
+
+    @classmethod
+    def _connect(cls, flask_app) -> bool:
+        """ Registers a client, starting the publisher if it's the first. False if there are too many. """
+        with cls._lock:
+            if cls._subscribers >= max_clients():
+                return False
+            cls._subscribers += 1
+            cls._flask_app = flask_app
+            if cls._thread is not None:
+                return True
+            cls._thread = threading.Thread(target=cls._run, name="State Stream", daemon=True)
+        # The state may be stale from an earlier run of the publisher
+        try:
+            with flask_app.app_context():
+                cls.publish()
+        except Exception as e:
+            logger.error(f"Error while sampling state for the event stream: {e}")
+        cls._thread.start()
+        return True
+
+    @classmethod
+    def _pending(cls, topics: list[str], seq: int) -> tuple[int, list[str]]:
+        """ Waits up to a heartbeat interval for events after `seq`; returns the new position and
+        the messages to send (caller holds the lock) """
+        if cls._seq == seq:
+            cls._lock.wait(HEARTBEAT_SECONDS)
+        pending = [(i, d) for i, d in cls._events if i > seq]
+        if pending and pending[0][0] != seq + 1:
+            # Fell behind the replay buffer
+            return cls._seq, [_format('snapshot', {topic: cls._state.get(topic) for topic in topics}, cls._seq)]
+        messages = []
+        for event_id, delta in pending:
+            seq = event_id
+            relevant = {topic: d for topic, d in delta.items() if topic in topics}
+            if relevant:
+                messages.append(_format('delta', relevant, event_id))
+        return seq, messages
+
+    @classmethod
+    def messages(cls, flask_app, topics: list[str], last_event_id: Optional[int]) -> Iterator[str]:
+        """ The SSE messages for one client. Ends after `MAX_CONNECTION_SECONDS` so the client
+        reconnects and resumes, or right away with a `busy` event if too many are connected. """
+        if not cls._connect(flask_app):
+            yield _format('busy', {'max_clients': max_clients()})
+            return
+        try:
+            with cls._lock:
+                oldest = cls._events[0][0] if cls._events else cls._seq + 1
+                if last_event_id is not None and oldest - 1 <= last_event_id <= cls._seq:
+                    seq, first = last_event_id, []  # Resume: the missed events follow
+                else:
+                    seq = cls._seq
+                    first = [_format('snapshot', {topic: cls._state.get(topic) for topic in topics}, seq)]
+            yield f"retry: {int(HEARTBEAT_SECONDS * 1000 // 5)}\n\n"
+            yield from first
+
+            connected = time.monotonic()
+            while time.monotonic() - connected < MAX_CONNECTION_SECONDS:
+                with cls._lock:
+                    seq, messages = cls._pending(topics, seq)
+                # Never write to the client while holding the lock
+                yield from messages or [': keepalive\n\n']
+        finally:
+            with cls._lock:
+                cls._subscribers -= 1
+
+    @classmethod
+    def stats(cls) -> dict[str, Any]:
+        with cls._lock:
+            return {
+                'subscribers': cls._subscribers,
+                'max_clients': max_clients(),
+                'epoch': EPOCH,
+                'last_event_id': cls._seq,
+                'samples': cls.samples,
+                'events_published': cls.events_published,
+            }
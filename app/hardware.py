@@ -1,11 +1,13 @@
 """ Code for accessing hardware """
 
-from drivers.base_driver import BaseSensorDriver, BaseOutputDriver, BaseLCDDriver, BaseGFCIDriver, HardwareDriver
+from drivers.base_driver import BaseSensorDriver, BaseOutputDriver, BaseLCDDriver, BaseGFCIDriver, HardwareDriver, GFCIRelay
 from drivers.dummy_driver import DummySensorDriver, DummyOutputDriver, DummyLCDDriver, DummyGFCIDriver
 import drivers.real_drivers # Register real drivers
-from typing import Type
+import drivers.host_drivers
+from typing import Type, Hashable
 from app.dynconfig import DynConfig, MalformedConfigException
 from app.hardware_constants import SensorId, RelayId
+from app.hardwareworker import HardwareWorker, WorkerSensorDriver, WorkerOutputDriver, WorkerLCDDriver
 from loguru import logger
 from typing import Type
 import sys
@@ -21,6 +23,27 @@ gfci_driver = None
 def get_all_drivers() -> dict[str,HardwareDriver]:
     return {'lcd': lcd_driver, **sensor_drivers, **relay_drivers}
 
+def single_flight_stats() -> dict[str, dict[str, int]]:
+    """ Per driver, how many reads were asked for and how many actually reached the hardware """
+    drivers = {key.name: driver for key, driver in {**sensor_drivers, **relay_drivers}.items()}
+    drivers['gfci'] = gfci_driver
+    return {name: driver.single_flight_stats() for name, driver in drivers.items() if driver is not None}
+
+def _batch_type(driver_type: Type[BaseSensorDriver]) -> Type[BaseSensorDriver]:
+    """ The class that implements `read_batch` for this driver type """
+    return next(klass for klass in driver_type.__mro__ if 'read_batch' in vars(klass))
+
+def group_sensors(drivers: dict[SensorId, BaseSensorDriver]) -> dict[Hashable, dict[Type[BaseSensorDriver], list[SensorId]]]:
+    """ Groups sensors by the bus they are read over, and within each bus by the driver class
+    that implements their `read_batch`. Each innermost list can be acquired with a single
+    `read_batch` call of that class. Sensors that don't share a bus each get a group of their own.
+    """
+    groups: dict[Hashable, dict[Type[BaseSensorDriver], list[SensorId]]] = {}
+    for sensor_id, driver in drivers.items():
+        key = driver.bus if driver.bus is not None else sensor_id
+        groups.setdefault(key, {}).setdefault(_batch_type(type(driver)), []).append(sensor_id)
+    return groups
+
 def initialize_drivers():
     """ Reads drivers and driver configuration from DynConf.
     Initialized driver instances are then found in the dictionaries in this module.
@@ -44,17 +67,28 @@ def initialize_drivers():
         logger.opt(exception=True).error(f"Malformed driver config. Cannot initialize drivers.")
         raise
 
+    # Hardware I/O runs in a supervised worker process, with proxies standing in for the drivers here
+    use_worker = DynConfig.hardware_worker_enabled
+    worker_specs = {}
+
+    def make_driver(kind: str, key, DriverClass: Type[HardwareDriver], driver_name: str, params: dict) -> HardwareDriver:
+        if not use_worker or DriverClass is GFCIRelay:  # GFCI relays go through the in-process GFCI driver
+            return DriverClass(params)
+        worker_specs[key] = (kind, driver_name, params)
+        return {'sensor': WorkerSensorDriver, 'relay': WorkerOutputDriver, 'lcd': WorkerLCDDriver}[kind](key)
+
     # Do sensors
     for sensor in SensorId:
         try:
             DriverClass: Type[BaseSensorDriver] = BaseSensorDriver.get_driver(
                 sensor_driver_conf[sensor.value][0]
             )
-            sensor_drivers[sensor] = DriverClass(sensor_driver_conf[sensor.value][1])
+            sensor_conf = sensor_driver_conf[sensor.value]
         except KeyError as e:  # We don't have a sensor driver config specified for this sensor
             logger.warning(f"No driver found for sensor {sensor.name}... Using dummy driver.")
             logger.opt(exception=True).debug("(A KeyError exception occurred)")
-            sensor_drivers[sensor] = DummySensorDriver({})  # No parameters (use defaults)     
+            DriverClass, sensor_conf = DummySensorDriver, ("dummy", {})  # No parameters (use defaults)
+        sensor_drivers[sensor] = make_driver('sensor', ('sensor', sensor.value), DriverClass, *sensor_conf)
 
     # Do Relays
     for relay in RelayId:
@@ -62,22 +96,28 @@ def initialize_drivers():
             DriverClass: Type[BaseOutputDriver] = BaseOutputDriver.get_driver(
                 output_driver_conf[relay.value][0]
             )
-            relay_drivers[relay] = DriverClass(output_driver_conf[relay.value][1])
+            relay_conf = output_driver_conf[relay.value]
         except KeyError:  # We don't have a sensor driver config specified for this sensor
             logger.warning(f"No driver found for output {relay.name}... Using dummy driver.")
             logger.opt(exception=True).debug("(A KeyError exception occurred)")
-            relay_drivers[relay] = DummyOutputDriver({})  # No parameters (use defaults)     
+            DriverClass, relay_conf = DummyOutputDriver, ("dummy", {})  # No parameters (use defaults)
+        relay_drivers[relay] = make_driver('relay', ('relay', relay.value), DriverClass, *relay_conf)
 
     # Do LCD
     try:
         DriverClass: Type[BaseLCDDriver] = BaseLCDDriver.get_driver(
             lcd_driver_conf[0]
         )
-        lcd_driver = DriverClass(lcd_driver_conf[1])
     except KeyError:  # We don't have a sensor driver config specified for this sensor
         logger.warning(f"No driver found for lcd... Using dummy driver.")
         logger.opt(exception=True).debug("(A KeyError exception occurred)")
-        lcd_driver = DummyLCDDriver({})  # No parameters (use defaults)   
+        DriverClass, lcd_driver_conf = DummyLCDDriver, ("dummy", {})  # No parameters (use defaults)
+    lcd_driver = make_driver('lcd', ('lcd', None), DriverClass, *lcd_driver_conf)
+
+    if use_worker:
+        HardwareWorker.start(worker_specs)
+    else:
+        HardwareWorker.stop()
 
     # Do GFCI  
     try:
@@ -42,3 +42,25 @@ class RelayId(Enum):
     # Outside relays (GFCI)
     gfci1 = "gfci1"
     gfci2 = "gfci2"
+
+
+@unique
+class HostMetricId(Enum):
+    """ Uniquely identifies each health metric of the host computer """
+
+    cpu_temp = "cpu_temp"    # SoC temperature (C)
+    load_1m = "load_1m"      # 1-minute load average
+    mem_used = "mem_used"    # Memory in use (%)
+    disk_used = "disk_used"  # Disk space in use (%)
+    throttled = "throttled"  # Firmware throttle flags
+
+    @property
+    def readable_name(self):
+        names = {
+            "cpu_temp": "Host CPU Temp (C)",
+            "load_1m": "Host Load (1 min)",
+            "mem_used": "Host Memory Used (%)",
+            "disk_used": "Host Disk Used (%)",
+            "throttled": "Host Throttle Flags"
+        }
+        return names.get(self.value, self.value)
@@ -2,20 +2,25 @@
 
 from .utils import synchronized
 import threading
+import time
 from loguru import logger
 from datetime import datetime
 from typing import Optional
 from app.config import Config
 from .calibration import SensorReading
 from .hardware import sensor_drivers, relay_drivers, gfci_driver
+from .hardwareworker import HardwareWorkerError
 from drivers.base_driver import BaseSensorDriver, BaseOutputDriver, GFCIRelay
 from .dynconfig import DynConfig
 from .hardware_constants import SensorId, RelayId
+from .acquisition import AcquisitionResult, read_concurrent, read_sequential
 from threading import Thread
 from time import sleep
-from app import db
-from app.models import Measurement
+from app.persistence import MeasurementWriter
+from app.ringbuffer import SensorRingBuffer
 
+_sampling_thread: Optional[Thread] = None
+_NO_HISTORY = SensorRingBuffer(1)  # What `recent` returns for a sensor without readings; never written
 
 class HardwareState:
     """ This class contains the most recent sensor values, the current state of the relays, etc. """
@@ -30,7 +35,10 @@ class HardwareState:
         (key, False) for key in RelayId
     )
     last_polled: Optional[datetime] = None
+    last_poll_duration: Optional[float] = None  # Seconds the last poll spent acquiring sensor values
+    acquisition_results: dict[SensorId, AcquisitionResult] = {}  # Per-sensor timing of the last poll
     circuits_enabled: Optional[list[bool]] = None
+    history: dict[SensorId, SensorRingBuffer] = {}  # Recent readings of each sensor, readable without the lock
 
     @staticmethod
     def init():
@@ -38,88 +46,184 @@ class HardwareState:
         HardwareState.circuits_enabled = DynConfig.circuit_states
 
     @staticmethod
-    def poll_sensors():
-        """ Polls all hardware inputs, updating current context & saving to the database """
+    def sample_period(sensor_id: SensorId) -> float:
+        """ Seconds between acquisitions of the given sensor """
+        return DynConfig.sensor_sample_periods.get(sensor_id.value, DynConfig.polling_rate_seconds)
+
+    @staticmethod
+    def recent(sensor_id: SensorId) -> SensorRingBuffer:
+        """ The ring buffer of recent readings of the given sensor (an empty one if it has none yet).
+        Only the sampling side creates and resizes buffers, so readers never swap one out from under it. """
+        return HardwareState.history.get(sensor_id, _NO_HISTORY)
+
+    @staticmethod
+    def push_history(sensor_id: SensorId, timestamp: float, monotonic: float, raw: float, cal: float):
+        """ Appends a reading to the sensor's ring buffer, first creating it or resizing it to
+        `sensor_history_depth` (starting it over) if needed """
         with HardwareState._instancelock:
-            logger.debug("Polling from sensors")
+            buffer = HardwareState.history.get(sensor_id)
+            depth = DynConfig.sensor_history_depth
+            if buffer is None or buffer.depth != depth:
+                buffer = SensorRingBuffer(depth)
+                HardwareState.history = {**HardwareState.history, sensor_id: buffer}
+            buffer.push(timestamp, monotonic, raw, cal)
 
-            # poll current sensor values
-            new_sensor_values = {}
-            for sensor_id in HardwareState.cur_sensor_values.keys():
-                driver: BaseSensorDriver = sensor_drivers[sensor_id]
-                new_sensor_values[sensor_id] = SensorReading(driver.read(), sensor_id)
+    @staticmethod
+    def poll_sensors(sensor_ids: Optional[list[SensorId]] = None, persist: bool = True):
+        """ Polls hardware inputs (all of them, unless `sensor_ids` is given), updating the current context.
+        If `persist` is set, the resulting state is also saved to the database. """
+        if sensor_ids is None:
+            sensor_ids = list(SensorId)
+        logger.debug(f"Polling from sensors {[s.name for s in sensor_ids]}")
 
-            # Update relay states for GFCIRelay drivers
-            for relay_id, driver in relay_drivers.items():
-                if isinstance(driver, GFCIRelay):
-                    HardwareState._relay_states[relay_id] = driver.get_state()
+        # poll current sensor values
+        # (The drivers serialize access to their own buses, so this doesn't need the state lock)
+        poll_start = time.monotonic()
+        drivers: dict[SensorId, BaseSensorDriver] = {
+            sensor_id: sensor_drivers[sensor_id] for sensor_id in sensor_ids
+        }
+        if DynConfig.acquisition_concurrent:
+            results = read_concurrent(
+                drivers,
+                max_workers=DynConfig.acquisition_max_workers,
+                read_timeout=DynConfig.acquisition_read_timeout_seconds
+            )
+        else:
+            results = read_sequential(
+                drivers,
+                max_workers=DynConfig.acquisition_max_workers,
+                read_timeout=DynConfig.acquisition_read_timeout_seconds
+            )
+        poll_duration = time.monotonic() - poll_start
+
+        with HardwareState._instancelock:
+            new_sensor_values = dict(HardwareState.cur_sensor_values)
+            for sensor_id, result in results.items():
+                new_sensor_values[sensor_id] = SensorReading(
+                    result.value, sensor_id, result.timestamp, result.monotonic
+                ) if result.ok else None
+            HardwareState.acquisition_results = {**HardwareState.acquisition_results, **results}
+            HardwareState.last_poll_duration = poll_duration
 
             # Update the "current" latest values all at once (reference updates are atomic)
             HardwareState.cur_sensor_values = new_sensor_values
+            for sensor_id in results:
+                reading = new_sensor_values[sensor_id]
+                if reading is not None:
+                    HardwareState.push_history(
+                        sensor_id, reading.timestamp.timestamp(), reading.monotonic, reading.raw, reading.cald
+                    )
 
             # Update last polled time
             HardwareState.last_polled = datetime.now(Config.TIMEZONE)
 
+        if persist:
+            HardwareState.save_measurement()
+
+    @staticmethod
+    def save_measurement():
+        """ Saves the current sensor values and relay states to the database """
+        with HardwareState._instancelock:
+            # Update relay states for GFCIRelay drivers
+            for relay_id, driver in relay_drivers.items():
+                if isinstance(driver, GFCIRelay):
+                    HardwareState._relay_states[relay_id] = driver.get_state()
+
+            new_sensor_values = HardwareState.cur_sensor_values
+
             # Save to database
             try:
-                m = Measurement(
-                    timestamp=HardwareState.last_polled,
+                row = {
+                    'timestamp': datetime.now(Config.TIMEZONE),
                     # Raw
-                    v1_raw=new_sensor_values[SensorId.v1].raw if new_sensor_values[SensorId.v1] else None,
-                    i1_raw=new_sensor_values[SensorId.i1].raw if new_sensor_values[SensorId.i1] else None,
-                    t1_raw=new_sensor_values[SensorId.t1].raw if new_sensor_values[SensorId.t1] else None,
-                    v2_raw=new_sensor_values[SensorId.v2].raw if new_sensor_values[SensorId.v2] else None,
-                    i2_raw=new_sensor_values[SensorId.i2].raw if new_sensor_values[SensorId.i2] else None,
-                    t2_raw=new_sensor_values[SensorId.t2].raw if new_sensor_values[SensorId.t2] else None,
-                    t0_raw=new_sensor_values[SensorId.t0].raw if new_sensor_values[SensorId.t0] else None,
+                    'v1_raw': new_sensor_values[SensorId.v1].raw if new_sensor_values[SensorId.v1] else None,
+                    'i1_raw': new_sensor_values[SensorId.i1].raw if new_sensor_values[SensorId.i1] else None,
+                    't1_raw': new_sensor_values[SensorId.t1].raw if new_sensor_values[SensorId.t1] else None,
+                    'v2_raw': new_sensor_values[SensorId.v2].raw if new_sensor_values[SensorId.v2] else None,
+                    'i2_raw': new_sensor_values[SensorId.i2].raw if new_sensor_values[SensorId.i2] else None,
+                    't2_raw': new_sensor_values[SensorId.t2].raw if new_sensor_values[SensorId.t2] else None,
+                    't0_raw': new_sensor_values[SensorId.t0].raw if new_sensor_values[SensorId.t0] else None,
                     # Calibrated
-                    v1_cal=new_sensor_values[SensorId.v1].cald if new_sensor_values[SensorId.v1] else None,
-                    i1_cal=new_sensor_values[SensorId.i1].cald if new_sensor_values[SensorId.i1] else None,
-                    t1_cal=new_sensor_values[SensorId.t1].cald if new_sensor_values[SensorId.t1] else None,
-                    v2_cal=new_sensor_values[SensorId.v2].cald if new_sensor_values[SensorId.v2] else None,
-                    i2_cal=new_sensor_values[SensorId.i2].cald if new_sensor_values[SensorId.i2] else None,
-                    t2_cal=new_sensor_values[SensorId.t2].cald if new_sensor_values[SensorId.t2] else None,
-                    t0_cal=new_sensor_values[SensorId.t0].cald if new_sensor_values[SensorId.t0] else None,
+                    'v1_cal': new_sensor_values[SensorId.v1].cald if new_sensor_values[SensorId.v1] else None,
+                    'i1_cal': new_sensor_values[SensorId.i1].cald if new_sensor_values[SensorId.i1] else None,
+                    't1_cal': new_sensor_values[SensorId.t1].cald if new_sensor_values[SensorId.t1] else None,
+                    'v2_cal': new_sensor_values[SensorId.v2].cald if new_sensor_values[SensorId.v2] else None,
+                    'i2_cal': new_sensor_values[SensorId.i2].cald if new_sensor_values[SensorId.i2] else None,
+                    't2_cal': new_sensor_values[SensorId.t2].cald if new_sensor_values[SensorId.t2] else None,
+                    't0_cal': new_sensor_values[SensorId.t0].cald if new_sensor_values[SensorId.t0] else None,
                     # Relays
-                    relay_inside_1=HardwareState.get_relay_state(RelayId.circ1),
-                    relay_inside_2=HardwareState.get_relay_state(RelayId.circ2),
-                    relay_outside_1=HardwareState.get_relay_state(RelayId.gfci1),
-                    relay_outside_2=HardwareState.get_relay_state(RelayId.gfci2)
-                )
-                db.session.add(m)
-                db.session.commit()
+                    'relay_inside_1': HardwareState.get_relay_state(RelayId.circ1),
+                    'relay_inside_2': HardwareState.get_relay_state(RelayId.circ2),
+                    'relay_outside_1': HardwareState.get_relay_state(RelayId.gfci1),
+                    'relay_outside_2': HardwareState.get_relay_state(RelayId.gfci2)
+                }
+                # Handed off to the write-behind queue; the lock is not held across the DB write
+                MeasurementWriter.enqueue(row)
             except Exception as e:
-                logger.error(f"Error saving measurement to DB: {e}")
-                db.session.rollback()
+                logger.error(f"Error queueing measurement for the DB: {e}")
 
     @staticmethod
     def schedule_sensor_polling(flask_app):
-        """ Schedules the sensor polling job """
+        """ Starts the multi-rate sampling loop and schedules the job persisting measurements """
         from app import scheduler
         from app.utils import run_with_timeout_and_kill
-        
+
+        global _sampling_thread
+        if _sampling_thread is None or not _sampling_thread.is_alive():
+            _sampling_thread = Thread(
+                target=HardwareState._sampling_loop, args=(flask_app,), name="Sensor Sampling", daemon=True
+            )
+            _sampling_thread.start()
+
         def job():
             def task():
                 with flask_app.app_context():
-                    HardwareState.poll_sensors()
+                    HardwareState.save_measurement()
 
             run_with_timeout_and_kill(
-                task, 
-                timeout=DynConfig.polling_rate_seconds
+                task,
+                timeout=HardwareState.persist_period()
             )
 
-        if scheduler.get_job('sensor_polling'):
-            scheduler.remove_job('sensor_polling')
+        if scheduler.get_job('measurement_persist'):
+            scheduler.remove_job('measurement_persist')
 
         scheduler.add_job(
-            id='sensor_polling',
+            id='measurement_persist',
             func=job,
             trigger='interval',
-            seconds=DynConfig.polling_rate_seconds,
+            seconds=HardwareState.persist_period(),
             max_instances=1,
             coalesce=True
         )
 
+    @staticmethod
+    def persist_period() -> float:
+        """ Seconds between measurement rows saved to the database """
+        return DynConfig.persist_period_seconds or DynConfig.polling_rate_seconds
+
+    @staticmethod
+    def _sampling_loop(flask_app):
+        """ Forever acquires each sensor whenever its own sample period has elapsed.
+        Sensors that come due together are acquired together, so they still share bus batches. """
+        next_due: dict[SensorId, float] = {sensor_id: time.monotonic() for sensor_id in SensorId}
+        while True:
+            now = time.monotonic()
+            due = [sensor_id for sensor_id, t in next_due.items() if t <= now]
+            if due:
+                try:
+                    with flask_app.app_context():
+                        HardwareState.poll_sensors(due, persist=False)
+                except Exception:
+                    logger.exception("Error while polling sensors")
+                now = time.monotonic()
+                for sensor_id in due:
+                    # Don't try to catch up on missed samples if acquisition overran the period
+                    next_due[sensor_id] = max(next_due[sensor_id] + HardwareState.sample_period(sensor_id), now)
+
+            # Wake for the next due sensor, but at least every second to pick up config changes
+            sleep(min(max(min(next_due.values()) - time.monotonic(), 0.01), 1.0))
+
     @staticmethod
     def set_relay(id: RelayId, new_state: bool, force: bool = False) -> None:
         """ Sets the state of the given relay. 
@@ -141,6 +245,18 @@ class HardwareState:
             # Keep track of the change
             HardwareState._relay_states[id] = new_state
 
+    @staticmethod
+    def try_set_relay(id: RelayId, new_state: bool, **kwargs) -> bool:
+        """ Like `set_relay`, for the regulation and watchdog loops: if the hardware worker is down
+        the failure is logged and False returned, so the caller can carry on with its other relays.
+        The worker applies the wanted state once it is back up. """
+        try:
+            HardwareState.set_relay(id, new_state, **kwargs)
+            return True
+        except HardwareWorkerError as e:
+            logger.error(f"Could not set relay {id.name} to {new_state}: {e}")
+            return False
+
     @staticmethod
     def get_relay_state(id: RelayId) -> bool:
         return HardwareState._relay_states.get(id, False)
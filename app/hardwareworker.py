@@ -0,0 +1,337 @@
+""" Supervision of the out-of-process hardware drivers
+
+A thread that is stuck inside a C-level smbus or sysfs read cannot be interrupted, and it keeps
+holding every lock it took on the way in. So the sensor, relay and LCD drivers run in a child
+process (see `drivers.hardware_worker`) and the rest of the app talks to them through proxy
+drivers. Every call gets a deadline; when one is missed the worker is killed and respawned in
+the background, the calls in flight fail right away, and the relays are set to the states
+last asked of them, including changes whose calls failed. Calls made while the worker is
+restarting fail immediately with HardwareWorkerError instead of queueing up behind it, so
+long-running loops must catch it and carry on.
+
+The GFCI controller (and the relays it drives) is reached over HTTP with its own timeouts, so
+it stays in-process.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing.connection import Connection
+from typing import Any, Optional, Hashable
+from loguru import logger
+
+from app.dynconfig import DynConfig
+from drivers.base_driver import BaseSensorDriver, BaseOutputDriver, BaseLCDDriver
+import drivers
+
+DriverSpec = tuple[str, str, dict[str, Any]]  # (kind, registered driver name, params)
+RESPAWN_DELAY_SECONDS = 5.0  # Between attempts when a respawned worker fails to come up
+
+
+class HardwareWorkerError(RuntimeError):
+    """ A hardware call failed because the worker is down or restarting, or the driver raised """
+    pass
+
+
+class HardwareWorkerTimeout(HardwareWorkerError, TimeoutError):
+    """ A hardware call missed its deadline (and the worker was restarted) """
+    pass
+
+
+class HardwareWorker:
+    """ Runs the hardware drivers in a child process that is killed and respawned if it hangs """
+
+    _lock = threading.Lock()
+    _specs: dict[Hashable, DriverSpec] = {}
+    _process = None
+    _conn = None
+    _send_lock = threading.Lock()
+    _generation: int = 0  # Bumped each time the worker is (re)started or stopped
+    _ready: bool = False
+    _buses: dict[Hashable, Optional[str]] = {}
+    _pending: dict[int, Future] = {}
+    _next_id: int = 0
+    _outputs: dict[Hashable, tuple] = {}  # Last state asked of each relay, restored after a restart
+
+    # Counters
+    calls: int = 0
+    failed_calls: int = 0
+    timeouts: int = 0
+    restarts: int = 0
+    last_restart_reason: Optional[str] = None
+    last_restart_seconds: Optional[float] = None  # How long the last respawn took
+    _latencies: deque = deque(maxlen=512)  # Seconds per successful call
+
+    @classmethod
+    def start(cls, specs: dict[Hashable, DriverSpec]):
+        """ Starts the worker with the given drivers, stopping any previous one. The hardware is not
+        initialized; that is left to the drivers' `hardware_init`, as for in-process drivers. """
+        cls.stop()
+        with cls._lock:
+            cls._specs = dict(specs)
+            cls._outputs = {}
+            generation = cls._generation
+        cls._spawn(generation, init_hardware=False)
+        if not cls._ready:
+            raise HardwareWorkerError("The hardware worker failed to start")
+
+    @classmethod
+    def stop(cls, timeout: float = 5.0):
+        """ Asks the worker to exit, killing it if it doesn't within `timeout` seconds """
+        with cls._lock:
+            process, conn = cls._process, cls._conn
+            cls._generation += 1
+            cls._ready = False
+            cls._process = cls._conn = None
+            cls._fail_pending(HardwareWorkerError("The hardware worker was stopped"))
+        if process is None:
+            return
+        try:
+            with cls._send_lock:
+                conn.send(None)
+        except (OSError, ValueError):
+            pass
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    @classmethod
+    def running(cls) -> bool:
+        return cls._ready
+
+    @classmethod
+    def bus(cls, key: Hashable) -> Optional[str]:
+        return cls._buses.get(key)
+
+    @classmethod
+    def _spawn(cls, generation: int, init_hardware: bool):
+        """ Starts a worker process for `generation` and waits for it to report ready """
+        started = time.monotonic()
+        # A fresh interpreter rather than a fork, which would copy locks held by other threads
+        ours, theirs = socket.socketpair()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'drivers.hardware_worker', str(theirs.fileno())],
+            pass_fds=(theirs.fileno(),), cwd=os.path.dirname(os.path.dirname(drivers.__file__))
+        )
+        theirs.close()
+        conn = Connection(ours.detach())
+
+        reply = None
+        try:
+            conn.send((cls._specs, init_hardware))
+            if conn.poll(DynConfig.hardware_worker_start_timeout_seconds):
+                reply = conn.recv()
+        except (EOFError, OSError):
+            pass
+        if reply is None or not reply[1]:
+            logger.error(f"Hardware worker failed to start: {reply[2] if reply else 'no response'}")
+            process.kill()
+            conn.close()
+            return
+
+        with cls._lock:
+            if generation != cls._generation:  # Stopped or restarted again meanwhile
+                process.kill()
+                conn.close()
+                return
+            cls._process, cls._conn, cls._buses = process, conn, reply[2]
+            cls._ready = True
+        threading.Thread(target=cls._read_replies, args=(conn, generation), name="Hardware Worker Replies",
+                         daemon=True).start()
+        if init_hardware:
+            cls.last_restart_seconds = time.monotonic() - started
+            for key, args in list(cls._outputs.items()):
+                try:
+                    cls.call(key, 'set_state', *args)
+                except HardwareWorkerError as e:
+                    logger.error(f"Could not restore {key} after restarting the hardware worker: {e}")
+        logger.info(f"Hardware worker started (pid {process.pid})")
+
+    @classmethod
+    def _respawn(cls, generation: int):
+        """ Keeps trying to bring the worker back up until it is, or it's stopped or restarted again """
+        while True:
+            cls._spawn(generation, init_hardware=True)
+            with cls._lock:
+                if cls._ready or generation != cls._generation:
+                    return
+            time.sleep(RESPAWN_DELAY_SECONDS)
+
+    @classmethod
+    def _read_replies(cls, conn, generation: int):
+        """ Resolves calls as their replies arrive; the connection is this thread's to close """
+        while True:
+            try:
+                call_id, ok, value = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                cls._restart(generation, "The hardware worker exited")
+                return
+            with cls._lock:
+                future = cls._pending.pop(call_id, None)
+            if future is not None:
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(HardwareWorkerError(value))
+
+    @classmethod
+    def _fail_pending(cls, error: Exception):
+        """ Fails every call in flight (caller holds the lock) """
+        pending, cls._pending = cls._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+
+    @classmethod
+    def _restart(cls, generation: int, reason: str):
+        """ Kills the worker of `generation`, if it is still the current one, and respawns it in the background """
+        with cls._lock:
+            if generation != cls._generation:
+                return
+            cls._generation += 1
+            cls._ready = False
+            process = cls._process
+            cls._process = cls._conn = None
+            cls._fail_pending(HardwareWorkerError(reason))
+            cls.restarts += 1
+            cls.last_restart_reason = reason
+            new_generation = cls._generation
+        logger.error(f"{reason}; restarting it")
+        if process is not None:
+            process.kill()
+            try:
+                process.wait(1.0)
+            except subprocess.TimeoutExpired:
+                pass  # Stuck in the kernel; it goes once the call returns
+        threading.Thread(target=cls._respawn, args=(new_generation,), name="Hardware Worker Restart",
+                         daemon=True).start()
+
+    @classmethod
+    def call(cls, key: Any, method: str, *args, timeout: Optional[float] = None) -> Any:
+        """ Calls `method` of the driver `key` in the worker and returns the result. Raises
+        HardwareWorkerTimeout (after restarting the worker) if it takes longer than `timeout`
+        seconds, or HardwareWorkerError if the worker is down or the driver raised. """
+        if timeout is None:
+            timeout = DynConfig.hardware_call_timeout_seconds
+        future = Future()
+        with cls._lock:
+            if method == 'set_state':
+                # Wanted even if this call fails: it's (re)applied once the worker is back up
+                cls._outputs[key] = args
+            if not cls._ready:
+                cls.failed_calls += 1
+                raise HardwareWorkerError("The hardware worker is not running")
+            call_id, cls._next_id = cls._next_id, cls._next_id + 1
+            cls._pending[call_id] = future
+            conn, generation = cls._conn, cls._generation
+            cls.calls += 1
+
+        start = time.monotonic()
+        try:
+            with cls._send_lock:
+                conn.send((call_id, key, method, args))
+        except (OSError, ValueError):
+            cls._restart(generation, "Lost the connection to the hardware worker")
+
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            cls.timeouts += 1
+            cls.failed_calls += 1
+            cls._restart(generation, f"Hardware call {method} on {key} missed its {timeout}s deadline")
+            raise HardwareWorkerTimeout(f"{method} on {key} timed out after {timeout}s") from None
+        except HardwareWorkerError:
+            cls.failed_calls += 1
+            raise
+        cls._latencies.append(time.monotonic() - start)
+        return result
+
+    @classmethod
+    def stats(cls) -> dict[str, Any]:
+        latencies = sorted(cls._latencies)
+        return {
+            'running': cls._ready,
+            'pid': cls._process.pid if cls._process is not None else None,
+            'calls': cls.calls,
+            'failed_calls': cls.failed_calls,
+            'timeouts': cls.timeouts,
+            'restarts': cls.restarts,
+            'last_restart_reason': cls.last_restart_reason,
+            'last_restart_seconds': cls.last_restart_seconds,
+            'latency_ms': {
+                'mean': 1000 * sum(latencies) / len(latencies),
+                'p95': 1000 * latencies[int(0.95 * (len(latencies) - 1))],
+                'max': 1000 * latencies[-1],
+            } if latencies else None,
+        }
+
+
+# Proxy drivers, which stand in for the drivers running in the worker
+
+class WorkerSensorDriver(BaseSensorDriver):
+    def __init__(self, key: Hashable):
+        super().__init__()
+        self.key = key
+
+    def hardware_init(self):
+        HardwareWorker.call(self.key, 'hardware_init')
+
+    def hardware_deinit(self):
+        HardwareWorker.call(self.key, 'hardware_deinit')
+
+    @property
+    def bus(self) -> Optional[str]:
+        return HardwareWorker.bus(self.key)
+
+    def read(self) -> float:
+        return HardwareWorker.call(self.key, 'read')
+
+    @classmethod
+    def read_batch(cls, drivers: list['WorkerSensorDriver']) -> list[float]:
+        # The worker splits the batch up by the actual driver types
+        return HardwareWorker.call([driver.key for driver in drivers], 'read_batch')
+
+
+class WorkerOutputDriver(BaseOutputDriver):
+    def __init__(self, key: Hashable):
+        super().__init__()
+        self.key = key
+
+    def hardware_init(self):
+        HardwareWorker.call(self.key, 'hardware_init')
+
+    def hardware_deinit(self):
+        HardwareWorker.call(self.key, 'hardware_deinit')
+
+    def set_state(self, state):
+        HardwareWorker.call(self.key, 'set_state', state)
+
+    def get_state(self):
+        return HardwareWorker.call(self.key, 'get_state')
+
+
+class WorkerLCDDriver(BaseLCDDriver):
+    def __init__(self, key: Hashable):
+        super().__init__()
+        self.key = key
+
+    def hardware_init(self):
+        HardwareWorker.call(self.key, 'hardware_init')
+
+    def hardware_deinit(self):
+        HardwareWorker.call(self.key, 'hardware_deinit')
+
+    def write_line(self, line_num, text):
+        HardwareWorker.call(self.key, 'write_line', line_num, text)
+
+    def clear(self):
+        HardwareWorker.call(self.key, 'clear')
+
+    def set_backlight(self, state):
+        HardwareWorker.call(self.key, 'set_backlight', state)
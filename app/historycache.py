@@ -0,0 +1,111 @@
+""" Result cache for /api/history
+
+Finished responses are kept by a normalized key of everything that shapes them, in LRU order
+and bounded by their total size. Each entry remembers the time range it covers, so that
+writes only invalidate the entries they can affect: new measurements land at "now" and only
+drop entries whose range reaches it, while closed historical ranges stay cached until a
+recalibration or a database downsample rewrites rows inside them.
+
+A response computed while an overlapping invalidation happened is not stored, so a slow query
+can never put back data that was just invalidated.
+"""
+
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Any, Hashable
+
+from app.dynconfig import DynConfig
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    mimetype: str
+    start: Optional[datetime]  # Range covered (naive local time); None is unbounded
+    end: Optional[datetime]
+
+
+def _overlaps(start: Optional[datetime], end: Optional[datetime], lo: Optional[datetime], hi: Optional[datetime]) -> bool:
+    return (end is None or lo is None or end >= lo) and (start is None or hi is None or start <= hi)
+
+
+class HistoryCache:
+    """ LRU cache of history responses with range-aware invalidation """
+
+    _lock = threading.Lock()
+    _entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+    _size: int = 0
+    _generation: int = 0
+    _invalidations: deque = deque(maxlen=64)  # Recent (generation, lo, hi)
+
+    # Counters
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidated: int = 0
+
+    @classmethod
+    def generation(cls) -> int:
+        """ Taken before computing a response and handed to `put` """
+        return cls._generation
+
+    @classmethod
+    def get(cls, key: Hashable) -> Optional[CachedResponse]:
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is None:
+                cls.misses += 1
+                return None
+            cls._entries.move_to_end(key)
+            cls.hits += 1
+            return entry
+
+    @classmethod
+    def put(cls, key: Hashable, entry: CachedResponse, generation: int):
+        """ Stores a response computed from data as of `generation` """
+        limit = DynConfig.history_cache_mb * 1024 * 1024
+        if len(entry.body) > limit / 4:
+            return  # Would evict most of the cache for a single response
+        with cls._lock:
+            if generation != cls._generation:
+                recent = [inv for inv in cls._invalidations if inv[0] > generation]
+                if len(recent) < cls._generation - generation \
+                        or any(_overlaps(entry.start, entry.end, lo, hi) for _, lo, hi in recent):
+                    return
+            if key in cls._entries:
+                cls._size -= len(cls._entries.pop(key).body)
+            cls._entries[key] = entry
+            cls._size += len(entry.body)
+            while cls._size > limit and cls._entries:
+                _, evicted = cls._entries.popitem(last=False)
+                cls._size -= len(evicted.body)
+                cls.evictions += 1
+
+    @classmethod
+    def invalidate(cls, lo: Optional[datetime] = None, hi: Optional[datetime] = None):
+        """ Drops every entry whose range overlaps [lo, hi] (naive local time; None is unbounded) """
+        with cls._lock:
+            cls._generation += 1
+            cls._invalidations.append((cls._generation, lo, hi))
+            stale = [key for key, entry in cls._entries.items() if _overlaps(entry.start, entry.end, lo, hi)]
+            for key in stale:
+                cls._size -= len(cls._entries.pop(key).body)
+            cls.invalidated += len(stale)
+
+    @classmethod
+    def clear(cls):
+        cls.invalidate()
+
+    @classmethod
+    def stats(cls) -> dict[str, Any]:
+        with cls._lock:
+            return {
+                'entries': len(cls._entries),
+                'bytes': cls._size,
+                'hits': cls.hits,
+                'misses': cls.misses,
+                'evictions': cls.evictions,
+                'invalidated': cls.invalidated,
+            }
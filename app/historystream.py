@@ -0,0 +1,155 @@
+""" Streaming history export
+
+Pages through the archive and then the live `Measurement` table in (timestamp, id) order using
+keyset cursors, so memory use stays constant however long the range, and emits the rows as
+NDJSON or CSV while it goes. A cursor is the `<timestamp>,<id>` of the last row a client
+received; passing it back resumes the stream right after that row.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Optional, Iterator
+import numpy as np
+from sqlalchemy import select, type_coerce, String, or_, and_
+
+from app import db
+from app.config import Config
+from app.models import Measurement
+from app.archive import Archive
+from app.dbpools import DBPools
+from app.rollups import RELAY_COLUMNS
+
+PAGE_ROWS = 5000
+
+
+def _utc_offsets(naive: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ The distinct UTC offsets (in minutes) of naive local timestamps, and which one applies to
+    each timestamp. The offset is worked out once per distinct hour rather than once per timestamp. """
+    hours, which = np.unique(naive.astype('datetime64[h]'), return_inverse=True)
+    offsets = np.array([
+        int(hour.replace(tzinfo=Config.TIMEZONE).utcoffset().total_seconds() // 60) for hour in hours.tolist()
+    ], dtype=np.int64)
+    return offsets, which
+
+
+def iso_timestamps(values: np.ndarray, unit: str = 'ms') -> list[str]:
+    """ Formats naive local timestamps as ISO strings with their UTC offset """
+    naive = np.asarray(values).astype(f'datetime64[{unit}]')
+    offsets, which = _utc_offsets(naive)
+    suffixes = np.array([f"{'+' if o >= 0 else '-'}{abs(o) // 60:02d}:{abs(o) % 60:02d}" for o in offsets.tolist()], dtype=str)
+    return np.char.add(np.datetime_as_string(naive, unit=unit), suffixes[which]).tolist()
+
+
+def epoch_milliseconds(values: np.ndarray) -> np.ndarray:
+    """ Naive local timestamps as int64 milliseconds since the Unix epoch """
+    naive = np.asarray(values).astype('datetime64[ms]')
+    offsets, which = _utc_offsets(naive)
+    return naive.astype(np.int64) - offsets[which] * 60_000
+
+
+def parse_cursor(cursor: str) -> tuple[datetime, int]:
+    """ (naive local timestamp, id) from a `<timestamp>,<id>` cursor. Raises ValueError if malformed. """
+    ts_str, id_str = cursor.rsplit(',', 1)
+    ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(Config.TIMEZONE).replace(tzinfo=None)
+    return ts, int(id_str)
+
+
+def _live_pages(start: Optional[datetime], end: Optional[datetime], columns: list[str],
+                after: Optional[tuple[datetime, int]], size: int) -> Iterator[dict[str, np.ndarray]]:
+    table = Measurement.__table__
+    timestamp = table.c.timestamp
+    if db.engine.dialect.name == 'sqlite':
+        timestamp = type_coerce(timestamp, String)  # Parsed in bulk by NumPy
+    while True:
+        stmt = select(timestamp, table.c.id, *[table.c[c] for c in columns])\
+            .order_by(table.c.timestamp, table.c.id).limit(size)
+        if start is not None:
+            stmt = stmt.where(table.c.timestamp >= start)
+        if end is not None:
+            stmt = stmt.where(table.c.timestamp <= end)
+        if after is not None:
+            stmt = stmt.where(or_(table.c.timestamp > after[0],
+                                  and_(table.c.timestamp == after[0], table.c.id > after[1])))
+        with DBPools.reading() as session:  # A connection per page, so no read transaction outlives it
+            rows = session.execute(stmt).all()
+        if not rows:
+            return
+        data = list(zip(*rows))
+        page = {'timestamp': np.array(data[0], dtype='datetime64[us]'), 'id': np.array(data[1], dtype=np.int64)}
+        for col, values in zip(columns, data[2:]):
+            values = np.array(values, dtype=np.float64)  # NULL -> NaN
+            page[col] = np.nan_to_num(values) > 0 if col in RELAY_COLUMNS else values
+        yield page
+        if len(rows) < size:
+            return
+        after = (page['timestamp'][-1].astype(datetime), int(page['id'][-1]))
+
+
+def iter_pages(start: Optional[datetime], end: Optional[datetime], columns: list[str],
+               after: Optional[tuple[datetime, int]] = None, size: int = PAGE_ROWS) -> Iterator[dict[str, np.ndarray]]:
+    """ The measurements with start <= timestamp <= end after the cursor position `after`, as
+    pages of at most `size` rows holding 'timestamp', 'id' and `columns`: archived months first,
+    then the live table. Requires an app context for as long as it's iterated. """
+    for chunk in Archive.iter_chunks(start, end, columns, after, size):
+        yield chunk
+        after = (chunk['timestamp'][-1].astype(datetime), int(chunk['id'][-1]))
+    yield from _live_pages(start, end, columns, after, size)
+
+
+def _page_records(page: dict[str, np.ndarray], names: dict[str, str]) -> tuple[list[str], list[list]]:
+    """ The page's timestamps and, column by column, its values with NaN as None """
+    values = []
+    for col in names:
+        column = page[col].astype(object)
+        if page[col].dtype.kind == 'f':
+            column[np.isnan(page[col])] = None
+        values.append(column.tolist())
+    return iso_timestamps(page['timestamp'], 'us'), values
+
+
+def ndjson_lines(pages: Iterator[dict[str, np.ndarray]], names: dict[str, str], limit: Optional[int] = None) -> Iterator[str]:
+    """ One JSON object per row with `names` mapping columns to keys, followed by a final
+    `{"cursor": ..., "done": ...}` line. `done` is false if the stream stopped at `limit` rows. """
+    cursor, sent, done = None, 0, True
+    for page in pages:
+        if limit is not None and sent + len(page['id']) > limit:
+            page = {col: values[:limit - sent] for col, values in page.items()}
+            done = False
+        timestamps, values = _page_records(page, names)
+        keys = list(names.values())
+        lines = [
+            json.dumps({'timestamp': ts, 'id': id_, **dict(zip(keys, row))})
+            for ts, id_, row in zip(timestamps, page['id'].tolist(), zip(*values))
+        ]
+        if lines:
+            cursor = f"{timestamps[-1]},{int(page['id'][-1])}"
+            sent += len(lines)
+            yield '\n'.join(lines) + '\n'
+        if not done:
+            break
+    yield json.dumps({'cursor': cursor, 'done': done}) + '\n'
+
+
+def csv_lines(pages: Iterator[dict[str, np.ndarray]], names: dict[str, str], limit: Optional[int] = None) -> Iterator[str]:
+    """ A header and one CSV row per measurement; the last row's `timestamp,id` is the cursor """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['timestamp', 'id'] + list(names.values()))
+    sent = 0
+    for page in pages:
+        if limit is not None:
+            page = {col: values[:limit - sent] for col, values in page.items()}
+        timestamps, values = _page_records(page, names)
+        writer.writerows([ts, id_, *row] for ts, id_, row in zip(timestamps, page['id'].tolist(), zip(*values)))
+        sent += len(timestamps)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if limit is not None and sent >= limit:
+            break
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,122 @@
+""" Sampling and storage of the host computer's health
+
+Slow polls tend to line up with the Pi throttling itself or its SD card filling up, so the
+host's CPU temperature, load, memory and disk use and throttle flags are recorded next to
+the measurements, in their own table, at their own low rate (`host_health_period_seconds`).
+The drivers (see `drivers.host_drivers`) only read procfs/sysfs files, so they run right in
+the scheduler job rather than in the hardware worker, and a metric that can't be read on
+this host is simply stored as None.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Optional
+from loguru import logger
+from sqlalchemy import select, delete, insert
+
+from app.config import Config
+from app.dbpools import DBPools
+from app.dynconfig import DynConfig
+from app.hardware_constants import HostMetricId
+from app.models import HostMetric
+from drivers.base_driver import BaseSensorDriver
+import drivers.host_drivers  # Register drivers
+
+
+class HostHealth:
+    """ Samples the host health drivers and keeps the samples in the DB """
+
+    _drivers: dict[HostMetricId, BaseSensorDriver] = {}
+    _failing: set[HostMetricId] = set()  # Metrics whose last read failed, so failures are logged once
+    latest: dict[HostMetricId, Optional[float]] = {}
+    latest_timestamp: Optional[datetime] = None
+
+    # Counters
+    samples: int = 0
+    rows_pruned: int = 0
+
+    @classmethod
+    def initialize_drivers(cls):
+        """ Builds the drivers from DynConfig; metrics without a usable config are left out """
+        cls._drivers = {}
+        for metric_id, (driver_name, params) in DynConfig.driver_host_metrics.items():
+            try:
+                cls._drivers[HostMetricId[metric_id]] = BaseSensorDriver.get_driver(driver_name)(params)
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Cannot set up host metric {metric_id} ({driver_name}): {e}")
+
+    @classmethod
+    def sample(cls) -> dict[HostMetricId, Optional[float]]:
+        """ Reads every host metric, with None for those that fail """
+        values = {}
+        for metric_id, driver in cls._drivers.items():
+            try:
+                values[metric_id] = driver.read()
+                cls._failing.discard(metric_id)
+            except Exception as e:
+                values[metric_id] = None
+                if metric_id not in cls._failing:
+                    cls._failing.add(metric_id)
+                    logger.warning(f"Cannot read host metric {metric_id.name}: {e}")
+        cls.latest = values
+        cls.latest_timestamp = datetime.now(Config.TIMEZONE).replace(tzinfo=None)
+        cls.samples += 1
+        return values
+
+    @classmethod
+    def record(cls):
+        """ Samples the metrics, stores them and drops samples past the retention period.
+        Requires an app context. """
+        values = cls.sample()
+        row = {'timestamp': cls.latest_timestamp, **{metric_id.value: value for metric_id, value in values.items()}}
+        cutoff = cls.latest_timestamp - timedelta(days=DynConfig.host_health_retention_days)
+        with DBPools.writing() as session:
+            session.execute(insert(HostMetric), [row])
+            cls.rows_pruned += session.execute(delete(HostMetric).where(HostMetric.timestamp < cutoff)).rowcount
+            session.commit()
+
+    @classmethod
+    def history(cls, start_local: Optional[datetime], end_local: Optional[datetime]) -> tuple[list[datetime], dict[str, list]]:
+        """ The stored samples in the range (naive local time; None is unbounded), as timestamps
+        and a list of values per metric. Requires an app context. """
+        table = HostMetric.__table__
+        stmt = select(table.c.timestamp, *[table.c[m.value] for m in HostMetricId]).order_by(table.c.timestamp)
+        if start_local is not None:
+            stmt = stmt.where(table.c.timestamp >= start_local)
+        if end_local is not None:
+            stmt = stmt.where(table.c.timestamp <= end_local)
+        with DBPools.reading() as session:
+            rows = session.execute(stmt).all()
+        columns = list(zip(*rows)) or [()] * (1 + len(HostMetricId))
+        return list(columns[0]), {m.name: list(col) for m, col in zip(HostMetricId, columns[1:])}
+
+    @classmethod
+    def schedule(cls, flask_app):
+        """ Sets up the drivers and schedules sampling every `host_health_period_seconds` """
+        from app import scheduler
+
+        cls.initialize_drivers()
+        if scheduler.get_job('host_health'):
+            scheduler.remove_job('host_health')
+        period = DynConfig.host_health_period_seconds
+        if not period or not cls._drivers:
+            return
+
+        def job():
+            with flask_app.app_context():
+                try:
+                    cls.record()
+                except Exception as e:
+                    logger.error(f"Error recording host health: {e}")
+
+        scheduler.add_job(id='host_health', func=job, trigger='interval', seconds=period,
+                          max_instances=1, coalesce=True, misfire_grace_time=int(period))
+
+    @classmethod
+    def stats(cls) -> dict[str, Any]:
+        return {
+            'metrics': {metric_id.name: value for metric_id, value in cls.latest.items()},
+            'timestamp': cls.latest_timestamp.isoformat() if cls.latest_timestamp else None,
+            'failing': sorted(metric_id.name for metric_id in cls._failing),
+            'samples': cls.samples,
+            'rows_pruned': cls.rows_pruned,
+        }
@@ -50,12 +50,82 @@ class Measurement(db.Model):
     relay_outside_1 = db.Column(db.Boolean)
     relay_outside_2 = db.Column(db.Boolean)
 
+class HostMetric(db.Model):
+    """ One sample of the host computer's health, to set against the measurements """
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, index=True)
+
+    # One column per HostMetricId; None where the metric couldn't be read
+    cpu_temp = db.Column(db.Float)
+    load_1m = db.Column(db.Float)
+    mem_used = db.Column(db.Float)
+    disk_used = db.Column(db.Float)
+    throttled = db.Column(db.Float)
+
 class CalibrationPoint(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sensor_id = db.Column(db.String(64), index=True) # e.g., 'v1', 't2'
     measured_val = db.Column(db.Float)
     actual_val = db.Column(db.Float)
 
+class MeasurementRollup(db.Model):
+    """ Aggregate of the measurements in one time bucket at one resolution """
+    __table_args__ = (db.UniqueConstraint('resolution', 'bucket'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    resolution = db.Column(db.Integer)  # Bucket width in seconds
+    bucket = db.Column(db.DateTime, index=True)  # Start of the bucket
+    count = db.Column(db.Integer)  # Measurements in the bucket
+
+    # Calibrated values: min/max/sum over the n non-null values (mean = sum / n)
+    v1_min = db.Column(db.Float)
+    v1_max = db.Column(db.Float)
+    v1_sum = db.Column(db.Float)
+    v1_n = db.Column(db.Integer)
+    i1_min = db.Column(db.Float)
+    i1_max = db.Column(db.Float)
+    i1_sum = db.Column(db.Float)
+    i1_n = db.Column(db.Integer)
+    t1_min = db.Column(db.Float)
+    t1_max = db.Column(db.Float)
+    t1_sum = db.Column(db.Float)
+    t1_n = db.Column(db.Integer)
+    v2_min = db.Column(db.Float)
+    v2_max = db.Column(db.Float)
+    v2_sum = db.Column(db.Float)
+    v2_n = db.Column(db.Integer)
+    i2_min = db.Column(db.Float)
+    i2_max = db.Column(db.Float)
+    i2_sum = db.Column(db.Float)
+    i2_n = db.Column(db.Integer)
+    t2_min = db.Column(db.Float)
+    t2_max = db.Column(db.Float)
+    t2_sum = db.Column(db.Float)
+    t2_n = db.Column(db.Integer)
+    t0_min = db.Column(db.Float)
+    t0_max = db.Column(db.Float)
+    t0_sum = db.Column(db.Float)
+    t0_n = db.Column(db.Integer)
+
+    # Number of measurements with each relay on (on-fraction = on / count)
+    relay_inside_1_on = db.Column(db.Integer)
+    relay_inside_2_on = db.Column(db.Integer)
+    relay_outside_1_on = db.Column(db.Integer)
+    relay_outside_2_on = db.Column(db.Integer)
+
+class RecalibrationJob(db.Model):
+    """ Progress of re-applying a changed calibration to stored measurements """
+    id = db.Column(db.Integer, primary_key=True)
+    sensor_id = db.Column(db.String(64), index=True)
+    created = db.Column(db.DateTime, default=lambda: datetime.now(Config.TIMEZONE))
+    since = db.Column(db.DateTime)  # Only measurements from here on are recalibrated
+    raw_min = db.Column(db.Float)  # Raw range whose calibration changed (None = unbounded)
+    raw_max = db.Column(db.Float)
+    last_id = db.Column(db.Integer, default=0)  # Keyset position: every row up to here is done
+    max_id = db.Column(db.Integer)  # Highest measurement id when the job was created (for progress)
+    rows_updated = db.Column(db.Integer, default=0)
+    status = db.Column(db.String(16), default='pending', index=True)  # pending, done
+
 class DailySummary(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, index=True, unique=True)
@@ -0,0 +1,228 @@
+""" Write-behind persistence of measurements
+
+Polls push finished rows onto an in-memory queue and return right away. A dedicated writer
+thread flushes the queue to the database, over its own connection (see `app.dbpools`), with a
+single bulk INSERT once enough rows have accumulated or the oldest row has waited long enough,
+so the SD card sees one commit per batch instead of one per poll, and the hardware lock is
+never held across a DB round-trip.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Optional, Any
+from loguru import logger
+from sqlalchemy import insert
+
+from app.models import Measurement
+from app.dbpools import DBPools
+from app.dynconfig import DynConfig
+from app.rollups import Rollups, naive_local
+from app.historycache import HistoryCache
+
+DROP_LOG_INTERVAL_SECONDS = 60.0  # After the first dropped row is logged, drops are summarized at most this often
+
+
+class MeasurementWriter:
+    """ Batches Measurement rows and writes them from a background thread """
+
+    _lock = threading.Condition()
+    _queue: deque = deque()
+    _oldest_enqueued: Optional[float] = None  # monotonic time the oldest queued row was added
+    _thread: Optional[threading.Thread] = None
+    _stopping: bool = False
+    _flushing: int = 0  # Callers of `flush` waiting for the queue to be written
+    _in_flight: bool = False  # A batch taken off the queue is being written
+    _flask_app = None
+    _drop_logged: Optional[float] = None  # monotonic time drops were last logged
+    _drops_unlogged: int = 0
+
+    # Counters
+    rows_written: int = 0
+    rows_dropped: int = 0
+    flushes: int = 0
+    failed_flushes: int = 0
+    last_batch_size: int = 0
+    last_flush_seconds: Optional[float] = None
+    max_flush_seconds: float = 0.0
+
+    @classmethod
+    def start(cls, flask_app):
+        """ Starts the writer thread. Until this is called, rows are written synchronously. """
+        with cls._lock:
+            if cls._thread is not None and cls._thread.is_alive():
+                return
+            cls._flask_app = flask_app
+            cls._stopping = False
+            cls._thread = threading.Thread(target=cls._run, name="Measurement Writer", daemon=True)
+            cls._thread.start()
+
+    @classmethod
+    def running(cls) -> bool:
+        return cls._thread is not None and cls._thread.is_alive() and not cls._stopping
+
+    @classmethod
+    def enqueue(cls, row: dict[str, Any]):
+        """ Queues one measurement row (a dict of Measurement column values) for writing """
+        if not cls.running():
+            cls._write([row])
+            return
+
+        with cls._lock:
+            max_depth = DynConfig.persist_queue_max
+            while len(cls._queue) >= max_depth:
+                cls._queue.popleft()
+                cls._count_drops(1, "the queue is full")
+            if not cls._queue:
+                cls._oldest_enqueued = time.monotonic()
+            cls._queue.append(row)
+            if len(cls._queue) >= DynConfig.persist_batch_size:
+                cls._lock.notify()
+
+    @classmethod
+    def stop(cls, timeout: float = 10.0):
+        """ Stops the writer thread after it has flushed everything still queued """
+        with cls._lock:
+            cls._stopping = True
+            cls._lock.notify()
+        if cls._thread is not None:
+            cls._thread.join(timeout)
+            if cls._thread.is_alive():
+                logger.error(f"Measurement writer did not finish flushing within {timeout}s")
+            else:
+                logger.info("Measurement writer flushed and stopped.")
+
+    @classmethod
+    def flush(cls, timeout: float = 10.0) -> bool:
+        """ Writes everything queued so far right away, waiting up to `timeout` seconds for it.
+        False if that didn't happen (e.g. the DB is unavailable). """
+        if not cls.running():
+            return True  # Rows are written synchronously
+        deadline = time.monotonic() + timeout
+        with cls._lock:
+            cls._flushing += 1
+            cls._lock.notify_all()
+            try:
+                while cls._queue or cls._in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not cls.running():
+                        return False
+                    cls._lock.wait(remaining)
+                return True
+            finally:
+                cls._flushing -= 1
+
+    @classmethod
+    def stats(cls) -> dict[str, Any]:
+        with cls._lock:
+            oldest = None if cls._oldest_enqueued is None or not cls._queue \
+                else time.monotonic() - cls._oldest_enqueued
+            return {
+                'running': cls.running(),
+                'queue_depth': len(cls._queue),
+                'oldest_pending_seconds': oldest,
+                'rows_written': cls.rows_written,
+                'rows_dropped': cls.rows_dropped,
+                'flushes': cls.flushes,
+                'failed_flushes': cls.failed_flushes,
+                'last_batch_size': cls.last_batch_size,
+                'last_flush_seconds': cls.last_flush_seconds,
+                'max_flush_seconds': cls.max_flush_seconds,
+            }
+
+    @classmethod
+    def _due(cls) -> bool:
+        """ Whether the queue has hit its size or age threshold (caller holds the lock) """
+        if not cls._queue:
+            return False
+        if cls._stopping or cls._flushing or len(cls._queue) >= DynConfig.persist_batch_size:
+            return True
+        return time.monotonic() - cls._oldest_enqueued >= DynConfig.persist_flush_interval_seconds
+
+    @classmethod
+    def _run(cls):
+        while True:
+            with cls._lock:
+                while not cls._due() and not cls._stopping:
+                    timeout = DynConfig.persist_flush_interval_seconds
+                    if cls._queue:
+                        timeout -= time.monotonic() - cls._oldest_enqueued
+                    cls._lock.wait(max(0.05, timeout))
+                batch = list(cls._queue)
+                cls._queue.clear()
+                cls._oldest_enqueued = None
+                cls._in_flight = bool(batch)
+                stopping = cls._stopping
+
+            if batch:
+                try:
+                    with cls._flask_app.app_context():
+                        if not cls._write(batch):
+                            cls._requeue(batch)
+                finally:
+                    with cls._lock:
+                        cls._in_flight = False
+                        cls._lock.notify_all()
+            if stopping:
+                return
+
+    @classmethod
+    def _requeue(cls, batch: list[dict[str, Any]]):
+        """ Puts a batch that failed to write back at the front of the queue """
+        with cls._lock:
+            if cls._stopping:
+                cls._count_drops(len(batch), "the writer stopped before it could write them")
+                return
+            combined = batch + list(cls._queue)
+            overflow = max(0, len(combined) - DynConfig.persist_queue_max)
+            if overflow:
+                cls._count_drops(overflow, "the queue is full")
+            cls._queue = deque(combined[overflow:])
+            cls._oldest_enqueued = time.monotonic()
+
+    @classmethod
+    def _count_drops(cls, count: int, reason: str):
+        """ Counts rows lost without being written, logging the first loss right away and later
+        ones at most every `DROP_LOG_INTERVAL_SECONDS`. Called with `_lock` held. """
+        cls.rows_dropped += count
+        cls._drops_unlogged += count
+        now = time.monotonic()
+        if cls._drop_logged is None or now - cls._drop_logged >= DROP_LOG_INTERVAL_SECONDS:
+            logger.warning(f"Dropped {cls._drops_unlogged} measurement row(s) because {reason} "
+                           f"({cls.rows_dropped} in all, queue limit {DynConfig.persist_queue_max})")
+            cls._drop_logged = now
+            cls._drops_unlogged = 0
+
+    @classmethod
+    def _write(cls, rows: list[dict[str, Any]]) -> bool:
+        """ Writes rows with one executemany INSERT on the writer connection. Requires an app context. """
+        start = time.monotonic()
+        with Rollups.lock, DBPools.writing() as session:
+            try:
+                session.execute(insert(Measurement), rows)
+                session.commit()
+            except Exception as e:
+                logger.error(f"Error saving {len(rows)} measurement(s) to DB: {e}")
+                session.rollback()
+                cls.failed_flushes += 1
+                return False
+
+            # The measurements are safe; a failure here only leaves the rollups short of this batch
+            try:
+                Rollups.add_rows(rows, session)
+                session.commit()
+            except Exception as e:
+                logger.error(f"Error rolling up {len(rows)} measurement(s): {e}")
+                session.rollback()
+
+        # Only cached history reaching the new rows' timestamps is affected
+        timestamps = [naive_local(row['timestamp']) for row in rows if row.get('timestamp') is not None]
+        HistoryCache.invalidate(min(timestamps, default=None), None)
+
+        duration = time.monotonic() - start
+        cls.flushes += 1
+        cls.rows_written += len(rows)
+        cls.last_batch_size = len(rows)
+        cls.last_flush_seconds = duration
+        cls.max_flush_seconds = max(cls.max_flush_seconds, duration)
+        return True
@@ -0,0 +1,206 @@
+""" Retroactive recalibration of stored measurements
+
+When a calibration point is added or removed, the `*_cal` columns of the stored measurements
+are recomputed from their `*_raw` columns in the background. Only rows whose raw value lies in
+the range where the old and new calibration curves actually differ are touched.
+
+The work is a `RecalibrationJob` row that records its keyset position (the last measurement id
+done) in the same transaction as each chunk of updates, so a restart picks up where it left
+off. Chunks are kept small and separated by a pause so the measurement writer is never kept
+waiting on the database for long.
+"""
+
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Any
+import numpy as np
+from loguru import logger
+from sqlalchemy import select, update, func
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from app.config import Config
+from app.dbpools import DBPools
+from app.models import Measurement, RecalibrationJob
+from app.calibration import CalibrationRegistry, CompiledCalibration
+from app.hardware_constants import SensorId
+from app.dynconfig import DynConfig
+from app.rollups import Rollups
+from app.historycache import HistoryCache
+from app.persistence import MeasurementWriter
+
+
+def changed_range(old: CompiledCalibration, new: CompiledCalibration) -> Optional[tuple[float, float]]:
+    """ The raw range over which two calibration curves differ, as (min, max) with infinite bounds
+    where an extrapolated end changed, or None if they are identical """
+    xs = np.union1d(old.measured, new.measured)
+    if len(xs) == 0:
+        return None
+
+    # Between neighbouring breakpoints (and beyond the ends) both curves are straight lines, and
+    # two distinct lines agree in at most one point, so two probes per interval tell if they differ.
+    edges = np.concatenate(([-math.inf], xs, [math.inf]))
+    left, right = xs[:-1], xs[1:]
+    probes = np.concatenate((
+        [xs[0] - 2.0, xs[0] - 1.0],
+        left + (right - left) / 3, left + 2 * (right - left) / 3,
+        [xs[-1] + 1.0, xs[-1] + 2.0]
+    ))
+    differs = ~np.isclose(old.apply(probes), new.apply(probes), rtol=1e-12, atol=1e-12)
+    if not differs.any():
+        return None
+
+    # The interval [edges[i], edges[i+1]] holding each differing probe
+    intervals = np.searchsorted(xs, probes[differs], side='right')
+    return float(edges[intervals.min()]), float(edges[intervals.max() + 1])
+
+
+class Recalibrator:
+    """ Runs RecalibrationJobs one at a time on a background thread """
+
+    _lock = threading.Condition()
+    _thread: Optional[threading.Thread] = None
+    _stopping: bool = False
+    _flask_app = None
+
+    @classmethod
+    def start(cls, flask_app):
+        """ Starts the worker thread, resuming any unfinished jobs """
+        with cls._lock:
+            if cls._thread is not None and cls._thread.is_alive():
+                return
+            cls._flask_app = flask_app
+            cls._stopping = False
+            cls._thread = threading.Thread(target=cls._run, name="Recalibration", daemon=True)
+            cls._thread.start()
+
+    @classmethod
+    def stop(cls, timeout: float = 10.0):
+        with cls._lock:
+            cls._stopping = True
+            cls._lock.notify()
+        if cls._thread is not None:
+            cls._thread.join(timeout)
+
+    @classmethod
+    def calibration_changed(cls, sensor: SensorId, old: CompiledCalibration) -> Optional[RecalibrationJob]:
+        """ Queues recalibration of the stored measurements after `sensor`'s calibration went
+        from `old` to the current one. Requires an app context. """
+        span = changed_range(old, CalibrationRegistry.get_table(sensor))
+        if span is None:
+            return None
+
+        # Readings still queued for the DB carry the old calibration, and the job only covers
+        # the rows that exist now
+        if not MeasurementWriter.flush():
+            logger.warning("Could not write the queued measurements before recalibrating")
+        job = RecalibrationJob(
+            sensor_id=sensor.value,
+            since=datetime.now(Config.TIMEZONE).replace(tzinfo=None) - timedelta(days=DynConfig.recalibration_days),
+            raw_min=span[0] if math.isfinite(span[0]) else None,
+            raw_max=span[1] if math.isfinite(span[1]) else None,
+            last_id=0,
+            max_id=db.session.scalar(select(func.max(Measurement.id))) or 0,
+            rows_updated=0,
+            status='pending'
+        )
+        db.session.add(job)
+        db.session.commit()
+        logger.info(f"Queued recalibration of {sensor.name} for raw values in [{span[0]}, {span[1]}]")
+
+        with cls._lock:
+            cls._lock.notify()
+        return job
+
+    @classmethod
+    def progress(cls, job: RecalibrationJob) -> dict[str, Any]:
+        return {
+            'id': job.id,
+            'sensor': SensorId(job.sensor_id).name,
+            'status': job.status,
+            'raw_min': job.raw_min,
+            'raw_max': job.raw_max,
+            'rows_updated': job.rows_updated,
+            'fraction_done': 1.0 if job.status == 'done' or not job.max_id else min(1.0, job.last_id / job.max_id),
+        }
+
+    @classmethod
+    def stats(cls) -> dict[str, Any]:
+        """ Progress of the unfinished jobs (requires an app context) """
+        jobs = RecalibrationJob.query.filter_by(status='pending').order_by(RecalibrationJob.id).all()
+        return {
+            'running': cls._thread is not None and cls._thread.is_alive(),
+            'jobs': [cls.progress(job) for job in jobs],
+        }
+
+    @classmethod
+    def _run(cls):
+        while not cls._stopping:
+            try:
+                with cls._flask_app.app_context():
+                    job = RecalibrationJob.query.filter_by(status='pending').order_by(RecalibrationJob.id).first()
+                    if job is not None:
+                        cls.run_job(job)
+                        continue
+            except Exception as e:
+                logger.error(f"Error while recalibrating measurements: {e}")
+                time.sleep(5.0)
+                continue
+
+            with cls._lock:
+                if not cls._stopping:
+                    cls._lock.wait(60.0)
+
+    @classmethod
+    def run_job(cls, job: RecalibrationJob):
+        """ Works through a job chunk by chunk until it's done (or the worker is stopped).
+        Requires an app context. """
+        sensor = SensorId(job.sensor_id)
+        raw_col = getattr(Measurement, f"{sensor.value}_raw")
+        cal_name = f"{sensor.value}_cal"
+
+        while not cls._stopping:
+            query = select(Measurement.id, raw_col)\
+                .where(Measurement.id > job.last_id, Measurement.id <= job.max_id,
+                       Measurement.timestamp >= job.since, raw_col.is_not(None))
+            if job.raw_min is not None:
+                query = query.where(raw_col >= job.raw_min)
+            if job.raw_max is not None:
+                query = query.where(raw_col <= job.raw_max)
+            with DBPools.reading() as session:
+                rows = session.execute(query.order_by(Measurement.id).limit(DynConfig.recalibration_chunk_size)).all()
+
+            position = {'last_id': job.last_id, 'rows_updated': job.rows_updated, 'status': job.status}
+            with DBPools.writing() as session:
+                try:
+                    if rows:
+                        ids = [row[0] for row in rows]
+                        # Always the latest table, so a later edit can't be undone by an earlier job
+                        cald = CalibrationRegistry.get_table(sensor).apply(np.array([row[1] for row in rows]))
+                        session.execute(
+                            update(Measurement),
+                            [{'id': id_, cal_name: value} for id_, value in zip(ids, cald.tolist())]
+                        )
+                        position['last_id'] = ids[-1]
+                        position['rows_updated'] += len(ids)
+                    else:
+                        position['status'] = 'done'
+                    # The updates and the job's position together
+                    session.execute(update(RecalibrationJob).where(RecalibrationJob.id == job.id).values(**position))
+                    session.commit()
+                except Exception:
+                    session.rollback()
+                    raise
+            for key, value in position.items():
+                set_committed_value(job, key, value)  # Already stored, so not for the app's session to write
+            if rows:
+                HistoryCache.invalidate(job.since, None)
+
+            if job.status == 'done':
+                logger.info(f"Recalibrated {job.rows_updated} measurement(s) of {sensor.name}")
+                if job.rows_updated:
+                    Rollups.rebuild(job.since)
+                return
+            time.sleep(DynConfig.recalibration_pause_seconds)
@@ -10,6 +10,9 @@ from time import sleep
 from app.config import Config
 from loguru import logger
 from flask import current_app
+from typing import Optional
+import time
+from app.rolling import RollingWindow
 
 class Regulator:
     """ Singleton that handles overall regulation of things """
@@ -25,6 +28,10 @@ class Regulator:
     def __init__(self):
         if not Regulator._initialized:
             self._status_repr = "~ Regulator hook not yet executed. ~"
+            self._status_repr1 = ""
+            self._windows: dict[SensorId, RollingWindow] = {}  # Regulation windows of the tank temperatures
+            self._window_seqs: dict[SensorId, int] = {}  # Next ring buffer reading to feed into each window
+            self._last_switched: dict[RelayId, float] = {}  # When the thermostat last changed each relay
             Regulator._initialized = True
 
     def schedule_regulation(self, app):
@@ -58,6 +65,65 @@ class Regulator:
         window = light_window()
         return window[0] < datetime.now(Config.TIMEZONE) < window[1]
 
+    def _tank_temp(self, sensor_id: SensorId) -> Optional[float]:
+        """ The temperature to regulate on: the latest reading, or a statistic of the readings
+        in the regulation window. None if there is nothing usable. """
+        seconds = DynConfig.regulation_window_seconds
+        if not seconds:
+            reading = HardwareState.cur_sensor_values[sensor_id]
+            return reading.cald if reading is not None else None
+
+        window = self._windows.get(sensor_id)
+        trim = DynConfig.regulation_trim_proportion
+        if window is None or window.seconds != seconds or window.trim != trim:
+            window = self._windows[sensor_id] = RollingWindow(seconds, trim)
+            self._window_seqs[sensor_id] = 0  # Backfill from the ring buffer
+
+        # Feed only the readings that arrived since the last tick
+        new, self._window_seqs[sensor_id] = HardwareState.recent(sensor_id).since(self._window_seqs[sensor_id])
+        for monotonic, cal in zip(new.monotonic, new.cal):
+            window.add(float(monotonic), float(cal))
+        window.expire(time.monotonic())
+
+        if DynConfig.regulation_statistic == "trimmed_mean":
+            return window.trimmed_mean()
+        return window.median()
+
+    def _switch_circuit(self, relay: RelayId, state: bool) -> bool:
+        """ Sets a circuit relay for the thermostat, unless it changed less than the minimum dwell
+        time ago. Returns False if the change was held back. """
+        if state != HardwareState.get_relay_state(relay):
+            last = self._last_switched.get(relay)
+            if last is not None and time.monotonic() - last < DynConfig.regulation_min_dwell_seconds:
+                return False
+            self._last_switched[relay] = time.monotonic()
+        HardwareState.try_set_relay(relay, state)  # If the worker is down, it applies this once it's back
+        return True
+
+    def _regulate_circuit(self, name: str, enabled: bool, relay: RelayId, sensor_id: SensorId,
+                          target_temp: float) -> str:
+        """ Runs the thermostat for one circuit, returning its status line """
+        if not enabled:  # If circuit is "turned off"
+            HardwareState.try_set_relay(relay, False)
+            return f"{name}:  Disabled => Circuit OFF."
+
+        # Check temperature
+        current_temp = self._tank_temp(sensor_id)
+        if current_temp is None:
+            HardwareState.try_set_relay(relay, False)
+            return f"{name}:  Bad/nonexistent sensor reading."
+
+        hysteresis = DynConfig.temp_hysteresis
+        if current_temp < (target_temp - hysteresis):
+            if self._switch_circuit(relay, True):
+                return f"{name}:  Fell below target-hysteresis => Circuit ON."
+            return f"{name}:  Fell below target-hysteresis, holding for minimum dwell."
+        elif current_temp > target_temp:
+            if self._switch_circuit(relay, False):
+                return f"{name}:  Above target temp => Circuit OFF."
+            return f"{name}:  Above target temp, holding for minimum dwell."
+        return f"{name}:  Within hysteresis band => No change."
+
     def get_status_str(self) -> str:
         """ Returns a human-readable string describing the current regulation "decision" """
         return self._status_repr
@@ -75,58 +141,24 @@ class Regulator:
             for relay in RelayId:
                 if DynConfig.gfci_always_on and (relay == RelayId.gfci1 or relay == RelayId.gfci2):
                     continue
-                HardwareState.set_relay(relay, False)
+                HardwareState.try_set_relay(relay, False)
             return  # no more until the morning.
 
         # Circuit 1 regulation
-        if DynConfig.circuit_states[0]:  # If circuit is "turned on"
-            # Check temperature
-            reading = HardwareState.cur_sensor_values[SensorId.t1]
-            if reading is None:
-                self._status_repr1 = "C1:  Bad/nonexistent sensor reading."
-                HardwareState.set_relay(RelayId.circ1, False)
-            else:
-                current_temp = reading.cald
-                target_temp = DynConfig.target_temp_tank1_f
-                hysteresis = DynConfig.temp_hysteresis
-                
-                if current_temp < (target_temp - hysteresis):
-                    self._status_repr1 = "C1:  Fell below target-hysteresis => Circuit ON."
-                    HardwareState.set_relay(RelayId.circ1, True)
-                elif current_temp > target_temp:
-                    self._status_repr1 = "C1:  Above target temp => Circuit OFF."
-                    HardwareState.set_relay(RelayId.circ1, False)
-        else:
-            self._status_repr1 = "C1:  Disabled => Circuit OFF."
-            HardwareState.set_relay(RelayId.circ1, False)
-        
+        self._status_repr1 = self._regulate_circuit(
+            "C1", DynConfig.circuit_states[0], RelayId.circ1, SensorId.t1, DynConfig.target_temp_tank1_f
+        )
+
         # Ensure GFCI is ON if always_on is set
         if DynConfig.gfci_always_on:
-            HardwareState.set_relay(RelayId.gfci1, True)
-            HardwareState.set_relay(RelayId.gfci2, True)
+            HardwareState.try_set_relay(RelayId.gfci1, True)
+            HardwareState.try_set_relay(RelayId.gfci2, True)
 
         self._status_repr1 += "\n"
 
         # Circuit 2 regulation
-        if DynConfig.circuit_states[1]:  # If circuit is "turned on"
-            # Check temperature
-            reading = HardwareState.cur_sensor_values[SensorId.t2]
-            if reading is None:
-                self._status_repr1 += "C2:  Bad/nonexistent sensor reading."
-                HardwareState.set_relay(RelayId.circ2, False)
-            else:
-                current_temp = reading.cald
-                target_temp = DynConfig.target_temp_tank2_f
-                hysteresis = DynConfig.temp_hysteresis
-                
-                if current_temp < (target_temp - hysteresis):
-                    self._status_repr1 += "C2:  Fell below target-hysteresis => Circuit ON."
-                    HardwareState.set_relay(RelayId.circ2, True)
-                elif current_temp > target_temp:
-                    self._status_repr1 += "C2:  Above target temp => Circuit OFF."
-                    HardwareState.set_relay(RelayId.circ2, False)
-        else:
-            self._status_repr1 += "C2:  Disabled => Circuit OFF."
-            HardwareState.set_relay(RelayId.circ2, False) 
+        self._status_repr1 += self._regulate_circuit(
+            "C2", DynConfig.circuit_states[1], RelayId.circ2, SensorId.t2, DynConfig.target_temp_tank2_f
+        )
 
         self._status_repr = self._status_repr1 + f"\n\nLast updated {datetime.now(Config.TIMEZONE).isoformat()}"
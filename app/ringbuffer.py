@@ -0,0 +1,192 @@
+""" Fixed-size in-memory history of recent sensor readings
+
+Each sensor gets a `SensorRingBuffer` of preallocated numpy arrays holding (timestamp,
+monotonic time, raw, calibrated) for its last `depth` readings. There is a single writer (the
+sampling loop, which holds the hardware lock while pushing), while readers take no lock at all:
+a sequence counter that is odd during a write lets them detect a torn read and simply retry.
+
+Rolling statistics over the buffer's contents are maintained as readings come and go, so
+`mean`, `min`, `max` and `slope` are O(1) regardless of the depth.
+"""
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+
+
+@dataclass(frozen=True)
+class RingSnapshot:
+    """ A consistent copy of a ring buffer's contents, oldest first """
+    timestamp: np.ndarray   # Unix epoch seconds
+    monotonic: np.ndarray   # time.monotonic() at acquisition
+    raw: np.ndarray
+    cal: np.ndarray
+
+    def __len__(self):
+        return len(self.cal)
+
+
+@dataclass(frozen=True)
+class RingStats:
+    """ Rolling statistics of the calibrated values in a ring buffer """
+    count: int
+    mean: Optional[float]
+    min: Optional[float]
+    max: Optional[float]
+    slope: Optional[float]  # Calibrated units per second, least squares over the buffer
+
+
+class SensorRingBuffer:
+    """ Preallocated, array-backed history of the last `depth` readings of one sensor """
+
+    def __init__(self, depth: int):
+        if depth < 1:
+            raise ValueError("Ring buffer depth must be at least 1")
+        self.depth = depth
+        self._timestamp = np.zeros(depth)
+        self._monotonic = np.zeros(depth)
+        self._raw = np.zeros(depth)
+        self._cal = np.zeros(depth)
+        self._written = 0   # Total readings ever pushed; the next slot is _written % depth
+        self._seq = 0       # Odd while a push is in progress
+        self._write_lock = threading.Lock()
+
+        # Running sums for mean/slope. Times are taken relative to _t0 to keep them small
+        self._t0: Optional[float] = None
+        self._sum_t = self._sum_y = self._sum_tt = self._sum_ty = 0.0
+        # Monotonic deques of (sequence number, value) for the rolling min/max
+        self._mins: deque[tuple[int, float]] = deque()
+        self._maxs: deque[tuple[int, float]] = deque()
+
+    def __len__(self):
+        return min(self._written, self.depth)
+
+    def push(self, timestamp: float, monotonic: float, raw: float, cal: float):
+        """ Appends a reading, overwriting the oldest one if the buffer is full """
+        with self._write_lock:
+            self._seq += 1
+            try:
+                n = self._written
+                slot = n % self.depth
+                if n >= self.depth:
+                    self._forget(self._monotonic[slot], self._cal[slot])
+                if self._t0 is None:
+                    self._t0 = monotonic
+
+                self._timestamp[slot] = timestamp
+                self._monotonic[slot] = monotonic
+                self._raw[slot] = raw
+                self._cal[slot] = cal
+                self._remember(n, monotonic, cal)
+                self._written = n + 1
+
+                # Re-base the running sums once per lap so rounding errors can't accumulate
+                if self._written % self.depth == 0:
+                    self._resum()
+            finally:
+                self._seq += 1
+
+    def _remember(self, n: int, monotonic: float, cal: float):
+        t = monotonic - self._t0
+        self._sum_t += t
+        self._sum_y += cal
+        self._sum_tt += t * t
+        self._sum_ty += t * cal
+
+        while self._mins and self._mins[-1][1] >= cal:
+            self._mins.pop()
+        self._mins.append((n, cal))
+        while self._maxs and self._maxs[-1][1] <= cal:
+            self._maxs.pop()
+        self._maxs.append((n, cal))
+
+        oldest = n - self.depth + 1
+        while self._mins[0][0] < oldest:
+            self._mins.popleft()
+        while self._maxs[0][0] < oldest:
+            self._maxs.popleft()
+
+    def _forget(self, monotonic: float, cal: float):
+        t = monotonic - self._t0
+        self._sum_t -= t
+        self._sum_y -= cal
+        self._sum_tt -= t * t
+        self._sum_ty -= t * cal
+
+    def _resum(self):
+        self._t0 = float(self._monotonic.min())
+        t = self._monotonic - self._t0
+        self._sum_t = float(t.sum())
+        self._sum_y = float(self._cal.sum())
+        self._sum_tt = float((t * t).sum())
+        self._sum_ty = float((t * self._cal).sum())
+
+    def _consistent(self, read):
+        """ Runs `read` until it completes without a push happening concurrently """
+        while True:
+            seq = self._seq
+            if seq % 2 == 0:
+                try:
+                    result = read()
+                except IndexError:
+                    pass  # Saw the min/max deques mid-update
+                else:
+                    if self._seq == seq:
+                        return result
+            time.sleep(0)  # Let the writer finish
+
+    def snapshot(self, seconds: Optional[float] = None) -> RingSnapshot:
+        """ Copies the buffer (or only readings acquired in the last `seconds`), oldest first """
+        def read():
+            n = self._written
+            count = min(n, self.depth)
+            order = (np.arange(n - count, n) % self.depth)
+            return RingSnapshot(self._timestamp[order], self._monotonic[order], self._raw[order], self._cal[order])
+
+        snap = self._consistent(read)
+        if seconds is not None and len(snap):
+            keep = snap.monotonic >= snap.monotonic[-1] - seconds
+            snap = RingSnapshot(snap.timestamp[keep], snap.monotonic[keep], snap.raw[keep], snap.cal[keep])
+        return snap
+
+    @property
+    def written(self) -> int:
+        """ Total number of readings ever pushed; reading `n` has sequence number n """
+        return self._written
+
+    def since(self, seq: int) -> tuple[RingSnapshot, int]:
+        """ Copies the readings with sequence numbers from `seq` on that are still in the buffer,
+        along with the sequence number to pass next time to get only newer readings """
+        def read():
+            n = self._written
+            start = seq if seq <= n else 0  # A sequence number from a buffer since replaced
+            order = np.arange(max(start, n - self.depth), n) % self.depth
+            return RingSnapshot(self._timestamp[order], self._monotonic[order], self._raw[order], self._cal[order]), n
+        return self._consistent(read)
+
+    def stats(self) -> RingStats:
+        """ Rolling mean/min/max/slope of the calibrated values currently in the buffer """
+        def read():
+            count = len(self)
+            if count == 0:
+                return RingStats(0, None, None, None, None)
+            denominator = count * self._sum_tt - self._sum_t ** 2
+            slope = (count * self._sum_ty - self._sum_t * self._sum_y) / denominator \
+                if count > 1 and denominator > 1e-12 else None
+            return RingStats(count, self._sum_y / count, self._mins[0][1], self._maxs[0][1], slope)
+        return self._consistent(read)
+
+    def mean(self) -> Optional[float]:
+        return self.stats().mean
+
+    def min(self) -> Optional[float]:
+        return self.stats().min
+
+    def max(self) -> Optional[float]:
+        return self.stats().max
+
+    def slope(self) -> Optional[float]:
+        return self.stats().slope
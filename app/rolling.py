@@ -0,0 +1,100 @@
+""" Incrementally maintained statistics over a sliding time window """
+
+import math
+from bisect import bisect_left, bisect_right
+from collections import deque
+from typing import Optional
+
+
+class RollingWindow:
+    """ The values seen in the last `seconds`, kept both in arrival order and sorted.
+
+    Each update touches only the values entering and leaving the window: the median is an
+    index into the sorted values, and the trimmed mean's sum is adjusted at its boundaries
+    rather than re-summed, so the cost per tick does not grow with the window length.
+    """
+
+    def __init__(self, seconds: float, trim: float = 0.2):
+        if not 0.0 <= trim < 0.5:
+            raise ValueError("Trim proportion must be in [0, 0.5)")
+        self.seconds = seconds
+        self.trim = trim
+        self._arrivals: deque[tuple[float, float]] = deque()  # (monotonic, value), oldest first
+        self._sorted: list[float] = []
+        # The trimmed mean is _mid_sum over _sorted[_lo:_hi]
+        self._lo = self._hi = 0
+        self._mid_sum = 0.0
+        self._updates = 0
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def add(self, monotonic: float, value: float):
+        """ Adds a value acquired at `monotonic`, then expires values older than the window """
+        if not math.isfinite(value):
+            return
+        self._arrivals.append((monotonic, value))
+        i = bisect_right(self._sorted, value)
+        self._sorted.insert(i, value)
+        if i < self._lo or (i == self._lo and self._lo < self._hi):
+            # Lands before the trimmed range (or at its start), shifting it up by one
+            self._lo += 1
+            self._hi += 1
+        elif i < self._hi:
+            self._mid_sum += value
+            self._hi += 1
+        self._rebalance()
+        self.expire(monotonic)
+
+    def expire(self, now: float):
+        """ Drops values acquired more than `seconds` before `now` """
+        while self._arrivals and self._arrivals[0][0] < now - self.seconds:
+            _, value = self._arrivals.popleft()
+            i = bisect_left(self._sorted, value)
+            del self._sorted[i]
+            if i < self._lo:
+                self._lo -= 1
+                self._hi -= 1
+            elif i < self._hi:
+                self._mid_sum -= value
+                self._hi -= 1
+            self._rebalance()
+
+    def _rebalance(self):
+        """ Moves the trimmed range's boundaries to where they belong for the current size """
+        n = len(self._sorted)
+        k = int(self.trim * n)
+        lo, hi = k, n - k
+        # Widen first, then narrow, so the tracked range never inverts
+        while self._lo > lo:
+            self._lo -= 1
+            self._mid_sum += self._sorted[self._lo]
+        while self._hi < hi:
+            self._mid_sum += self._sorted[self._hi]
+            self._hi += 1
+        while self._lo < lo:
+            self._mid_sum -= self._sorted[self._lo]
+            self._lo += 1
+        while self._hi > hi:
+            self._hi -= 1
+            self._mid_sum -= self._sorted[self._hi]
+
+        # Re-sum now and then so rounding errors can't accumulate
+        self._updates += 1
+        if self._updates >= max(n, 64):
+            self._mid_sum = math.fsum(self._sorted[self._lo:self._hi])
+            self._updates = 0
+
+    def median(self) -> Optional[float]:
+        n = len(self._sorted)
+        if n == 0:
+            return None
+        if n % 2:
+            return self._sorted[n // 2]
+        return (self._sorted[n // 2 - 1] + self._sorted[n // 2]) / 2
+
+    def trimmed_mean(self) -> Optional[float]:
+        """ Mean of the values with the lowest and highest `trim` proportion cut off """
+        if self._hi <= self._lo:
+            return None
+        return self._mid_sum / (self._hi - self._lo)
@@ -0,0 +1,214 @@
+""" Multi-resolution rollups of measurements
+
+For each of `RESOLUTIONS`, a `MeasurementRollup` row holds the min/max/sum/count of every
+calibrated sensor value and the on-count of every relay over one time bucket. The measurement
+writer folds each batch it inserts into the rollups of the buckets it touches, so they are kept
+current incrementally; `rebuild` is only needed for backfilling and after stored values change
+(e.g. a retroactive recalibration).
+
+Long /api/history ranges are served from the coarsest resolution that still yields the
+requested number of points, instead of loading and thinning every raw row.
+"""
+
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Any, Iterable
+import numpy as np
+import pandas as pd
+from loguru import logger
+from sqlalchemy import select, delete, func
+from sqlalchemy.orm import Session
+
+from app import db
+from app.config import Config
+from app.models import Measurement, MeasurementRollup
+from app.hardware_constants import SensorId
+from app.historycache import HistoryCache
+from app.dbpools import DBPools
+
+RESOLUTIONS = (60, 15 * 60, 60 * 60)  # Seconds; each divides a day
+RELAY_COLUMNS = ['relay_inside_1', 'relay_inside_2', 'relay_outside_1', 'relay_outside_2']
+_CAL_COLUMNS = [f"{s.value}_cal" for s in SensorId]
+
+
+def naive_local(ts: datetime) -> datetime:
+    """ Timestamps are stored as naive local time """
+    return ts.astimezone(Config.TIMEZONE).replace(tzinfo=None) if ts.tzinfo is not None else ts
+
+
+def _frame(rows: Iterable[dict[str, Any]]) -> pd.DataFrame:
+    """ Measurement rows as a frame of calibrated values and relay states, indexed by timestamp """
+    df = pd.DataFrame(list(rows)).reindex(columns=['timestamp'] + _CAL_COLUMNS + RELAY_COLUMNS)
+    df['timestamp'] = pd.to_datetime([naive_local(ts) for ts in df['timestamp']])
+    df[_CAL_COLUMNS] = df[_CAL_COLUMNS].astype(float)
+    df[RELAY_COLUMNS] = df[RELAY_COLUMNS].fillna(False).astype(bool)
+    return df.set_index('timestamp')
+
+
+def aggregate(df: pd.DataFrame, resolution: int) -> pd.DataFrame:
+    """ Rolls a frame from `_frame` up into buckets of `resolution` seconds """
+    groups = df.groupby(df.index.floor(f"{resolution}s"))
+    out = pd.DataFrame({'count': groups.size()})
+    for s in SensorId:
+        values = groups[f"{s.value}_cal"]
+        out[f"{s.value}_min"] = values.min()
+        out[f"{s.value}_max"] = values.max()
+        out[f"{s.value}_sum"] = values.sum()
+        out[f"{s.value}_n"] = values.count()
+    for relay in RELAY_COLUMNS:
+        out[f"{relay}_on"] = groups[relay].sum()
+    return out
+
+
+def _records(agg: pd.DataFrame, resolution: int) -> list[dict[str, Any]]:
+    records = []
+    for bucket, row in zip(agg.index, agg.to_dict('records')):
+        record = {k: (None if isinstance(v, float) and np.isnan(v) else v) for k, v in row.items()}
+        record.update(resolution=resolution, bucket=bucket.to_pydatetime())
+        for k, v in record.items():
+            if isinstance(v, np.integer):
+                record[k] = int(v)
+        records.append(record)
+    return records
+
+
+def _merge_into(rollup: MeasurementRollup, record: dict[str, Any]):
+    """ Folds a freshly aggregated bucket into its stored rollup """
+    rollup.count += record['count']
+    for s in SensorId:
+        for stat, combine in (('min', min), ('max', max)):
+            key = f"{s.value}_{stat}"
+            old, new = getattr(rollup, key), record[key]
+            setattr(rollup, key, new if old is None else old if new is None else combine(old, new))
+        setattr(rollup, f"{s.value}_sum", (getattr(rollup, f"{s.value}_sum") or 0.0) + record[f"{s.value}_sum"])
+        setattr(rollup, f"{s.value}_n", (getattr(rollup, f"{s.value}_n") or 0) + record[f"{s.value}_n"])
+    for relay in RELAY_COLUMNS:
+        setattr(rollup, f"{relay}_on", (getattr(rollup, f"{relay}_on") or 0) + record[f"{relay}_on"])
+
+
+class Rollups:
+    """ Maintains and queries the MeasurementRollup tables """
+
+    # Held while measurements are written and folded in, and while buckets are rebuilt,
+    # so a rebuild can never lose or double-count a batch
+    lock = threading.RLock()
+
+    @classmethod
+    def add_rows(cls, rows: list[dict[str, Any]], session: Optional[Session] = None):
+        """ Folds newly inserted measurement rows into the rollups, in `session` (the app's
+        session by default). The caller commits. """
+        session = session or db.session
+        df = _frame(rows)
+        for resolution in RESOLUTIONS:
+            records = _records(aggregate(df, resolution), resolution)
+            existing = {
+                r.bucket: r for r in session.scalars(select(MeasurementRollup).where(
+                    MeasurementRollup.resolution == resolution,
+                    MeasurementRollup.bucket.in_([r['bucket'] for r in records])
+                ))
+            }
+            for record in records:
+                if record['bucket'] in existing:
+                    _merge_into(existing[record['bucket']], record)
+                else:
+                    session.add(MeasurementRollup(**record))
+
+    @classmethod
+    def rebuild(cls, start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+        """ Recomputes the rollups of every whole day overlapping [start, end] (naive local time;
+        None means from the oldest / up to the newest measurement) from the live table and the
+        archive. Returns the number of measurements rolled up. Requires an app context. """
+        from app.archive import Archive
+
+        if start is None:
+            oldest = [db.session.scalar(select(func.min(Measurement.timestamp)))]
+            partitions = Archive.partitions()
+            if partitions:
+                oldest.append(datetime.strptime(partitions[0], '%Y-%m'))
+            oldest = [ts for ts in oldest if ts is not None]
+            if not oldest:
+                return 0
+            start = min(oldest)
+        end = end or datetime.now(Config.TIMEZONE).replace(tzinfo=None)
+
+        table = Measurement.__table__
+        total = 0
+        day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day <= end:
+            next_day = day + timedelta(days=1)
+            with cls.lock, DBPools.writing() as session:
+                live = session.execute(
+                    select(table.c.timestamp, *[table.c[c] for c in _CAL_COLUMNS + RELAY_COLUMNS])
+                    .where(table.c.timestamp >= day, table.c.timestamp < next_day)
+                ).mappings().all()
+                archived = Archive.read(day, next_day - timedelta(microseconds=1), _CAL_COLUMNS + RELAY_COLUMNS)
+                frames = [_frame(dict(row) for row in live)] if live else []
+                if len(archived['timestamp']):
+                    frames.append(pd.DataFrame(
+                        {col: archived[col] for col in _CAL_COLUMNS + RELAY_COLUMNS},
+                        index=pd.DatetimeIndex(archived['timestamp'].astype('datetime64[ns]'), name='timestamp')
+                    ))
+
+                session.execute(delete(MeasurementRollup).where(
+                    MeasurementRollup.bucket >= day, MeasurementRollup.bucket < next_day
+                ))
+                if frames:
+                    df = pd.concat(frames)
+                    total += len(df)
+                    for resolution in RESOLUTIONS:
+                        records = _records(aggregate(df, resolution), resolution)
+                        session.execute(MeasurementRollup.__table__.insert(), records)
+                session.commit()
+            HistoryCache.invalidate(day, next_day)
+            day = next_day
+
+        logger.info(f"Rebuilt measurement rollups from {start} to {end} ({total} measurement(s))")
+        return total
+
+    @classmethod
+    def backfill_if_empty(cls):
+        """ Builds the rollups of all existing data the first time they're needed """
+        if db.session.scalar(select(func.count(MeasurementRollup.id))) == 0:
+            cls.rebuild()
+
+    @staticmethod
+    def pick_resolution(start: datetime, end: datetime, points: int) -> Optional[int]:
+        """ The coarsest resolution that still gives at least `points` buckets over the range,
+        or None if only the raw measurements are fine-grained enough """
+        span = (end - start).total_seconds()
+        for resolution in sorted(RESOLUTIONS, reverse=True):
+            if span / resolution >= points:
+                return resolution
+        return None
+
+    @classmethod
+    def history_frame(cls, resolution: int, start: Optional[datetime], end: Optional[datetime]) -> pd.DataFrame:
+        """ Rollups shaped like /api/history's frame: the mean of each sensor by name, relays on for
+        at least half the bucket, plus `<sensor>_min` / `<sensor>_max` columns and the fraction of
+        the bucket each relay was on as `<relay>_frac`; indexed by bucket """
+        query = select(MeasurementRollup.__table__).where(MeasurementRollup.resolution == resolution)
+        if start is not None:
+            query = query.where(MeasurementRollup.bucket >= start - timedelta(seconds=resolution))
+        if end is not None:
+            query = query.where(MeasurementRollup.bucket <= end)
+        with DBPools.reading() as session:
+            rollups = pd.DataFrame(session.execute(query.order_by(MeasurementRollup.bucket)).mappings().all())
+
+        columns = RELAY_COLUMNS + [f"{relay}_frac" for relay in RELAY_COLUMNS] + [s.name for s in SensorId] \
+            + [f"{s.name}_{stat}" for s in SensorId for stat in ('min', 'max')]
+        if rollups.empty:
+            return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([], name='timestamp'))
+
+        df = pd.DataFrame(index=pd.DatetimeIndex(pd.to_datetime(rollups['bucket']), name='timestamp'))
+        count = rollups['count'].to_numpy(dtype=float)
+        for relay in RELAY_COLUMNS:
+            on = rollups[f"{relay}_on"].to_numpy(dtype=float)
+            df[relay] = on >= count / 2
+            df[f"{relay}_frac"] = on / count
+        for s in SensorId:
+            n = rollups[f"{s.value}_n"].to_numpy(dtype=float)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                df[s.name] = np.where(n > 0, rollups[f"{s.value}_sum"].to_numpy(dtype=float) / n, np.nan)
+            df[f"{s.name}_min"] = rollups[f"{s.value}_min"].to_numpy(dtype=float)
+            df[f"{s.name}_max"] = rollups[f"{s.value}_max"].to_numpy(dtype=float)
+        return df[columns]
@@ -4,6 +4,7 @@ from app import db
 from app.models import User
 from app.forms import LoginForm
 from app.dynconfig import DynConfig, ConfigCategory
+from app.hardware_constants import HostMetricId
 from app.sunrise import light_window
 from loguru import logger
 
@@ -64,7 +65,8 @@ def sensors():
 @bp.route('/data-utilities')
 @login_required
 def data_utilities():
-    return render_template('grapher.html', title='Data Utilities')
+    host_metrics = {m.name: m.readable_name for m in HostMetricId}
+    return render_template('grapher.html', title='Data Utilities', host_metrics=host_metrics)
 
 @bp.route('/logs')
 @login_required
@@ -0,0 +1,41 @@
+// Decoder for the compact binary history format (see app/seriescodec.py).
+// Returns the same shape as the JSON /api/history response, with timestamps as epoch milliseconds
+// and missing values as null.
+function decodeHistory(buffer) {
+    const view = new DataView(buffer);
+    const headerLength = view.getUint32(0, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+    const dataStart = 4 + headerLength;
+    const count = header.count;
+    const result = {
+        timestamps: [],
+        sensors: {},
+        relays: {},
+        sensors_min: {},
+        sensors_max: {},
+        relays_on_fraction: {},
+        sensor_names: header.sensor_names,
+        resolution: header.resolution,
+        derived_errors: header.derived_errors || {}
+    };
+
+    for (const column of header.columns) {
+        const offset = dataStart + column.offset;
+        if (column.kind === 'time') {
+            const steps = column.dtype === 'u2' ? new Uint16Array(buffer, offset, count) : new Uint32Array(buffer, offset, count);
+            let t = 0;
+            result.timestamps = Array.from(steps, step => header.t0 + (t += step) * header.t_unit_ms);
+        } else if (column.kind === 'f32') {
+            const values = new Float32Array(buffer, offset, count);
+            result[column.group][column.name] = Array.from(values, v => Number.isNaN(v) ? null : v);
+        } else if (column.kind === 'bits') {
+            const bytes = new Uint8Array(buffer, offset, column.length);
+            const states = new Array(count);
+            for (let i = 0; i < count; i++) {
+                states[i] = (bytes[i >> 3] >> (i & 7) & 1) === 1;
+            }
+            result[column.group][column.name] = states;
+        }
+    }
+    return result;
+}
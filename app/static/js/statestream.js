@@ -0,0 +1,54 @@
+// Live state pushed over /api/stream (see app/eventstream.py).
+// subscribeState(topics, onUpdate, fallback) keeps a merged copy of the given topics and calls
+// onUpdate(state) whenever one of them changes. If the browser can't use Server-Sent Events or
+// the server has no room for another stream, fallback() is called instead, once, so the page
+// can go back to polling.
+function mergeDelta(target, delta) {
+    for (const [key, value] of Object.entries(delta)) {
+        const current = target[key];
+        if (value !== null && typeof value === 'object' && !Array.isArray(value)
+                && current !== null && typeof current === 'object' && !Array.isArray(current)) {
+            mergeDelta(current, value);
+        } else {
+            target[key] = value;
+        }
+    }
+    return target;
+}
+
+function subscribeState(topics, onUpdate, fallback) {
+    let fellBack = false;
+    const fallBack = () => {
+        if (!fellBack) {
+            fellBack = true;
+            fallback();
+        }
+    };
+    if (typeof EventSource === 'undefined') {
+        fallBack();
+        return null;
+    }
+
+    const state = {};
+    const source = new EventSource(`/api/stream?topics=${topics.join(',')}`);
+    source.addEventListener('snapshot', event => {
+        Object.assign(state, JSON.parse(event.data));
+        onUpdate(state);
+    });
+    source.addEventListener('delta', event => {
+        mergeDelta(state, JSON.parse(event.data));
+        onUpdate(state);
+    });
+    source.addEventListener('busy', () => {
+        source.close();
+        fallBack();
+    });
+    source.onerror = () => {
+        // EventSource reconnects by itself (resuming after the last event id) unless the
+        // server refused the stream outright
+        if (source.readyState === EventSource.CLOSED) {
+            fallBack();
+        }
+    };
+    return source;
+}
@@ -39,11 +39,10 @@ def _status_display() -> NoReturn:
     if not hardware.lcd_driver:
         return
 
-    hardware.lcd_driver.set_backlight(DynConfig.lcd_backlight_enabled)
-    
     while True:
-        hardware.lcd_driver.set_backlight(DynConfig.lcd_backlight_enabled)
         try:
+            hardware.lcd_driver.set_backlight(DynConfig.lcd_backlight_enabled)
+
             # --- Screen 1: Overview ---
             hardware.lcd_driver.clear()
             
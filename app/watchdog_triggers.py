@@ -41,7 +41,7 @@ class OverCurrentTrigger(WatchdogTrigger):
             if i1 > limit:
                 cls.trigger_alarm_state()
                 if cls.is_tripped():
-                    HardwareState.set_relay(RelayId.circ1, False)
+                    HardwareState.try_set_relay(RelayId.circ1, False)
                     disable_circuit(0)
             
         # Check Circuit 2
@@ -51,7 +51,7 @@ class OverCurrentTrigger(WatchdogTrigger):
             if i2 > limit:
                 cls.trigger_alarm_state()
                 if cls.is_tripped():
-                    HardwareState.set_relay(RelayId.circ2, False)
+                    HardwareState.try_set_relay(RelayId.circ2, False)
                     disable_circuit(1)
 
     @classmethod
@@ -72,7 +72,7 @@ class OverTemperatureTrigger(WatchdogTrigger):
             if t1 > limit:
                 cls.trigger_alarm_state()
                 if cls.is_tripped():
-                    HardwareState.set_relay(RelayId.circ1, False)
+                    HardwareState.try_set_relay(RelayId.circ1, False)
                     disable_circuit(0)
             
         # Check Tank 2
@@ -82,7 +82,7 @@ class OverTemperatureTrigger(WatchdogTrigger):
             if t2 > limit:
                 cls.trigger_alarm_state()
                 if cls.is_tripped():
-                    HardwareState.set_relay(RelayId.circ2, False)
+                    HardwareState.try_set_relay(RelayId.circ2, False)
                     disable_circuit(1)
 
     @classmethod
@@ -107,7 +107,7 @@ class SubnominalResistanceTrigger(WatchdogTrigger):
                 if r1 < min_ohms:
                     cls.trigger_alarm_state()
                     if cls.is_tripped():
-                        HardwareState.set_relay(RelayId.circ1, False)
+                        HardwareState.try_set_relay(RelayId.circ1, False)
                         disable_circuit(0)
 
         # Check Circuit 2
@@ -121,7 +121,7 @@ class SubnominalResistanceTrigger(WatchdogTrigger):
                 if r2 < min_ohms:
                     cls.trigger_alarm_state()
                     if cls.is_tripped():
-                        HardwareState.set_relay(RelayId.circ2, False)
+                        HardwareState.try_set_relay(RelayId.circ2, False)
                         disable_circuit(1)
 
     @classmethod
@@ -143,7 +143,7 @@ class LeakageCurrentTrigger(WatchdogTrigger):
                 if i1 > threshold:
                     cls.trigger_alarm_state()
                     if cls.is_tripped():
-                        HardwareState.set_relay(RelayId.circ1, False)
+                        HardwareState.try_set_relay(RelayId.circ1, False)
                         disable_circuit(0)
 
         # Check Circuit 2
@@ -154,7 +154,7 @@ class LeakageCurrentTrigger(WatchdogTrigger):
                 if i2 > threshold:
                     cls.trigger_alarm_state()
                     if cls.is_tripped():
-                        HardwareState.set_relay(RelayId.circ2, False)
+                        HardwareState.try_set_relay(RelayId.circ2, False)
                         disable_circuit(1)
 
     @classmethod
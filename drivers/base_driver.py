@@ -1,11 +1,124 @@
+import functools
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Type, Dict, Any
+from typing import Type, Dict, Any, Optional, List, Callable, Hashable, Tuple
+
+class _Flight:
+    """ One call in progress (or finished), whose outcome every caller that joined it gets """
+    def __init__(self):
+        self.leader = threading.get_ident()
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.finished: Optional[float] = None  # monotonic time the call returned
+
+class SingleFlight:
+    """ Coalesces calls with the same key: a call made while an identical one is in progress
+    waits for it and shares its result (or exception) instead of starting another transaction.
+    With a `ttl`, a result is also handed out again for that many seconds after it arrived. """
+
+    def __init__(self, ttl: float = 0.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}  # In progress, or finished within the TTL
+
+        # Counters
+        self.calls = 0
+        self.executions = 0
+
+    def call(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """ Returns `fn(*args, **kwargs)`, or the outcome of the identical call `key` in flight """
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            if flight is not None and flight.finished is not None and time.monotonic() - flight.finished > self.ttl:
+                flight = None
+            reentrant = flight is not None and flight.finished is None and flight.leader == threading.get_ident()
+            leading = flight is None
+            if leading:
+                flight = self._flights[key] = _Flight()
+                self.executions += 1
+        if reentrant:
+            return fn(*args, **kwargs)  # Called from within the flight itself, which waiting would deadlock
+
+        if leading:
+            try:
+                flight.result = fn(*args, **kwargs)
+            except BaseException as e:
+                flight.error = e
+            with self._lock:
+                flight.finished = time.monotonic()
+                # Failures are only shared with the callers that were already waiting
+                if self._flights.get(key) is flight and (self.ttl <= 0 or flight.error is not None):
+                    del self._flights[key]
+            flight.done.set()
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def forget(self):
+        """ Drops remembered results, and makes calls from now on start a fresh flight rather
+        than join one that began before (e.g. because the hardware's state was just changed) """
+        with self._lock:
+            self._flights.clear()
+
+def _coalesced(method: Callable) -> Callable:
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        flights = getattr(self, '_single_flight', None)
+        try:
+            key = (method.__name__, args, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            flights = None
+        if flights is None:
+            return method(self, *args, **kwargs)
+        return flights.call(key, method, self, *args, **kwargs)
+    wrapper._single_flight_wrapped = True
+    return wrapper
+
+def _invalidating(method: Callable) -> Callable:
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        flights = getattr(self, '_single_flight', None)
+        if flights is not None:
+            flights.forget()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            if flights is not None:
+                flights.forget()  # Nor reuse anything read while the change was being made
+    wrapper._single_flight_wrapped = True
+    return wrapper
 
 class HardwareDriver(ABC):
     _instances: Dict[str, Type] = {}
 
+    # Reads that concurrent callers share (see `SingleFlight`), and the methods that change what
+    # those reads return. Every driver class gets its own implementations of these wrapped, so bus
+    # and network traffic is bounded by the distinct reads in flight rather than by the callers.
+    # The `freshness_ttl` param (seconds) additionally lets a result be reused for that long.
+    single_flight_methods: Tuple[str, ...] = ()
+    state_changing_methods: Tuple[str, ...] = ()
+
     def __init__(self, params: Dict[str, Any] = None):
         self.params = params or {}
+        self._single_flight = SingleFlight(float(self.params.get('freshness_ttl', 0.0)))
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for names, wrap in ((cls.single_flight_methods, _coalesced), (cls.state_changing_methods, _invalidating)):
+            for name in names:
+                method = vars(cls).get(name)
+                if callable(method) and not getattr(method, '__isabstractmethod__', False) \
+                        and not getattr(method, '_single_flight_wrapped', False):
+                    setattr(cls, name, wrap(method))
+
+    def single_flight_stats(self) -> Dict[str, int]:
+        return {'calls': self._single_flight.calls, 'executions': self._single_flight.executions}
 
     @classmethod
     def get_driver(cls, key: str) -> Type:
@@ -37,14 +150,32 @@ class HardwareDriver(ABC):
 
 class BaseSensorDriver(HardwareDriver):
     _instances = {}
+    single_flight_methods = ('read',)
 
     @abstractmethod
     def read(self) -> float:
         """Read the sensor value and return it."""
         pass
 
+    @property
+    def bus(self) -> Optional[str]:
+        """ Identifies the physical bus this sensor is read over.
+        Sensors that report the same bus are never read concurrently.
+        None means the sensor does not share a bus with anything else. """
+        return None
+
+    @classmethod
+    def read_batch(cls, drivers: List['BaseSensorDriver']) -> List[float]:
+        """ Reads several sensors of this driver type that share a bus in one acquisition,
+        returning their values in the same order.
+        Drivers whose hardware can sample multiple channels at once should override this;
+        by default each sensor is simply read in turn. """
+        return [driver.read() for driver in drivers]
+
 class BaseOutputDriver(HardwareDriver):
     _instances = {}
+    single_flight_methods = ('get_state',)
+    state_changing_methods = ('set_state',)
 
     @abstractmethod
     def set_state(self, state):
@@ -76,6 +207,8 @@ class BaseLCDDriver(HardwareDriver):
 
 class BaseGFCIDriver(HardwareDriver):
     _instances = {}
+    single_flight_methods = ('is_tripped', 'ping')
+    state_changing_methods = ('set_tripped', 'reset_tripped', 'set_enabled')
 
     @abstractmethod
     def set_tolerance(self, value: float):
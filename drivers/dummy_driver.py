@@ -1,4 +1,5 @@
 import random
+import time
 from drivers.base_driver import BaseSensorDriver, BaseOutputDriver, BaseLCDDriver, BaseGFCIDriver
 
 @BaseSensorDriver.register_driver("dummy")
@@ -8,7 +9,17 @@ class DummySensorDriver(BaseSensorDriver):
     def hardware_deinit(self):
         pass
 
+    @property
+    def bus(self):
+        # Lets a simulated setup mimic sensors sharing a bus
+        return self.params.get('bus')
+
     def read(self):
+        # Simulate the time a real acquisition takes, if asked to
+        delay = float(self.params.get('delay', 0.0))
+        if delay > 0:
+            time.sleep(delay)
+
         # Return a value based on params, or a random value if not specified
         base_value = float(self.params.get('value', 0.0))
         noise = float(self.params.get('noise', 0.0))
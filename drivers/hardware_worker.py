@@ -0,0 +1,98 @@
+""" The hardware worker process
+
+Runs the sensor, relay and LCD drivers in a child process on behalf of
+`app.hardwareworker.HardwareWorker`, which can kill it outright if a driver call hangs in
+C code (an I2C transaction, a sysfs read) where no Python-level timeout reaches.
+
+Requests arrive over the connection as `(call_id, key, method, args)` and are answered with
+`(call_id, ok, value)` in whatever order they finish: each request runs on a thread pool, so
+sensors on independent buses are still read in parallel and the drivers serialize access to
+their own buses as usual. `key` names a driver such as `('sensor', 'v1')`; the method
+`read_batch` takes a list of sensor keys instead and reads them with as few batch reads as
+possible. The shared bus interfaces in `INTERFACES` (e.g. `('interface', 'arduino')`) can be
+called the same way, for maintenance such as resetting the Arduino.
+
+The worker is started as `python -m drivers.hardware_worker <fd>` with one end of a socket
+pair, and receives `(specs, init_hardware)` (see `serve`) as its first message. This module
+only imports the drivers, so starting the worker stays cheap.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+import sys
+import threading
+from typing import Any, Hashable
+from loguru import logger
+
+from drivers.base_driver import HardwareDriver, BaseSensorDriver, BaseOutputDriver, BaseLCDDriver
+import drivers.dummy_driver  # Register drivers
+import drivers.real_drivers
+import drivers.host_drivers
+
+BASES: dict[str, type[HardwareDriver]] = {'sensor': BaseSensorDriver, 'relay': BaseOutputDriver, 'lcd': BaseLCDDriver}
+# Shared bus interfaces that can be called directly, by key, as well as through their drivers
+INTERFACES: dict[Hashable, Any] = {('interface', 'arduino'): drivers.real_drivers.ArduinoInterface}
+MAX_THREADS = 8
+
+
+def _read_batch(drivers: list[BaseSensorDriver]) -> list[float]:
+    """ Reads sensors of any driver types, one `read_batch` per class that implements it """
+    batches: dict[type, list[int]] = {}
+    for position, driver in enumerate(drivers):
+        batch_type = next(klass for klass in type(driver).__mro__ if 'read_batch' in vars(klass))
+        batches.setdefault(batch_type, []).append(position)
+    values = [None] * len(drivers)
+    for batch_type, positions in batches.items():
+        for position, value in zip(positions, batch_type.read_batch([drivers[p] for p in positions])):
+            values[position] = value
+    return values
+
+
+def serve(conn, specs: dict[Hashable, tuple[str, str, dict[str, Any]]], init_hardware: bool):
+    """ The worker's main loop. `specs` maps driver keys to (kind, registered driver name, params);
+    `init_hardware` brings the hardware up first, as when respawning after a kill. """
+    try:
+        drivers = {key: BASES[kind].get_driver(name)(params) for key, (kind, name, params) in specs.items()}
+        if init_hardware:
+            for driver in drivers.values():
+                driver.hardware_init()
+    except Exception as e:
+        conn.send((None, False, f"{type(e).__name__}: {e}"))
+        return
+    conn.send((None, True, {key: driver.bus for key, driver in drivers.items() if isinstance(driver, BaseSensorDriver)}))
+
+    send_lock = threading.Lock()
+
+    def handle(call_id: int, key: Any, method: str, args: tuple):
+        try:
+            if method == 'read_batch':
+                value = _read_batch([drivers[k] for k in key])
+            else:
+                target = drivers[key] if key in drivers else INTERFACES[key]()
+                value = getattr(target, method)(*args)
+            reply = (call_id, True, value)
+        except Exception as e:
+            reply = (call_id, False, f"{type(e).__name__}: {e}")
+        with send_lock:
+            conn.send(reply)
+
+    with ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix="Hardware") as executor:
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                break  # The supervisor went away
+            if request is None:
+                break
+            executor.submit(handle, *request)
+    logger.info("Hardware worker exiting")
+
+
+def main():
+    conn = Connection(int(sys.argv[1]))
+    specs, init_hardware = conn.recv()
+    serve(conn, specs, init_hardware)
+
+
+if __name__ == '__main__':
+    main()
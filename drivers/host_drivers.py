@@ -0,0 +1,87 @@
+""" Sensor drivers for the health of the host (the Pi) itself
+
+These read the kernel's own bookkeeping from procfs and sysfs, so a read is a small file
+read with no bus involved. The `path` parameter of each driver points it at another file,
+e.g. a different thermal zone or the disk that holds the database.
+"""
+
+import shutil
+from typing import Any, Dict
+
+from drivers.base_driver import BaseSensorDriver
+
+
+class HostFileDriver(BaseSensorDriver):
+    """ Reads its value from a single procfs/sysfs file """
+    default_path: str = None
+
+    def __init__(self, params: Dict[str, Any] = None):
+        super().__init__(params)
+        self.path = self.params.get('path', self.default_path)
+
+    def hardware_init(self):
+        pass
+
+    def hardware_deinit(self):
+        pass
+
+    def _read_text(self) -> str:
+        with open(self.path) as f:
+            return f.read()
+
+
+@BaseSensorDriver.register_driver("host_cpu_temp")
+class HostCPUTempDriver(HostFileDriver):
+    """ SoC temperature in degrees C """
+    default_path = "/sys/class/thermal/thermal_zone0/temp"
+
+    def read(self) -> float:
+        return int(self._read_text()) / 1000  # Millidegrees
+
+
+@BaseSensorDriver.register_driver("host_loadavg")
+class HostLoadAvgDriver(HostFileDriver):
+    """ Load average over the last 1, 5 or 15 minutes (`window`) """
+    default_path = "/proc/loadavg"
+    WINDOWS = {1: 0, 5: 1, 15: 2}
+
+    def __init__(self, params: Dict[str, Any] = None):
+        super().__init__(params)
+        self.field = self.WINDOWS[int(self.params.get('window', 1))]
+
+    def read(self) -> float:
+        return float(self._read_text().split()[self.field])
+
+
+@BaseSensorDriver.register_driver("host_memory")
+class HostMemoryDriver(HostFileDriver):
+    """ Percentage of memory in use (not available to new allocations) """
+    default_path = "/proc/meminfo"
+
+    def read(self) -> float:
+        fields = {}
+        for line in self._read_text().splitlines():
+            key, _, value = line.partition(':')
+            fields[key] = int(value.split()[0]) if value.strip() else 0
+        return 100 * (1 - fields['MemAvailable'] / fields['MemTotal'])
+
+
+@BaseSensorDriver.register_driver("host_disk")
+class HostDiskDriver(HostFileDriver):
+    """ Percentage used of the filesystem that holds `path` """
+    default_path = "/"
+
+    def read(self) -> float:
+        usage = shutil.disk_usage(self.path)
+        return 100 * usage.used / usage.total
+
+
+@BaseSensorDriver.register_driver("host_throttled")
+class HostThrottledDriver(HostFileDriver):
+    """ The firmware's throttle flags, as `vcgencmd get_throttled` reports them.
+    Bits 0-3 are the current state (under-voltage, frequency capped, throttled, soft
+    temperature limit) and bits 16-19 whether each has happened since boot. """
+    default_path = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+
+    def read(self) -> float:
+        return float(int(self._read_text().strip(), 16))
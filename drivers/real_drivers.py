@@ -1,10 +1,13 @@
 import time
 import threading
+import os
 import glob
 import weakref
+import bisect
+import math
+from dataclasses import dataclass
 from typing import Dict, Any, List
-import numpy as np
-from scipy.stats import trim_mean
+from abc import abstractmethod
 from loguru import logger
 import requests
 
@@ -28,8 +31,61 @@ except RuntimeError:
     GPIO = None
     logger.warning("Not on a real raspi. Real drivers will fail if used.")
 
+# --- Oversampling ---
+
+@dataclass
+class Oversampling:
+    """ How one ADC channel is oversampled """
+    samples: int = 10           # Maximum number of samples to take
+    delay: float = 1/25         # Seconds between consecutive samples of this channel
+    tolerance: float = 0.0      # Stop early once the samples' standard deviation is at most this (0 = never)
+    min_samples: int = 3        # Samples always taken before stopping early
+
+class OversampleFilter:
+    """ Accumulates the samples of one channel.
+    Samples are kept sorted as they arrive and their spread is tracked with Welford's running
+    variance, so checking for convergence is O(1) and the trimmed mean needs no extra sort.
+    """
+    def __init__(self, spec: Oversampling):
+        self.spec = spec
+        self.sorted_samples: List[float] = []
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float):
+        bisect.insort(self.sorted_samples, value)
+        n = len(self.sorted_samples)
+        delta = value - self._mean
+        self._mean += delta / n
+        self._m2 += delta * (value - self._mean)
+
+    @property
+    def count(self) -> int:
+        return len(self.sorted_samples)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self._m2 / self.count) if self.count else 0.0
+
+    @property
+    def done(self) -> bool:
+        if self.count >= self.spec.samples:
+            return True
+        return self.spec.tolerance > 0 and self.count >= self.spec.min_samples \
+            and self.std <= self.spec.tolerance
+
+    def trimmed_mean(self, proportion: float) -> float:
+        """ Mean after cutting `proportion` of the samples off each end (as scipy.stats.trim_mean) """
+        if not self.sorted_samples:
+            return 0.0
+        cut = int(proportion * self.count)
+        kept = self.sorted_samples[cut:self.count - cut]
+        return sum(kept) / len(kept)
+
 # --- Arduino Interface ---
 
+SMBUS_BLOCK_MAX = 32  # Largest SMBus block transfer, in bytes
+
 class ArduinoInterface:
     _instance = None
     _lock = threading.RLock()
@@ -116,26 +172,69 @@ class ArduinoInterface:
                     logger.error(f"Failed to restore state: {e}")
 
     def read_word(self, command: int) -> int:
-        if not self.bus:
-            # Try to re-init? Or just fail.
-            logger.error("I2C bus not available")
-            return 0
-            
-        with self._lock:
-            samples = []
-            # Legacy logic: retry until we get 10 samples, resetting on error
-            while len(samples) < 10:
-                try:
-                    time.sleep(1/25)
-                    # The legacy code sends the command as the register address
-                    val = self.bus.read_word_data(self.address, command)
-                    samples.append(val)
-                except (OSError, IOError):
-                    logger.warning("I2C Read Error. Resetting Arduino.")
-                    self.reset_arduino()
-            
-            # Legacy: int(trim_mean(array(samples), 0.20)+0.5)
-            return int(trim_mean(np.array(samples), 0.20) + 0.5)
+        return self.read_words([command])[0]
+
+    def read_words(self, commands: List[int], block_command: int | None = None,
+                   oversampling: List['Oversampling'] | None = None) -> List[int]:
+        """ Samples several ADC channels in one acquisition, returning one filtered word per command.
+
+        Each channel is oversampled according to its entry in `oversampling` (legacy defaults if
+        not given). The channels are sampled interleaved, each on its own schedule, so a channel
+        that converges early or samples quickly does not wait on the others.
+        If `block_command` is given, each transaction is a single `read_i2c_block_data` on that
+        register, which the Arduino answers with consecutive little-endian words where the
+        word at index `c` is the value for command `c`.
+
+        The bus lock is only held for the individual transactions, never across the delays
+        between samples or the filtering, so relay writes can interleave with a long read.
+        """
+        if oversampling is None:
+            oversampling = [Oversampling() for _ in commands]
+
+        if block_command is not None and 2 * (max(commands) + 1) > SMBUS_BLOCK_MAX:
+            logger.warning(f"Commands {commands} do not fit in one I2C block read; sampling individually.")
+            block_command = None
+
+        filters = [OversampleFilter(spec) for spec in oversampling]
+        start = time.monotonic()
+        next_due = [start + spec.delay for spec in oversampling]  # Legacy: settle before the first sample
+
+        while True:
+            active = [i for i, f in enumerate(filters) if not f.done]
+            if not active:
+                break
+            wait = min(next_due[i] for i in active) - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            now = time.monotonic()
+            due = [i for i in active if next_due[i] <= now]
+            if not due:
+                continue
+
+            try:
+                with self._lock:
+                    if not self.bus:
+                        # Try to re-init? Or just fail.
+                        logger.error("I2C bus not available")
+                        return [0] * len(commands)
+                    if block_command is not None:
+                        block = self.bus.read_i2c_block_data(self.address, block_command, 2 * (max(commands) + 1))
+                        words = [block[2*commands[i]] | (block[2*commands[i] + 1] << 8) for i in due]
+                    else:
+                        # The legacy code sends the command as the register address
+                        words = [self.bus.read_word_data(self.address, commands[i]) for i in due]
+            except (OSError, IOError):
+                # Legacy logic: keep sampling until done, resetting on error
+                logger.warning("I2C Read Error. Resetting Arduino.")
+                self.reset_arduino()
+                continue
+
+            for i, word in zip(due, words):
+                filters[i].add(word)
+                next_due[i] = now + oversampling[i].delay
+
+        # Legacy: int(trim_mean(array(samples), 0.20)+0.5)
+        return [int(f.trimmed_mean(0.20) + 0.5) for f in filters]
 
     def write_byte(self, command: int):
         if not self.bus:
@@ -162,6 +261,14 @@ class ArduinoSensorDriver(BaseSensorDriver):
         self.command = int(self.params.get('command', 0))
         self.slope = float(self.params.get('slope', 1.0))
         self.intercept = float(self.params.get('intercept', 0.0))
+        # Register that returns all ADC channels in one block read (requires firmware support)
+        self.block_command = self.params.get('block_command')
+        self.oversampling = Oversampling(
+            samples=int(self.params.get('samples', 10)),
+            delay=float(self.params.get('sample_delay', 1/25)),
+            tolerance=float(self.params.get('tolerance', 0.0)),
+            min_samples=int(self.params.get('min_samples', 3))
+        )
         self.interface = ArduinoInterface()
 
     def hardware_init(self):
@@ -170,10 +277,25 @@ class ArduinoSensorDriver(BaseSensorDriver):
     def hardware_deinit(self):
         pass
 
+    @property
+    def bus(self) -> str:
+        return "arduino"
+
     def read(self) -> float:
-        raw = self.interface.read_word(self.command)
+        raw = self.interface.read_words([self.command], oversampling=[self.oversampling])[0]
         return raw * self.slope + self.intercept
 
+    @classmethod
+    def read_batch(cls, drivers: List['ArduinoSensorDriver']) -> List[float]:
+        block_commands = {driver.block_command for driver in drivers}
+        block_command = int(block_commands.pop()) if len(block_commands) == 1 and None not in block_commands else None
+        raws = ArduinoInterface().read_words(
+            [driver.command for driver in drivers],
+            block_command,
+            [driver.oversampling for driver in drivers]
+        )
+        return [raw * driver.slope + driver.intercept for raw, driver in zip(raws, drivers)]
+
 @BaseOutputDriver.register_driver("arduino")
 class ArduinoOutputDriver(BaseOutputDriver):
     def __init__(self, params: Dict[str, Any] = None):
@@ -201,28 +323,226 @@ class ArduinoOutputDriver(BaseOutputDriver):
     def get_state(self):
         return self._state
 
-@BaseSensorDriver.register_driver("w1_temp_index")
-class W1ThermometerIndexDriver(BaseSensorDriver):
+# --- 1-Wire Device Registry ---
+
+class W1DeviceRegistry:
+    """ Shared view of the DS18B20 thermometers on the 1-Wire bus.
+
+    Each device gets its index the first time it is seen, in the order the bus lists them (as the
+    index driver always used), and keeps it for the life of the process: a device that drops off
+    the bus leaves a gap rather than shifting the ones after it, and hot-plugged devices are
+    added at the end. The bus is re-scanned lazily: when an index that isn't present is asked
+    for, after a read failure, or every `refresh_interval` seconds.
+    """
+    def __init__(self, base_dir: str = '/sys/bus/w1/devices/', family: str = '28', refresh_interval: float = 300.0):
+        self.base_dir = base_dir
+        self.family = family
+        self.refresh_interval = refresh_interval
+        self.scans = 0        # Number of times the sysfs directory has been enumerated
+        self.lookups = 0      # Number of device lookups served
+        self.bulk_conversions = 0
+        self._lock = threading.Lock()
+        self._devices: List[str] = []  # Every device seen so far, in index order
+        self._present: set[str] = set()
+        self._paths: Dict[str, str] = {}
+        self._masters: List[str] = []
+        self._last_scan: float | None = None
+        self._stale = True
+
+    def refresh(self):
+        """ Re-enumerates the bus """
+        with self._lock:
+            self._scan()
+
+    def invalidate(self):
+        """ Forces a re-scan before the next lookup (e.g. after a device failed to read) """
+        self._stale = True
+
+    def _scan(self):
+        devices = [os.path.basename(path) for path in glob.glob(os.path.join(self.base_dir, self.family + '*'))]
+        present = set(devices)
+        new = [device for device in devices if device not in self._devices]
+        if new:
+            logger.info(f"New 1-Wire devices: {dict(enumerate(new, len(self._devices)))}")
+            self._devices.extend(new)
+        missing = [device for device in self._devices if device not in present]
+        if present != self._present and missing:
+            logger.warning(f"1-Wire devices missing from the bus: "
+                           f"{ {self._devices.index(device): device for device in missing} }")
+        self._present = present
+        self._paths = {device: os.path.join(self.base_dir, device, 'w1_slave') for device in devices}
+        self._masters = sorted(os.path.basename(path) for path in glob.glob(os.path.join(self.base_dir, 'w1_bus_master*')))
+        self._last_scan = time.monotonic()
+        self._stale = False
+        self.scans += 1
+
+    def _due(self) -> bool:
+        return self._stale or self._last_scan is None \
+            or time.monotonic() - self._last_scan >= self.refresh_interval
+
+    def devices(self) -> List[str | None]:
+        """ Returns the IDs of all thermometers in index order, None for those missing from the bus """
+        with self._lock:
+            if self._due():
+                self._scan()
+            return [device if device in self._present else None for device in self._devices]
+
+    def device_at(self, index: int) -> str | None:
+        """ Returns the ID of the thermometer at `index`, or None if there is no such device on the bus """
+        with self._lock:
+            self.lookups += 1
+            if self._due() or index >= len(self._devices) or self._devices[index] not in self._present:
+                self._scan()
+            device = self._devices[index] if index < len(self._devices) else None
+            return device if device in self._present else None
+
+    def slave_path(self, device_id: str) -> str:
+        """ Returns the path of the device's `w1_slave` file """
+        path = self._paths.get(device_id)
+        return path if path is not None else os.path.join(self.base_dir, device_id, 'w1_slave')
+
+    def device_file(self, device_id: str, name: str) -> str:
+        """ Returns the path of one of the device's sysfs attributes (e.g. `temperature`) """
+        return os.path.join(self.base_dir, device_id, name)
+
+    def bulk_convert(self, timeout: float) -> bool:
+        """ Starts a temperature conversion on every device of every bus master at once
+        (w1_therm's `therm_bulk_read`) and waits for it to finish.
+        Returns False if bulk conversion isn't available or did not finish within `timeout`. """
+        with self._lock:
+            if self._due():
+                self._scan()
+            masters = list(self._masters)
+        if not masters:
+            return False
+
+        try:
+            for master in masters:
+                with open(os.path.join(self.base_dir, master, 'therm_bulk_read'), 'w') as f:
+                    f.write('trigger')
+
+            # Reads back -1 while any device on that master is still converting
+            deadline = time.monotonic() + timeout
+            while True:
+                pending = False
+                for master in masters:
+                    with open(os.path.join(self.base_dir, master, 'therm_bulk_read'), 'r') as f:
+                        pending = pending or f.read().strip() == '-1'
+                if not pending:
+                    self.bulk_conversions += 1
+                    return True
+                if time.monotonic() >= deadline:
+                    logger.warning(f"1-Wire bulk conversion did not finish within {timeout}s")
+                    return False
+                time.sleep(W1_BULK_POLL_SECONDS)
+        except OSError as e:
+            logger.warning(f"1-Wire bulk conversion unavailable: {e}")
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'devices': [device if device in self._present else None for device in self._devices],
+            'scans': self.scans,
+            'lookups': self.lookups,
+            'bulk_conversions': self.bulk_conversions,
+        }
+
+w1_registry = W1DeviceRegistry()
+
+# DS18B20 worst-case conversion time (seconds) per resolution (bits)
+W1_CONVERSION_SECONDS = {9: 0.09375, 10: 0.1875, 11: 0.375, 12: 0.75}
+W1_BULK_POLL_SECONDS = 0.01
+
+class W1ThermometerBase(BaseSensorDriver):
+    """ Shared behavior of the DS18B20 drivers.
+
+    Params:
+    - `resolution`: 9-12 bits, written to the device on init; lower is less precise but converts faster.
+    - `bulk`: (default True) when several thermometers are read together, start one conversion on
+      all of them at once through the bus master instead of converting each one in turn.
+    """
     def __init__(self, params: Dict[str, Any] = None):
         super().__init__(params)
-        self.index = int(self.params.get('index', 0))
-        self.base_dir = '/sys/bus/w1/devices/'
+        self.registry = w1_registry
+        self.resolution = int(self.params['resolution']) if 'resolution' in self.params else None
+        self.bulk = bool(self.params.get('bulk', True))
 
-    def hardware_init(self):
+    @abstractmethod
+    def device(self) -> str | None:
+        """ The ID of the device this driver reads """
         pass
 
+    def hardware_init(self):
+        if self.resolution is None:
+            return
+        if self.resolution not in W1_CONVERSION_SECONDS:
+            logger.error(f"Invalid W1 resolution {self.resolution}; must be 9-12 bits.")
+            return
+        device_id = self.device()
+        if device_id is None:
+            logger.error("Cannot set W1 resolution: device not found.")
+            return
+        try:
+            with open(self.registry.device_file(device_id, 'resolution'), 'w') as f:
+                f.write(str(self.resolution))
+        except OSError as e:
+            logger.error(f"Failed to set resolution of W1 device {device_id}: {e}")
+
     def hardware_deinit(self):
         pass
 
+    @property
+    def bus(self) -> str:
+        return "w1"
+
+    @property
+    def conversion_seconds(self) -> float:
+        return W1_CONVERSION_SECONDS.get(self.resolution or 12, W1_CONVERSION_SECONDS[12])
+
+    @classmethod
+    def read_batch(cls, drivers: List['W1ThermometerBase']) -> List[float]:
+        if len(drivers) < 2 or not all(driver.bulk for driver in drivers):
+            return super().read_batch(drivers)
+
+        registry = drivers[0].registry
+        timeout = 2 * max(driver.conversion_seconds for driver in drivers) + 0.1
+        if not registry.bulk_convert(timeout):
+            return super().read_batch(drivers)
+
+        # The converted values are now waiting in each device's `temperature` attribute
+        values = []
+        for driver in drivers:
+            device_id = driver.device()
+            try:
+                with open(registry.device_file(device_id, 'temperature'), 'r') as f:
+                    temp_c = float(f.read().strip()) / 1000.0
+                values.append(temp_c * 9.0 / 5.0 + 32.0)
+            except (TypeError, ValueError, OSError):
+                # Missing device or no result; fall back to an individual conversion
+                values.append(driver.read())
+        return values
+
+@BaseSensorDriver.register_driver("w1_temp_index")
+class W1ThermometerIndexDriver(W1ThermometerBase):
+    def __init__(self, params: Dict[str, Any] = None):
+        super().__init__(params)
+        self.index = int(self.params.get('index', 0))
+
+    def device(self) -> str | None:
+        return self.registry.device_at(self.index)
+
     def read_temp_raw(self):
+        device_id = self.registry.device_at(self.index)
+        if device_id is None:
+            logger.error(f"W1 device at index {self.index} not found.")
+            return []
         try:
-            device_folder = glob.glob(self.base_dir + '28*')[self.index]
-            device_file = device_folder + '/w1_slave'
-            with open(device_file, 'r') as f:
+            with open(self.registry.slave_path(device_id), 'r') as f:
                 lines = f.readlines()
             return lines
-        except (IndexError, FileNotFoundError, OSError):
-            logger.error(f"W1 device at index {self.index} not found.")
+        except OSError:
+            logger.error(f"W1 device at index {self.index} ({device_id}) could not be read.")
+            self.registry.invalidate()
             return []
 
     def read(self) -> float:
@@ -243,22 +563,17 @@ class W1ThermometerIndexDriver(BaseSensorDriver):
         return 0.0
 
 @BaseSensorDriver.register_driver("w1_temp")
-class W1ThermometerDriver(BaseSensorDriver):
+class W1ThermometerDriver(W1ThermometerBase):
     def __init__(self, params: Dict[str, Any] = None):
         super().__init__(params)
         self.device_id = self.params.get('device_id')
-        self.base_dir = '/sys/bus/w1/devices/'
 
-    def hardware_init(self):
-        pass
-
-    def hardware_deinit(self):
-        pass
+    def device(self) -> str | None:
+        return self.device_id
 
     def read_temp_raw(self):
-        device_file = self.base_dir + self.device_id + '/w1_slave'
         try:
-            with open(device_file, 'r') as f:
+            with open(self.registry.slave_path(self.device_id), 'r') as f:
                 lines = f.readlines()
             return lines
         except FileNotFoundError:
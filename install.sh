@@ -84,7 +84,7 @@ User=root
 WorkingDirectory=$INSTALL_DIR
 Environment="PATH=$INSTALL_DIR/venv/bin"
 EnvironmentFile=$INSTALL_DIR/.env
-ExecStart=$INSTALL_DIR/venv/bin/gunicorn "app:create_app()" --bind 0.0.0.0:80 --workers 1 --threads 4
+ExecStart=$INSTALL_DIR/venv/bin/gunicorn "app:create_app()" --bind 0.0.0.0:80 --workers 1 --threads 12
 Restart=always
 
 [Install]
@@ -105,9 +105,21 @@ function uninstall() {
     echo "Uninstalled successfully."
 }
 
+function migrate_service() {
+    # Older service files ran gunicorn with 4 threads, too few for the live-update streams
+    # (each open page holds a thread), so bring them up to the 12 new installs get
+    local service_file="/etc/systemd/system/$SERVICE_NAME.service"
+    if [ -f "$service_file" ] && grep -Eq -- "--threads ([1-9]|1[01])( |$)" "$service_file"; then
+        sed -Ei 's/--threads ([1-9]|1[01])( |$)/--threads 12\2/' "$service_file"
+        systemctl daemon-reload
+        echo "Raised the gunicorn thread count in $service_file to 12."
+    fi
+}
+
 function update() {
     systemctl stop "$SERVICE_NAME"
     install_package
+    migrate_service
     systemctl start "$SERVICE_NAME"
     echo "Updated successfully."
 }
@@ -0,0 +1,9 @@
+import pytest
+from app.config import Config
+
+@pytest.fixture(autouse=True, scope='session')
+def config_snapshot_path(tmp_path_factory):
+    """ Keeps the tests away from the real config snapshot """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(Config, 'CONFIG_SNAPSHOT_PATH', str(tmp_path_factory.mktemp('config') / 'config_snapshot.json'))
+        yield
@@ -0,0 +1,72 @@
+import time
+from drivers.base_driver import BaseSensorDriver
+from drivers.dummy_driver import DummySensorDriver
+from app.hardware_constants import SensorId
+from app.hardware import group_sensors
+from app.acquisition import read_concurrent, read_sequential
+
+def test_group_sensors():
+    drivers = {
+        SensorId.v1: DummySensorDriver({'bus': 'arduino'}),
+        SensorId.i1: DummySensorDriver({'bus': 'arduino'}),
+        SensorId.t1: DummySensorDriver({'bus': 'w1'}),
+        SensorId.t0: DummySensorDriver({}),
+    }
+    groups = group_sensors(drivers)
+    assert groups['arduino'] == {BaseSensorDriver: [SensorId.v1, SensorId.i1]}
+    assert groups['w1'] == {BaseSensorDriver: [SensorId.t1]}
+    assert groups[SensorId.t0] == {BaseSensorDriver: [SensorId.t0]}  # No shared bus => group of its own
+
+def test_group_sensors_batches_by_read_batch_implementation():
+    from drivers.real_drivers import W1ThermometerBase, W1ThermometerIndexDriver, W1ThermometerDriver
+    drivers = {
+        SensorId.t0: W1ThermometerIndexDriver({'index': 0}),
+        SensorId.t1: W1ThermometerDriver({'device_id': '28-aaa'}),
+    }
+    assert group_sensors(drivers) == {'w1': {W1ThermometerBase: [SensorId.t0, SensorId.t1]}}
+
+def test_read_concurrent_takes_as_long_as_slowest_bus():
+    drivers = {
+        SensorId.v1: DummySensorDriver({'bus': 'a', 'value': 1.0, 'delay': 0.2}),
+        SensorId.i1: DummySensorDriver({'bus': 'a', 'value': 2.0, 'delay': 0.2}),
+        SensorId.t1: DummySensorDriver({'bus': 'b', 'value': 3.0, 'delay': 0.2}),
+        SensorId.t2: DummySensorDriver({'bus': 'b', 'value': 4.0, 'delay': 0.2}),
+    }
+    start = time.monotonic()
+    results = read_concurrent(drivers, max_workers=4, read_timeout=5.0)
+    duration = time.monotonic() - start
+
+    assert duration < 0.7  # Sequential would be 0.8s
+    assert [results[s].value for s in drivers] == [1.0, 2.0, 3.0, 4.0]
+    assert all(results[s].duration >= 0.2 for s in drivers)
+
+def test_read_concurrent_deadline():
+    drivers = {
+        SensorId.v1: DummySensorDriver({'bus': 'slow', 'value': 1.0, 'delay': 1.0}),
+        SensorId.t1: DummySensorDriver({'bus': 'fast', 'value': 3.0}),
+    }
+    results = read_concurrent(drivers, max_workers=2, read_timeout=0.2)
+    assert results[SensorId.v1].timed_out
+    assert results[SensorId.v1].value is None
+    assert results[SensorId.t1].value == 3.0
+
+    # The stuck bus is skipped rather than queued behind the hung read
+    results = read_concurrent(drivers, max_workers=2, read_timeout=0.2)
+    assert results[SensorId.v1].error == "bus busy"
+
+def test_read_sequential():
+    drivers = {SensorId.v1: DummySensorDriver({'value': 5.0})}
+    results = read_sequential(drivers)
+    assert results[SensorId.v1].value == 5.0
+    assert results[SensorId.v1].duration is not None
+
+def test_read_sequential_deadline():
+    drivers = {
+        SensorId.v2: DummySensorDriver({'bus': 'hung', 'value': 1.0, 'delay': 1.0}),
+        SensorId.t2: DummySensorDriver({'bus': 'fine', 'value': 3.0}),
+    }
+    start = time.monotonic()
+    results = read_sequential(drivers, max_workers=3, read_timeout=0.2)
+    assert time.monotonic() - start < 0.8
+    assert results[SensorId.v2].timed_out and results[SensorId.v2].value is None
+    assert results[SensorId.t2].value == 3.0
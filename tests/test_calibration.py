@@ -62,3 +62,24 @@ def test_registry_caching(app):
     # Third fetch hits DB (now 3 points)
     points3 = CalibrationRegistry.get_points(SensorId.v1)
     assert len(points3) == 3
+
+def test_compiled_table_scalar_and_array_agree():
+    import numpy as np
+    from app.calibration import CompiledCalibration, CalPoint
+    table = CompiledCalibration([
+        CalPoint(1, 0.0, 0.0), CalPoint(2, 10.0, 100.0), CalPoint(3, 10.0, 120.0), CalPoint(4, 20.0, 140.0)
+    ])
+    values = np.array([-5.0, 0.0, 5.0, 10.0, 15.0, 20.0, 30.0])
+    expected = [-50.0, 0.0, 50.0, 100.0, 130.0, 140.0, 160.0]
+    assert np.allclose(table.apply(values), expected)
+    assert [table.apply(float(v)) for v in values] == pytest.approx(expected)
+    # Within the table it matches np.interp
+    inside = np.linspace(0.5, 9.5, 7)
+    assert np.allclose(table.apply(inside), np.interp(inside, table.measured, table.actual))
+
+def test_invalidate_bumps_version(app):
+    version = CalibrationRegistry.version(SensorId.v1)
+    CalibrationRegistry.get_table(SensorId.v1)
+    CalibrationRegistry.invalidate(SensorId.v1)
+    assert CalibrationRegistry.version(SensorId.v1) == version + 1
+    assert CalibrationRegistry.get_table(SensorId.v1).version == version + 1
@@ -91,3 +91,35 @@ def test_get_history_integrate(client):
     assert vals[0] == 120.0
     assert vals[1] == 120.0 + 121.0
 
+
+def test_get_history_projects_requested_sensors(client):
+    login(client, 'test', 'test')
+    response = client.get('/api/history?sensors=v1&resolution=raw')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert list(data['sensors']) == ['v1']
+    assert data['sensors']['v1'][:2] == [120.0, 121.0]
+    assert data['relays']['inside_1'][0] in (True, 1)
+    # Naive local timestamps come back with their UTC offset
+    offset = datetime.fromisoformat(data['timestamps'][0]).utcoffset()
+    assert offset in (timedelta(hours=-5), timedelta(hours=-4))
+
+def test_get_history_max_points(client):
+    login(client, 'test', 'test')
+    response = client.get('/api/history?sensors=v1&max_points=4')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert len(data['timestamps']) == 4
+    assert data['sensors']['v1'][0] == 120.0 and data['sensors']['v1'][-1] == 129.0
+
+def test_get_history_binary(client):
+    from app import seriescodec
+    login(client, 'test', 'test')
+    response = client.get('/api/history?sensors=v1,i1&format=binary')
+    assert response.status_code == 200
+    header, epoch_ms, groups = seriescodec.decode(response.get_data())
+    json_data = client.get('/api/history?sensors=v1,i1').get_json()
+    assert header['count'] == len(json_data['timestamps']) == 10
+    assert list(epoch_ms) == [int(datetime.fromisoformat(t).timestamp() * 1000) for t in json_data['timestamps']]
+    assert list(groups['sensors']['v1']) == json_data['sensors']['v1']
+    assert list(groups['relays']['inside_1']) == json_data['relays']['inside_1']
@@ -0,0 +1,70 @@
+import time
+import threading
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, func
+from sqlalchemy.exc import OperationalError
+from app import create_app, db
+from app.config import Config
+from app.dbpools import DBPools
+from app.models import Measurement
+from app.persistence import MeasurementWriter
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        LOGIN_DISABLED = True
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        MeasurementWriter.stop()  # Don't share a writer bound to another app
+        yield app
+        db.session.remove()
+        for pool in (DBPools._writer, DBPools._reader):
+            pool.engine.dispose()
+        DBPools._uri = DBPools._writer = DBPools._reader = None
+
+def _rows(n, start=datetime(2024, 1, 1)):
+    return [{'timestamp': start + timedelta(seconds=i), 'v1_cal': float(i), 'relay_inside_1': False} for i in range(n)]
+
+def test_readers_are_read_only(app):
+    MeasurementWriter._write(_rows(3))  # Through the writer connection
+    with DBPools.reading() as session:
+        assert session.scalar(select(func.count(Measurement.id))) == 3
+        with pytest.raises(OperationalError, match="readonly"):
+            session.execute(insert(Measurement), _rows(1))
+    stats = DBPools.stats()
+    assert stats['writer']['size'] == 1 and stats['writer']['statements'] > 0
+    assert stats['reader']['checkouts'] >= 1 and stats['reader']['in_use'] == 0
+
+def test_open_read_does_not_hold_up_writes(app):
+    MeasurementWriter._write(_rows(100))
+    reading, done = threading.Event(), threading.Event()
+
+    def long_read():
+        with app.app_context(), DBPools.reading() as session:
+            session.execute(select(Measurement.id)).first()  # Opens a read transaction
+            reading.set()
+            done.wait(10)
+
+    thread = threading.Thread(target=long_read)
+    thread.start()
+    reading.wait(5)
+    start = time.monotonic()
+    assert MeasurementWriter._write(_rows(10, datetime(2024, 2, 1)))
+    assert time.monotonic() - start < 1.0
+    done.set()
+    thread.join()
+    with DBPools.reading() as session:
+        assert session.scalar(select(func.count(Measurement.id))) == 110
+
+def test_downsample_deletes_in_chunks(app, monkeypatch):
+    import app.api.routes as routes
+    monkeypatch.setattr(routes, 'MAINTENANCE_DELETE_ROWS', 7)
+    MeasurementWriter._write(_rows(100))
+    response = app.test_client().post('/api/maintenance/downsample_db', json={'factor': 4})
+    assert response.get_json() == {'success': True}
+    assert db.session.scalar(select(func.count(Measurement.id))) == 25
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+from app.derived import compile_expression, parse_definitions, evaluate, DerivedExpressionError
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({'v1': [120.0, 121.0, 122.0], 'i1': [5.0, 5.5, np.nan]})
+
+def test_compile_is_cached_and_reports_dependencies():
+    expr = compile_expression("np.maximum(v1 * i1, 0) + integrate(p1)")
+    assert expr is compile_expression("np.maximum(v1 * i1, 0) + integrate(p1)")
+    assert expr.names == {'v1', 'i1', 'p1'}
+    assert expr.uses_spacing
+    assert not compile_expression("sqrt(v1) > 2").uses_spacing
+
+@pytest.mark.parametrize('expr', [
+    "__import__('os')", "v1.__class__", "np.load('x')", "(lambda: 1)()", "'a' + v1", "v1[0]", "max(v1, key=abs)", "v1 +",
+])
+def test_rejects_anything_outside_the_whitelist(expr):
+    with pytest.raises(DerivedExpressionError):
+        compile_expression(expr)
+
+def test_evaluates_in_dependency_order_with_errors_per_expression(df):
+    compiled, errors = parse_definitions([
+        {'name': 'e1', 'expr': 'integrate(p1)'},  # Defined before what it reads
+        {'name': 'p1', 'expr': 'v1 * i1'},
+        {'name': 'bad', 'expr': 'v1 + nope'},
+        {'name': 'worse', 'expr': 'bad * 2'},
+        {'name': 'a', 'expr': 'b + 1'},
+        {'name': 'b', 'expr': 'a + 1'},
+        {'name': 'evil', 'expr': 'open("x")'},
+        {'name': '', 'expr': 'v1'},
+    ])
+    assert set(errors) == {'evil'}
+    errors.update(evaluate(df, compiled))
+
+    assert list(df['p1'][:2]) == [600.0, 665.5]
+    assert list(df['e1'][:2]) == [600.0, 1265.5]
+    assert errors['bad'] == "Unknown name 'nope'"
+    assert errors['worse'] == "Depends on failed 'bad'"
+    assert errors['a'].startswith('Circular reference') and errors['b'].startswith('Circular reference')
+    assert 'bad' not in df.columns
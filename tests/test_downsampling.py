@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+from app.downsampling import lttb_indices, transition_indices, downsample_indices
+
+def test_lttb_keeps_spikes_and_ends():
+    x = np.arange(10000.0)
+    y = np.sin(x / 500)
+    y[1234] = 25.0
+    y[8765] = -25.0
+    keep = lttb_indices(x, y, 200)
+    assert len(keep) == 200
+    assert keep[0] == 0 and keep[-1] == 9999
+    assert np.all(np.diff(keep) > 0)
+    assert 1234 in keep and 8765 in keep
+
+    # Short series are returned whole
+    assert list(lttb_indices(x[:5], y[:5], 10)) == [0, 1, 2, 3, 4]
+
+def test_transition_indices():
+    states = np.array([False, False, True, True, True, False])
+    assert list(transition_indices(states)) == [1, 2, 4, 5]
+
+def test_downsample_indices_keeps_relay_edges():
+    index = pd.date_range('2025-06-01', periods=5000, freq='s')
+    relay = np.zeros(5000, dtype=bool)
+    relay[2001:2003] = True  # A brief pulse that decimation would likely miss
+    values = np.random.default_rng(0).normal(size=5000)
+    values[100:200] = np.nan
+    df = pd.DataFrame({'t1': values, 'relay_inside_1': relay}, index=index)
+
+    keep = downsample_indices(df, ['t1'], ['relay_inside_1'], 100)
+    assert len(keep) <= 104
+    assert {2000, 2001, 2002, 2003} <= set(keep.tolist())
+    assert df['relay_inside_1'].iloc[keep].sum() == 2
+
+def test_downsample_indices_stays_within_budget():
+    n = 20000
+    index = pd.date_range('2025-06-01', periods=n, freq='s')
+    rng = np.random.default_rng(1)
+    columns = {f"s{i}": rng.normal(size=n) for i in range(7)}
+    columns['s2'][100:5000] = np.nan
+    columns['s3'][:] = np.nan
+    columns['s0'][4321] = 50.0  # Spikes in different series
+    columns['s5'][15000] = -50.0
+    columns['relay_inside_1'] = np.arange(n) % 10 < 5  # Switches every 5 s
+    columns['relay_outside_1'] = np.zeros(n, dtype=bool)
+    df = pd.DataFrame(columns, index=index)
+
+    keep = downsample_indices(df, [f"s{i}" for i in range(7)], ['relay_inside_1', 'relay_outside_1'], 400)
+    assert len(keep) <= 400
+    assert keep[0] == 0 and keep[-1] == n - 1 and np.all(np.diff(keep) > 0)
+    assert {4321, 15000} <= set(keep.tolist())
+    # The transitions got their share of the budget, as whole switches
+    relay = df['relay_inside_1'].to_numpy()
+    kept = set(keep.tolist())
+    switches = [i for i in range(n - 1) if relay[i] != relay[i + 1] and i in kept and i + 1 in kept]
+    assert len(switches) == 400 // 4 // 2
@@ -37,3 +37,226 @@ def test_driver_registration():
     # LCD Driver
     lcd_cls = BaseLCDDriver.get_driver("dummy")
     assert lcd_cls == DummyLCDDriver
+
+def test_arduino_block_read():
+    from unittest.mock import MagicMock
+    from drivers.real_drivers import ArduinoInterface, ArduinoSensorDriver
+
+    interface = ArduinoInterface()
+    interface.address = 0x08
+    interface.bus = MagicMock()
+    # Word for command c lives at bytes 2c..2c+1 (little-endian)
+    block = [0] * 16
+    block[8:16] = [0x10, 0x00, 0x20, 0x00, 0x30, 0x01, 0x40, 0x00]
+    interface.bus.read_i2c_block_data.return_value = block
+
+    drivers = [ArduinoSensorDriver({'command': c, 'block_command': 9, 'slope': 2.0, 'sample_delay': 0.001}) for c in (4, 5, 6, 7)]
+    values = ArduinoSensorDriver.read_batch(drivers)
+
+    assert values == [0x10 * 2.0, 0x20 * 2.0, 0x130 * 2.0, 0x40 * 2.0]
+    # One block transaction per sample round, regardless of the channel count
+    assert interface.bus.read_i2c_block_data.call_count == 10
+    interface.bus.read_i2c_block_data.assert_called_with(0x08, 9, 16)
+    interface.bus.read_word_data.assert_not_called()
+    interface.bus = None
+
+def test_oversample_filter():
+    import numpy as np
+    from scipy.stats import trim_mean
+    from drivers.real_drivers import Oversampling, OversampleFilter
+
+    samples = [512, 509, 515, 700, 511, 510, 300, 513, 512, 514]
+    f = OversampleFilter(Oversampling(samples=10))
+    for s in samples:
+        assert not f.done
+        f.add(s)
+    assert f.done
+    assert abs(f.trimmed_mean(0.2) - trim_mean(np.array(samples), 0.2)) < 1e-9
+    assert abs(f.std - np.std(samples)) < 1e-9
+
+    # A channel that has settled stops early
+    f = OversampleFilter(Oversampling(samples=10, tolerance=1.0, min_samples=3))
+    for s in (100, 100, 101):
+        f.add(s)
+    assert f.done
+
+def test_arduino_oversampling_per_channel():
+    from unittest.mock import MagicMock
+    from drivers.real_drivers import ArduinoInterface, ArduinoSensorDriver
+
+    interface = ArduinoInterface()
+    interface.address = 0x08
+    interface.bus = MagicMock()
+    interface.bus.read_word_data.side_effect = lambda addr, cmd: 100 if cmd == 6 else 50
+
+    voltage = ArduinoSensorDriver({'command': 6, 'tolerance': 1.0, 'sample_delay': 0.001})
+    current = ArduinoSensorDriver({'command': 4, 'samples': 5, 'sample_delay': 0.001})
+    values = ArduinoSensorDriver.read_batch([voltage, current])
+
+    assert values == [100.0, 50.0]
+    commands = [c.args[1] for c in interface.bus.read_word_data.call_args_list]
+    assert commands.count(6) == 3  # Stopped once settled
+    assert commands.count(4) == 5
+    interface.bus = None
+
+def test_w1_registry(tmp_path):
+    from drivers.real_drivers import W1DeviceRegistry, W1ThermometerIndexDriver
+
+    def add_device(device_id, millideg):
+        (tmp_path / device_id).mkdir()
+        (tmp_path / device_id / 'w1_slave').write_text(
+            f"72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n72 01 4b 46 7f ff 0e 10 57 t={millideg}\n")
+
+    add_device('28-000000000bbb', 20000)
+    add_device('28-000000000aaa', 100000)
+    registry = W1DeviceRegistry(str(tmp_path))
+    driver = W1ThermometerIndexDriver({'index': 0})
+    driver.registry = registry
+
+    # Indexes follow the bus's own listing order, and repeated reads don't re-scan the bus
+    devices = registry.devices()
+    assert sorted(devices) == ['28-000000000aaa', '28-000000000bbb']
+    expected = 212.0 if devices[0] == '28-000000000aaa' else 68.0
+    assert driver.read() == expected
+    assert driver.read() == expected
+    assert registry.scans == 1
+
+    # A hot-plugged device is picked up when its index is asked for
+    add_device('28-000000000ccc', 0)
+    driver.index = 2
+    assert driver.read() == 32.0
+    assert registry.scans == 2
+
+def test_w1_registry_indexes_survive_dropouts(tmp_path):
+    import shutil
+    from drivers.real_drivers import W1DeviceRegistry
+
+    for device_id in ('28-000000000ccc', '28-000000000bbb'):
+        (tmp_path / device_id).mkdir()
+    registry = W1DeviceRegistry(str(tmp_path))
+    first, second = registry.devices()
+
+    # A device dropping off leaves a gap, and one with a lower ID goes at the end
+    shutil.rmtree(tmp_path / first)
+    (tmp_path / '28-000000000aaa').mkdir()
+    registry.invalidate()
+    assert registry.devices() == [None, second, '28-000000000aaa']
+    assert registry.device_at(0) is None and registry.device_at(1) == second
+
+    # Once back, it has its old index again
+    (tmp_path / first).mkdir()
+    assert registry.device_at(0) == first
+    assert registry.devices() == [first, second, '28-000000000aaa']
+
+def test_w1_driver_reads_through_registry(tmp_path):
+    from drivers.real_drivers import W1DeviceRegistry, W1ThermometerBase, W1ThermometerDriver
+
+    (tmp_path / '28-aaa').mkdir()
+    (tmp_path / '28-aaa' / 'w1_slave').write_text("72 01 : crc=57 YES\n72 01 t=100000\n")
+    driver = W1ThermometerDriver({'device_id': '28-aaa', 'bulk': False})
+    driver.registry = W1DeviceRegistry(str(tmp_path))
+    assert driver.read() == 212.0
+
+    class NoDevice(W1ThermometerBase):
+        def read(self):
+            return 0.0
+    with pytest.raises(TypeError):
+        NoDevice({})
+
+def test_w1_bulk_conversion(tmp_path):
+    from drivers.real_drivers import W1DeviceRegistry, W1ThermometerIndexDriver, W1ThermometerDriver
+
+    (tmp_path / 'w1_bus_master1').mkdir()
+    (tmp_path / 'w1_bus_master1' / 'therm_bulk_read').write_text('0\n')
+    for device_id, millideg in (('28-aaa', 100000), ('28-bbb', 0)):
+        (tmp_path / device_id).mkdir()
+        (tmp_path / device_id / 'temperature').write_text(f"{millideg}\n")
+        (tmp_path / device_id / 'w1_slave').write_text("garbage NO\n")  # Must not be used
+    registry = W1DeviceRegistry(str(tmp_path))
+
+    index = registry.devices().index('28-bbb')
+    drivers = [W1ThermometerIndexDriver({'index': index, 'resolution': 9}), W1ThermometerDriver({'device_id': '28-aaa'})]
+    for driver in drivers:
+        driver.registry = registry
+        driver.hardware_init()
+
+    assert W1ThermometerIndexDriver.read_batch(drivers) == [32.0, 212.0]
+    assert registry.bulk_conversions == 1
+    assert (tmp_path / 'w1_bus_master1' / 'therm_bulk_read').read_text() == 'trigger'
+    assert (tmp_path / '28-bbb' / 'resolution').read_text() == '9'
+    assert not (tmp_path / '28-aaa' / 'resolution').exists()
+
+def test_single_flight_shares_concurrent_reads():
+    import threading
+    import time
+    from drivers.base_driver import SingleFlight
+
+    class SlowSensor(DummySensorDriver):
+        reads = 0
+        def read(self):
+            SlowSensor.reads += 1
+            time.sleep(0.2)
+            return float(SlowSensor.reads)
+
+    driver = SlowSensor({'value': 0.0})
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(driver.read())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert SlowSensor.reads == 1 and results == [1.0] * 8
+    assert driver.single_flight_stats() == {'calls': 8, 'executions': 1}
+
+    # Without a TTL, a later read goes to the hardware again
+    assert driver.read() == 2.0
+
+    # Failures reach the callers that waited, but aren't reused after
+    flights = SingleFlight()
+    def fail():
+        time.sleep(0.1)
+        raise OSError("bus error")
+    errors = []
+    def call():
+        try:
+            flights.call('k', fail)
+        except OSError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3 and flights.executions == 1
+    assert flights.call('k', lambda: 5) == 5
+
+def test_single_flight_ttl_and_invalidation():
+    from drivers.dummy_driver import DummyGFCIDriver
+
+    class CountingGFCI(DummyGFCIDriver):
+        def __init__(self, params=None):
+            super().__init__(params)
+            self.queries = 0
+            self.tripped = {1: False, 2: False}
+        def is_tripped(self, circuit):
+            self.queries += 1
+            return self.tripped[circuit]
+        def set_tripped(self, circuit):
+            self.tripped[circuit] = True
+
+    gfci = CountingGFCI({'freshness_ttl': 60})
+    assert not gfci.is_tripped(1) and not gfci.is_tripped(1)
+    assert gfci.queries == 1  # Reused within the TTL
+    assert not gfci.is_tripped(2) and gfci.queries == 2  # Different arguments are a different read
+
+    gfci.set_tripped(1)  # Changing the state drops what was read before
+    assert gfci.is_tripped(1) and gfci.queries == 3
+
+def test_single_flight_reentrant_read():
+    class Base(DummySensorDriver):
+        def read(self):
+            return 1.0
+    class Derived(Base):
+        def read(self):
+            return super().read() + 1  # Same key, same thread: must not wait on itself
+    assert Derived().read() == 2.0
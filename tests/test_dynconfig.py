@@ -0,0 +1,89 @@
+import json
+import os
+import pytest
+from app import create_app, db
+from app.config import Config
+from app.dynconfig import DynConfig
+from app.models import SystemConfig
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+@pytest.fixture
+def snapshot_path(tmp_path, monkeypatch):
+    path = tmp_path / 'config_snapshot.json'
+    monkeypatch.setattr(Config, 'CONFIG_SNAPSHOT_PATH', str(path))
+    for name in ('_confDict', '_source', '_version', '_loaded_at', '_db_error'):
+        monkeypatch.setattr(DynConfig, name, getattr(DynConfig, name))
+    return path
+
+@pytest.fixture
+def app(snapshot_path):
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+def _set(key, value):
+    conf = db.session.get(SystemConfig, key) or SystemConfig(key=key)
+    conf.value = value
+    db.session.add(conf)
+    db.session.commit()
+
+def test_fetch_writes_versioned_snapshot(app, snapshot_path):
+    _set('polling_rate_seconds', '30')
+    assert DynConfig.fetch_config()
+    snapshot = json.loads(snapshot_path.read_text())
+    version = snapshot['version']
+    assert snapshot['config'] == {'polling_rate_seconds': '30'}
+    assert DynConfig.status()['source'] == 'database' and DynConfig.status()['version'] == version
+
+    DynConfig.reload()  # Unchanged: not rewritten
+    assert json.loads(snapshot_path.read_text())['version'] == version
+
+    _set('polling_rate_seconds', '45')
+    DynConfig.reload()
+    assert json.loads(snapshot_path.read_text())['version'] == version + 1
+    assert DynConfig.polling_rate_seconds == 45
+    assert not os.path.exists(f"{snapshot_path}.tmp")
+
+def test_starts_from_snapshot_without_database(app, snapshot_path):
+    _set('polling_rate_seconds', '30')
+    DynConfig.fetch_config()
+    version = DynConfig.status()['version']
+
+    DynConfig._confDict = None
+    assert DynConfig.load_snapshot()
+    assert DynConfig.polling_rate_seconds == 30
+    assert DynConfig.status()['source'] == 'snapshot'
+
+    # Reconciling picks up what changed in the database meanwhile
+    _set('polling_rate_seconds', '20')
+    assert DynConfig.fetch_config()
+    assert DynConfig.polling_rate_seconds == 20
+    assert DynConfig.status() | {'loaded_at': None} == {'source': 'database', 'version': version + 1, 'loaded_at': None, 'db_error': None}
+
+def test_unreachable_database_falls_back_to_snapshot(snapshot_path):
+    snapshot_path.write_text(json.dumps({'format': 1, 'version': 7, 'config': {'manual_mode': 'True'}}))
+    DynConfig._confDict = None
+    assert not DynConfig.fetch_config()  # No app context, so no database
+    assert DynConfig.manual_mode is True
+    status = DynConfig.status()
+    assert status['source'] == 'snapshot' and status['version'] == 7 and status['db_error']
+
+    # A failed reload keeps what's live
+    DynConfig.reload()
+    assert DynConfig.status()['source'] == 'snapshot'
+
+def test_unusable_snapshot_is_ignored(snapshot_path):
+    snapshot_path.write_text('{"format": 1, "version": 3, "conf')
+    assert not DynConfig.load_snapshot()
+    snapshot_path.write_text(json.dumps({'format': 99, 'version': 3, 'config': {}}))
+    assert not DynConfig.load_snapshot()
+
+    DynConfig._confDict = None
+    DynConfig.fetch_config()
+    assert DynConfig._confDict == {} and DynConfig.status()['source'] == 'defaults'
@@ -0,0 +1,114 @@
+import contextlib
+import json
+import threading
+from collections import deque
+import pytest
+from app import create_app
+from app.config import Config
+from app.dynconfig import DynConfig
+from app.eventstream import StateStream, diff, parse_event_id, EPOCH
+
+class TestConfig(Config):
+    TESTING = True
+    LOGIN_DISABLED = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+@pytest.fixture
+def stream(monkeypatch):
+    """ A StateStream fed from a dict the test controls, without the publisher thread """
+    monkeypatch.setattr(DynConfig, '_confDict', {**(DynConfig._confDict or {}), 'stream_max_clients': '2'})
+    monkeypatch.setattr(StateStream, '_lock', threading.Condition())
+    monkeypatch.setattr(StateStream, '_events', deque(maxlen=3))
+    for name, value in (('_state', {}), ('_seq', 0), ('_subscribers', 0), ('_thread', None)):
+        monkeypatch.setattr(StateStream, name, value)
+    monkeypatch.setattr(StateStream, '_run', classmethod(lambda cls: None))
+    state = {'status': {'sensors': {'t1': {'calibrated': 20.0}, 't2': None}, 'manual_mode': False},
+             'watchdog': {'tripped': False, 'triggers': []}, 'logs': {'size': 0}}
+    monkeypatch.setattr(StateStream, '_sample', classmethod(lambda cls: json.loads(json.dumps(state))))
+    yield state
+
+class FakeApp:
+    def app_context(self):
+        return contextlib.nullcontext()
+
+def _parse(message):
+    fields = dict(line.split(': ', 1) for line in message.strip().split('\n') if not line.startswith(':'))
+    return fields.get('event'), parse_event_id(fields.get('id')), json.loads(fields.get('data', 'null'))
+
+def test_diff_sends_only_changes():
+    old = {'sensors': {'t1': {'raw': 1, 'cal': 2}, 't2': None}, 'relays': [1, 2], 'gone': 1}
+    new = {'sensors': {'t1': {'raw': 1, 'cal': 3}, 't2': None}, 'relays': [1, 3]}
+    assert diff(old, new) == {'sensors': {'t1': {'cal': 3}}, 'relays': [1, 3], 'gone': None}
+    assert diff(new, new) is None
+
+def test_snapshot_deltas_and_resume(stream):
+    app = FakeApp()
+    client = StateStream.messages(app, ['status'], None)
+    assert next(client).startswith('retry:')
+    event, first_id, data = _parse(next(client))
+    assert event == 'snapshot' and data['status']['sensors']['t1'] == {'calibrated': 20.0}
+
+    stream['status']['sensors']['t1']['calibrated'] = 21.0
+    stream['watchdog']['tripped'] = True
+    StateStream.publish()
+    event, event_id, data = _parse(next(client))
+    assert (event, event_id) == ('delta', first_id + 1)
+    assert data == {'status': {'sensors': {'t1': {'calibrated': 21.0}}}}  # No watchdog topic
+
+    # A client that saw the snapshot resumes with the missed delta instead of a new snapshot
+    resumed = StateStream.messages(app, ['status'], first_id)
+    next(resumed)
+    assert _parse(next(resumed))[:2] == ('delta', first_id + 1)
+
+    # The third client is turned away, and a closed one frees its place
+    assert _parse(next(StateStream.messages(app, ['status'], None)))[0] == 'busy'
+    resumed.close()
+    assert StateStream.stats()['subscribers'] == 1
+    client.close()
+
+def test_stale_resume_gets_snapshot(stream):
+    app = FakeApp()
+    for i in range(6):
+        stream['logs']['size'] = i + 1
+        StateStream.publish()
+    client = StateStream.messages(app, ['logs'], 1)  # Long gone from the replay buffer
+    next(client)
+    event, event_id, data = _parse(next(client))
+    assert (event, event_id, data) == ('snapshot', StateStream._seq, {'logs': {'size': 6}})
+    client.close()
+
+def test_stream_endpoint(stream, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    app = create_app(TestConfig)
+    response = app.test_client().get('/api/stream?topics=watchdog,bogus', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    next(chunks)
+    event, _, data = _parse(next(chunks).decode())
+    assert event == 'snapshot' and list(data) == ['watchdog']
+    response.close()
+
+    # An id from before a restart can't resume, even if the new numbering has reached it
+    StateStream.publish()
+    assert parse_event_id(f"{EPOCH}-1") == 1
+    assert parse_event_id("0123abcd-1") is None and parse_event_id("1") is None
+    response = app.test_client().get('/api/stream?topics=watchdog', headers={'Last-Event-ID': '0123abcd-0'},
+                                     buffered=False)
+    chunks = iter(response.response)
+    next(chunks)
+    assert _parse(next(chunks).decode())[0] == 'snapshot'
+    response.close()
+
+def test_client_cap_follows_server_threads(monkeypatch):
+    from app import eventstream
+    assert eventstream.server_threads(['pytest']) is None
+    assert eventstream.server_threads(['/venv/bin/gunicorn', 'app:create_app()', '--workers', '1', '--threads', '4']) == 4
+    assert eventstream.server_threads(['/venv/bin/gunicorn', '--threads=12', 'app:create_app()']) == 12
+    assert eventstream.server_threads(['/venv/bin/gunicorn', 'app:create_app()']) == 1
+    assert eventstream.server_threads(['/venv/bin/gunicorn', '-c', 'conf.py', 'app:create_app()']) is None
+
+    monkeypatch.setattr(DynConfig, '_confDict', {**(DynConfig._confDict or {}), 'stream_max_clients': '6'})
+    monkeypatch.setattr(eventstream, 'server_threads', lambda: 4)  # An old service file
+    assert eventstream.max_clients() == 1
+    monkeypatch.setattr(eventstream, 'server_threads', lambda: None)
+    assert eventstream.max_clients() == 6
@@ -0,0 +1,55 @@
+import pytest
+from app import create_app, db
+from app.hardwarestate import HardwareState
+from app.hardware_constants import SensorId
+from app.dynconfig import DynConfig
+from app.config import Config
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+@pytest.fixture
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+def test_poll_subset_keeps_other_sensors(app):
+    HardwareState.poll_sensors(persist=False)
+    before = dict(HardwareState.cur_sensor_values)
+
+    HardwareState.poll_sensors([SensorId.i1], persist=False)
+    after = HardwareState.cur_sensor_values
+    assert after[SensorId.i1] is not before[SensorId.i1]
+    assert after[SensorId.i1].monotonic >= before[SensorId.i1].monotonic
+    assert all(after[s] is before[s] for s in SensorId if s != SensorId.i1)
+
+def test_sample_period(app, monkeypatch):
+    monkeypatch.setattr(DynConfig, '_confDict', {**(DynConfig._confDict or {}), 'sensor_sample_periods': "{'i1': 0.25}"})
+    assert HardwareState.sample_period(SensorId.i1) == 0.25
+    assert HardwareState.sample_period(SensorId.t0) == DynConfig.polling_rate_seconds
+
+def test_poll_fills_history(app):
+    count = len(HardwareState.recent(SensorId.t0))
+    HardwareState.poll_sensors([SensorId.t0], persist=False)
+    assert len(HardwareState.recent(SensorId.t0)) == count + 1
+    assert HardwareState.recent(SensorId.t0).snapshot().cal[-1] == HardwareState.cur_sensor_values[SensorId.t0].cald
+
+def test_readers_never_create_history(app, monkeypatch):
+    monkeypatch.setattr(HardwareState, 'history', {})
+    assert len(HardwareState.recent(SensorId.t2)) == 0
+    assert HardwareState.history == {}
+
+    HardwareState.push_history(SensorId.t2, 0.0, 1.0, 2.0, 3.0)
+    buffer = HardwareState.recent(SensorId.t2)
+    assert len(buffer) == 1 and buffer.depth == DynConfig.sensor_history_depth
+
+    # A depth change is applied by the next push, not by a reader
+    monkeypatch.setattr(DynConfig, '_confDict', {**(DynConfig._confDict or {}), 'sensor_history_depth': "7"})
+    assert HardwareState.recent(SensorId.t2) is buffer
+    HardwareState.push_history(SensorId.t2, 0.0, 2.0, 2.0, 3.0)
+    assert HardwareState.recent(SensorId.t2).depth == 7 and len(HardwareState.recent(SensorId.t2)) == 1
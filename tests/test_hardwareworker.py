@@ -0,0 +1,103 @@
+import time
+import pytest
+from app.dynconfig import DynConfig
+from app.hardwareworker import (HardwareWorker, HardwareWorkerError, HardwareWorkerTimeout,
+                                WorkerSensorDriver, WorkerOutputDriver)
+from app.hardware_constants import SensorId
+from app.acquisition import read_concurrent
+from drivers.dummy_driver import DummyOutputDriver
+
+SPECS = {
+    ('sensor', 'a'): ('sensor', 'dummy', {'value': 1.0, 'bus': 'x'}),
+    ('sensor', 'b'): ('sensor', 'dummy', {'value': 2.0, 'bus': 'x'}),
+    ('sensor', 'slow'): ('sensor', 'dummy', {'value': 3.0, 'delay': 5.0}),
+    ('relay', 'r'): ('relay', 'dummy', {}),
+}
+
+@pytest.fixture
+def worker(monkeypatch):
+    monkeypatch.setattr(DynConfig, '_confDict', {**(DynConfig._confDict or {}), 'hardware_call_timeout_seconds': '1.0'})
+    HardwareWorker.start(SPECS)
+    yield HardwareWorker
+    HardwareWorker.stop()
+
+def _wait_until_running(timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not HardwareWorker.running():
+        assert time.monotonic() < deadline, "worker did not come back"
+        time.sleep(0.05)
+
+def test_proxies_call_into_worker(worker):
+    a, b = WorkerSensorDriver(('sensor', 'a')), WorkerSensorDriver(('sensor', 'b'))
+    assert a.bus == 'x' and a.read() == 1.0
+    assert WorkerSensorDriver.read_batch([b, a]) == [2.0, 1.0]
+    relay = WorkerOutputDriver(('relay', 'r'))
+    relay.set_state(True)
+    assert relay.get_state() is True
+
+    with pytest.raises(HardwareWorkerError, match="KeyError"):
+        worker.call(('sensor', 'missing'), 'read')
+    assert worker.stats()['restarts'] == 0  # A driver error doesn't need a restart
+
+def test_missed_deadline_kills_and_restarts(worker):
+    relay = WorkerOutputDriver(('relay', 'r'))
+    relay.set_state(True)
+    pid = worker.stats()['pid']
+
+    start = time.monotonic()
+    with pytest.raises(HardwareWorkerTimeout):
+        WorkerSensorDriver(('sensor', 'slow')).read()
+    assert time.monotonic() - start < 3.0  # Not left waiting for the stuck read
+
+    _wait_until_running()
+    stats = worker.stats()
+    assert stats['restarts'] == 1 and stats['timeouts'] == 1 and stats['pid'] != pid
+    assert relay.get_state() is True  # Restored after the restart
+    assert WorkerSensorDriver(('sensor', 'a')).read() == 1.0
+
+def test_acquisition_through_worker(worker, monkeypatch):
+    monkeypatch.setattr(DynConfig, '_confDict', {**DynConfig._confDict, 'hardware_call_timeout_seconds': '0.5'})
+    drivers = {
+        SensorId.v1: WorkerSensorDriver(('sensor', 'a')),
+        SensorId.v2: WorkerSensorDriver(('sensor', 'b')),
+        SensorId.t0: WorkerSensorDriver(('sensor', 'slow')),
+    }
+    results = read_concurrent(drivers, max_workers=4, read_timeout=2.0)
+    assert results[SensorId.v1].value == 1.0 and results[SensorId.v2].value == 2.0
+    assert not results[SensorId.t0].ok and 'timed out' in results[SensorId.t0].error
+
+def test_calls_fail_fast_when_stopped(worker):
+    worker.stop()
+    start = time.monotonic()
+    with pytest.raises(HardwareWorkerError):
+        WorkerSensorDriver(('sensor', 'a')).read()
+    assert time.monotonic() - start < 0.5
+
+def test_relay_change_during_restart_is_applied(worker):
+    relay = WorkerOutputDriver(('relay', 'r'))
+    relay.set_state(True)
+    with pytest.raises(HardwareWorkerTimeout):
+        WorkerSensorDriver(('sensor', 'slow')).read()
+    try:
+        relay.set_state(False)  # Most likely while the worker is still coming back
+    except HardwareWorkerError:
+        pass
+    _wait_until_running()
+    assert relay.get_state() is False
+
+def test_relay_loops_carry_on_when_worker_is_down(worker, monkeypatch):
+    from app import hardware
+    from app.hardwarestate import HardwareState
+    from app.hardware_constants import RelayId
+    worker.stop()
+    monkeypatch.setitem(hardware.relay_drivers, RelayId.circ1, WorkerOutputDriver(('relay', 'r')))
+    monkeypatch.setitem(hardware.relay_drivers, RelayId.circ2, DummyOutputDriver())
+    assert HardwareState.try_set_relay(RelayId.circ1, True) is False
+    assert HardwareState.try_set_relay(RelayId.circ2, True) is True
+
+def test_interface_calls(worker):
+    # Reaches the worker's ArduinoInterface, which was never initialized since no Arduino driver is configured
+    restarts = worker.stats()['restarts']
+    with pytest.raises(HardwareWorkerError, match="ArduinoInterface"):
+        worker.call(('interface', 'arduino'), 'reset_arduino')
+    assert worker.stats()['restarts'] == restarts
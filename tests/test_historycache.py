@@ -0,0 +1,100 @@
+import pytest
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import Measurement
+from app.config import Config
+from app.dynconfig import DynConfig
+from app.persistence import MeasurementWriter
+from app.historycache import HistoryCache, CachedResponse
+
+class TestConfig(Config):
+    TESTING = True
+    LOGIN_DISABLED = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(DynConfig, '_confDict', {**(DynConfig._confDict or {}), 'history_cache_mb': '32'})
+    monkeypatch.setattr(HistoryCache, '_entries', OrderedDict())
+    for counter in ('_size', 'hits', 'misses', 'evictions', 'invalidated'):
+        monkeypatch.setattr(HistoryCache, counter, 0)
+    yield HistoryCache
+
+BASE = datetime(2025, 6, 1)
+
+def _entry(size, start, end):
+    return CachedResponse(b'x' * size, 'application/json', start, end)
+
+def test_invalidation_only_touches_overlapping_ranges(cache):
+    cache.put('closed', _entry(10, BASE, BASE + timedelta(days=1)), cache.generation())
+    cache.put('open', _entry(10, BASE, None), cache.generation())
+    cache.invalidate(BASE + timedelta(days=3), None)  # A new poll
+    assert cache.get('closed') is not None
+    assert cache.get('open') is None
+    cache.invalidate(BASE + timedelta(hours=5), None)  # A recalibration reaching back into the range
+    assert cache.get('closed') is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+
+def test_stale_results_are_not_stored(cache):
+    generation = cache.generation()
+    cache.invalidate(BASE, BASE + timedelta(hours=1))  # Happens while the response is computed
+    cache.put('hit', _entry(10, BASE, BASE + timedelta(days=1)), generation)
+    cache.put('elsewhere', _entry(10, BASE + timedelta(days=2), BASE + timedelta(days=3)), generation)
+    assert cache.get('hit') is None
+    assert cache.get('elsewhere') is not None
+
+def test_lru_eviction_by_size(cache, monkeypatch):
+    monkeypatch.setattr(DynConfig, '_confDict', {**(DynConfig._confDict or {}), 'history_cache_mb': '0.001'})  # 1048 bytes
+    for key in 'abcd':
+        cache.put(key, _entry(260, BASE, BASE), cache.generation())
+    cache.get('a')
+    cache.put('e', _entry(260, BASE, BASE), cache.generation())
+    assert list(cache._entries) == ['c', 'd', 'a', 'e']
+    assert cache.stats()['evictions'] == 1
+
+def test_history_endpoint_uses_cache(cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        MeasurementWriter.stop()
+        now = datetime.now(Config.TIMEZONE).replace(tzinfo=None)
+        for i in range(3):
+            db.session.add(Measurement(timestamp=now - timedelta(hours=2, minutes=i), t1_cal=float(i)))
+        db.session.commit()
+        client = app.test_client()
+        start = (now - timedelta(hours=3)).astimezone(Config.TIMEZONE).isoformat()
+        closed_end = (now - timedelta(hours=1)).astimezone(Config.TIMEZONE).isoformat()
+        closed = {'start': start, 'end': closed_end, 'sensors': 't1', 'resolution': 'raw'}
+        open_ended = {'start': start, 'sensors': 't1', 'resolution': 'raw'}
+
+        first = client.get('/api/history', query_string=closed).get_json()
+        assert client.get('/api/history', query_string=closed).get_json() == first
+        client.get('/api/history', query_string=open_ended)
+        assert cache.stats()['hits'] == 1
+
+        MeasurementWriter.enqueue({'timestamp': now, 't1_cal': 9.0})
+        assert len(client.get('/api/history', query_string=open_ended).get_json()['timestamps']) == 4
+        assert client.get('/api/history', query_string=closed).get_json() == first
+        assert cache.stats()['hits'] == 2
+        db.session.remove()
+        db.drop_all()
+
+def test_default_window_shares_cache_entry(cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        MeasurementWriter.stop()
+        now = datetime.now(Config.TIMEZONE).replace(tzinfo=None)
+        db.session.add(Measurement(timestamp=now - timedelta(hours=2), t1_cal=1.0))
+        db.session.commit()
+        client = app.test_client()
+
+        # No range means the last 24 hours, keyed on a start that only moves once a minute
+        first = client.get('/api/history', query_string={'sensors': 't1'}).get_json()
+        assert client.get('/api/history', query_string={'sensors': 't1'}).get_json() == first
+        assert len(first['timestamps']) == 1 and cache.stats()['hits'] == 1
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,72 @@
+import pytest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.config import Config
+from app.hardware_constants import HostMetricId
+from app.hosthealth import HostHealth
+from app.models import HostMetric
+from drivers.base_driver import BaseSensorDriver
+from drivers.host_drivers import HostCPUTempDriver, HostLoadAvgDriver, HostMemoryDriver, HostDiskDriver, HostThrottledDriver
+
+@pytest.fixture
+def app():
+    class TestConfig(Config):
+        TESTING = True
+        LOGIN_DISABLED = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def host_files(tmp_path):
+    (tmp_path / 'temp').write_text("48312\n")
+    (tmp_path / 'loadavg').write_text("0.52 0.58 0.59 1/245 12345\n")
+    (tmp_path / 'meminfo').write_text("MemTotal:        1000000 kB\nMemFree:          100000 kB\nMemAvailable:     250000 kB\nHugePages_Total:       0\n")
+    (tmp_path / 'throttled').write_text("50005\n")
+    return tmp_path
+
+def test_host_drivers(host_files):
+    assert HostCPUTempDriver({'path': host_files / 'temp'}).read() == pytest.approx(48.312)
+    assert HostLoadAvgDriver({'path': host_files / 'loadavg'}).read() == 0.52
+    assert HostLoadAvgDriver({'path': host_files / 'loadavg', 'window': 15}).read() == 0.59
+    assert HostMemoryDriver({'path': host_files / 'meminfo'}).read() == pytest.approx(75.0)
+    assert 0 <= HostDiskDriver({'path': str(host_files)}).read() <= 100
+    flags = int(HostThrottledDriver({'path': host_files / 'throttled'}).read())
+    assert flags & 0x1 and flags & 0x4 and flags & 0x10000  # Under-voltage, throttled, under-voltage since boot
+    assert BaseSensorDriver.get_driver("host_cpu_temp") is HostCPUTempDriver
+
+def test_record_and_history(app, host_files, monkeypatch):
+    HostHealth._drivers = {
+        HostMetricId.cpu_temp: HostCPUTempDriver({'path': host_files / 'temp'}),
+        HostMetricId.throttled: HostThrottledDriver({'path': host_files / 'missing'}),  # Not a Pi
+    }
+    HostHealth._failing = set()
+    HostHealth.record()
+    assert HostHealth.stats()['failing'] == ['throttled']
+
+    timestamps, metrics = HostHealth.history(None, None)
+    assert len(timestamps) == 1
+    assert metrics['cpu_temp'] == [pytest.approx(48.312)]
+    assert metrics['throttled'] == [None] and metrics['mem_used'] == [None]
+
+    # Samples past the retention period are dropped on the next record
+    db.session.add(HostMetric(timestamp=datetime.now() - timedelta(days=400), cpu_temp=40.0))
+    db.session.commit()
+    assert len(HostHealth.history(None, None)[0]) == 2
+    HostHealth.record()
+    timestamps, _ = HostHealth.history(datetime.now() - timedelta(days=1), None)
+    assert len(timestamps) == 2 and len(HostHealth.history(None, None)[0]) == 2
+
+def test_host_history_endpoint(app, host_files):
+    HostHealth._drivers = {HostMetricId.load_1m: HostLoadAvgDriver({'path': host_files / 'loadavg'})}
+    HostHealth.record()
+    response = app.test_client().get('/api/host_history?metrics=load_1m')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert list(data['metrics']) == ['load_1m'] and data['metrics']['load_1m'] == [0.52]
+    assert len(data['timestamps']) == 1 and data['metric_names']['load_1m'] == HostMetricId.load_1m.readable_name
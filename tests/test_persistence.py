@@ -0,0 +1,74 @@
+import pytest
+from datetime import datetime
+from loguru import logger
+from app import create_app, db
+from app.models import Measurement
+from app.persistence import MeasurementWriter
+from app.dynconfig import DynConfig
+from app.config import Config
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+@pytest.fixture
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        MeasurementWriter.stop()  # Don't share a writer bound to another app
+        yield app
+        MeasurementWriter.stop()
+        db.session.remove()
+        db.drop_all()
+
+def _row(i):
+    return {'timestamp': datetime.now(Config.TIMEZONE), 'v1_raw': float(i), 'relay_inside_1': False}
+
+def test_synchronous_without_writer(app):
+    MeasurementWriter.enqueue(_row(1))
+    assert Measurement.query.count() == 1
+
+def test_flushes_in_batches_and_on_stop(app):
+    MeasurementWriter.start(app)
+    flushes = MeasurementWriter.flushes
+    for i in range(5):
+        MeasurementWriter.enqueue(_row(i))
+    assert MeasurementWriter.stats()['queue_depth'] == 5  # Below the batch size, so still queued
+
+    MeasurementWriter.stop()
+    assert Measurement.query.count() == 5
+    assert MeasurementWriter.flushes == flushes + 1
+    assert MeasurementWriter.last_batch_size == 5
+    assert MeasurementWriter.stats()['queue_depth'] == 0
+
+def test_flush_writes_queued_rows(app):
+    MeasurementWriter.start(app)
+    try:
+        for i in range(3):
+            MeasurementWriter.enqueue(_row(i))
+        assert MeasurementWriter.flush(timeout=5.0)
+        assert MeasurementWriter.stats()['queue_depth'] == 0
+        assert Measurement.query.count() == 3
+    finally:
+        MeasurementWriter.stop()
+
+def test_overflow_drops_are_counted_and_logged_once(app, monkeypatch):
+    monkeypatch.setattr(DynConfig, '_confDict', {
+        **(DynConfig._confDict or {}), 'persist_queue_max': "2", 'persist_batch_size': "100"
+    })
+    monkeypatch.setattr(MeasurementWriter, '_drop_logged', None)
+    warnings = []
+    sink = logger.add(lambda message: warnings.append(message), level="WARNING",
+                      filter=lambda record: "Dropped" in record["message"])
+    MeasurementWriter.start(app)
+    try:
+        dropped = MeasurementWriter.rows_dropped
+        for i in range(5):
+            MeasurementWriter.enqueue(_row(i))
+        assert MeasurementWriter.stats()['rows_dropped'] == dropped + 3
+        assert len(warnings) == 1  # Later drops within the interval are only counted
+    finally:
+        logger.remove(sink)
+        MeasurementWriter.stop()
+    assert Measurement.query.count() == 2
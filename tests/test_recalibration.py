@@ -0,0 +1,85 @@
+import math
+import pytest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import Measurement, CalibrationPoint, RecalibrationJob
+from app.hardware_constants import SensorId
+from app.calibration import CalibrationRegistry, CompiledCalibration, CalPoint
+from app.recalibration import Recalibrator, changed_range
+from app.dynconfig import DynConfig
+from app.config import Config
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+@pytest.fixture
+def app(monkeypatch):
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        CalibrationRegistry.invalidate()
+        monkeypatch.setattr(DynConfig, '_confDict', {
+            **(DynConfig._confDict or {}), 'recalibration_pause_seconds': "0", 'recalibration_chunk_size': "3"
+        })
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+def _table(*points):
+    return CompiledCalibration([CalPoint(i, m, a) for i, (m, a) in enumerate(points)])
+
+def test_changed_range():
+    points = [(0.0, 0.0), (10.0, 100.0), (20.0, 200.0), (30.0, 300.0), (40.0, 400.0)]
+    old = _table(*points)
+    # Moving a point only changes the two segments around it
+    assert changed_range(old, _table(*points[:2], (20.0, 210.0), *points[3:])) == (10.0, 30.0)
+    # Adding a point inside a segment only changes that segment
+    assert changed_range(old, _table(*points[:2], (15.0, 160.0), *points[2:])) == (10.0, 20.0)
+    # Changing an end segment changes the extrapolation beyond it
+    assert changed_range(old, _table(*points, (50.0, 600.0))) == (40.0, math.inf)
+    assert changed_range(_table((0.0, 50.0), *points[1:]), _table(*points[1:])) == (-math.inf, 10.0)
+    assert changed_range(old, old) is None
+
+def test_recalibrates_only_changed_rows(app):
+    now = datetime.now(Config.TIMEZONE).replace(tzinfo=None)
+    db.session.add_all([CalibrationPoint(sensor_id='v1', measured_val=m, actual_val=m) for m in (0.0, 10.0, 20.0, 30.0)])
+    db.session.add_all([Measurement(timestamp=now, v1_raw=float(raw), v1_cal=float(raw)) for raw in range(0, 35)])
+    db.session.add(Measurement(timestamp=now - timedelta(days=60), v1_raw=15.0, v1_cal=15.0))  # Too old
+    db.session.commit()
+
+    old = CalibrationRegistry.get_table(SensorId.v1)
+    db.session.add(CalibrationPoint(sensor_id='v1', measured_val=15.0, actual_val=25.0))
+    db.session.commit()
+    CalibrationRegistry.invalidate(SensorId.v1)
+    job = Recalibrator.calibration_changed(SensorId.v1, old)
+    assert (job.raw_min, job.raw_max) == (10.0, 20.0)
+
+    Recalibrator.run_job(job)
+    assert job.status == 'done'
+    assert job.rows_updated == 11  # Raw values 10..20 from the last 30 days
+    cal = {m.v1_raw: m.v1_cal for m in Measurement.query.filter(Measurement.timestamp >= now)}
+    assert cal[15.0] == 25.0
+    assert cal[12.0] == pytest.approx(16.0)
+    assert cal[5.0] == 5.0 and cal[22.0] == 22.0 and cal[34.0] == 34.0
+    assert Measurement.query.filter(Measurement.timestamp < now).one().v1_cal == 15.0
+
+def test_job_stops_at_rows_present_when_queued(app):
+    now = datetime.now(Config.TIMEZONE).replace(tzinfo=None)
+    db.session.add_all([CalibrationPoint(sensor_id='v1', measured_val=m, actual_val=m) for m in (0.0, 10.0, 20.0)])
+    db.session.add_all([Measurement(timestamp=now, v1_raw=15.0, v1_cal=15.0) for _ in range(4)])
+    db.session.commit()
+
+    old = CalibrationRegistry.get_table(SensorId.v1)
+    db.session.add(CalibrationPoint(sensor_id='v1', measured_val=15.0, actual_val=25.0))
+    db.session.commit()
+    CalibrationRegistry.invalidate(SensorId.v1)
+    job = Recalibrator.calibration_changed(SensorId.v1, old)
+
+    # Rows stored after the edit are already calibrated with the new table
+    db.session.add_all([Measurement(timestamp=now, v1_raw=15.0, v1_cal=-1.0) for _ in range(4)])
+    db.session.commit()
+    Recalibrator.run_job(job)
+    assert job.status == 'done' and job.rows_updated == 4
+    assert Recalibrator.progress(job)['fraction_done'] == 1.0
+    assert sorted(m.v1_cal for m in Measurement.query) == [-1.0] * 4 + [25.0] * 4
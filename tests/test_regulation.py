@@ -0,0 +1,52 @@
+import time
+import pytest
+from app import create_app, db
+from app.hardwarestate import HardwareState
+from app.hardware_constants import SensorId, RelayId
+from app.dynconfig import DynConfig
+from app.regulation import Regulator
+from app.config import Config
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+@pytest.fixture
+def app(monkeypatch):
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        monkeypatch.setattr(DynConfig, '_confDict', {
+            **(DynConfig._confDict or {}),
+            'regulation_window_seconds': "600",
+            'regulation_min_dwell_seconds': "300",
+            'target_temp_tank1_f': "140.0",
+            'temp_hysteresis': "2.0",
+        })
+        monkeypatch.setattr(HardwareState, 'history', {})
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+def _push(sensor_id, values):
+    start = time.monotonic() - len(values)
+    for i, value in enumerate(values):
+        HardwareState.push_history(sensor_id, 0.0, start + i, value, value)
+
+def test_windowed_temperature_ignores_glitch(app, monkeypatch):
+    regulator = Regulator()
+    monkeypatch.setattr(regulator, '_windows', {})
+    monkeypatch.setattr(regulator, '_window_seqs', {})
+    _push(SensorId.t1, [141.0] * 5 + [0.0] + [141.0] * 4)
+    assert regulator._tank_temp(SensorId.t1) == 141.0
+
+def test_min_dwell_holds_relay(app, monkeypatch):
+    regulator = Regulator()
+    monkeypatch.setattr(regulator, '_last_switched', {})
+    switched = []
+    monkeypatch.setattr(HardwareState, 'set_relay', lambda relay, state: switched.append((relay, state)))
+    monkeypatch.setattr(HardwareState, 'get_relay_state', lambda relay: bool(switched and switched[-1][1]))
+
+    assert regulator._switch_circuit(RelayId.circ1, True)
+    assert not regulator._switch_circuit(RelayId.circ1, False)  # Too soon after switching on
+    assert switched == [(RelayId.circ1, True)]
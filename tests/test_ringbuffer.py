@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from app.ringbuffer import SensorRingBuffer
+
+def test_empty():
+    buf = SensorRingBuffer(4)
+    assert len(buf) == 0
+    assert buf.mean() is None and buf.slope() is None
+    assert len(buf.snapshot()) == 0
+
+def test_wraps_and_keeps_order():
+    buf = SensorRingBuffer(3)
+    for i in range(5):
+        buf.push(1000.0 + i, float(i), float(i), 10.0 * i)
+    snap = buf.snapshot()
+    assert list(snap.raw) == [2.0, 3.0, 4.0]
+    assert list(snap.cal) == [20.0, 30.0, 40.0]
+    assert list(buf.snapshot(seconds=1.0).raw) == [3.0, 4.0]
+
+def test_rolling_stats_match_numpy():
+    rng = np.random.default_rng(0)
+    buf = SensorRingBuffer(50)
+    t = np.cumsum(rng.uniform(0.5, 1.5, 237)) + 1e6
+    y = 3.0 * t + rng.normal(0, 5, 237)
+    for ti, yi in zip(t, y):
+        buf.push(ti, ti, yi, yi)
+    window_t, window_y = t[-50:], y[-50:]
+
+    stats = buf.stats()
+    assert stats.count == 50
+    assert stats.mean == pytest.approx(window_y.mean())
+    assert stats.min == window_y.min()
+    assert stats.max == window_y.max()
+    assert stats.slope == pytest.approx(np.polyfit(window_t, window_y, 1)[0], rel=1e-6)
+
+def test_since_returns_only_new_readings():
+    buf = SensorRingBuffer(3)
+    buf.push(0.0, 0.0, 0.0, 0.0)
+    new, seq = buf.since(0)
+    assert list(new.raw) == [0.0] and seq == 1
+    for i in range(1, 6):
+        buf.push(0.0, float(i), float(i), float(i))
+    new, seq = buf.since(seq)
+    assert list(new.raw) == [3.0, 4.0, 5.0] and seq == 6  # The rest was overwritten
+
+def test_rolling_window_matches_batch_statistics():
+    from scipy import stats
+    from app.rolling import RollingWindow
+    rng = np.random.default_rng(1)
+    window = RollingWindow(seconds=30.0, trim=0.2)
+    t, values = 0.0, []
+    for value in rng.normal(100, 10, 500):
+        t += rng.uniform(0.1, 2.0)
+        window.add(t, float(value))
+        values.append((t, float(value)))
+        in_window = [v for ts, v in values if ts >= t - 30.0]
+        assert len(window) == len(in_window)
+        assert window.median() == pytest.approx(np.median(in_window))
+        assert window.trimmed_mean() == pytest.approx(stats.trim_mean(in_window, 0.2))
+
+def test_rolling_window_ignores_a_glitch():
+    from app.rolling import RollingWindow
+    window = RollingWindow(seconds=60.0)
+    for t in range(10):
+        window.add(float(t), 0.0 if t == 5 else 140.0)  # A failed W1 read reports 0.0
+    assert window.median() == 140.0
+    assert window.trimmed_mean() == 140.0
@@ -0,0 +1,67 @@
+import pytest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import Measurement, MeasurementRollup
+from app.persistence import MeasurementWriter
+from app.rollups import Rollups
+from app.archive import Archive
+from app.config import Config
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        MeasurementWriter.stop()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+BASE = datetime(2025, 6, 1, 12, 0, 0)
+
+def _row(minutes, value, relay):
+    return {'timestamp': BASE + timedelta(minutes=minutes), 't1_cal': value, 'relay_inside_1': relay}
+
+def test_rollups_follow_written_batches(app):
+    MeasurementWriter.enqueue(_row(0, 10.0, True))
+    MeasurementWriter.enqueue(_row(0.5, 20.0, False))
+    MeasurementWriter.enqueue(_row(20, None, True))
+
+    minute = MeasurementRollup.query.filter_by(resolution=60, bucket=BASE).one()
+    assert (minute.count, minute.t1_min, minute.t1_max, minute.t1_sum, minute.t1_n) == (2, 10.0, 20.0, 30.0, 2)
+    assert minute.relay_inside_1_on == 1
+    hour = MeasurementRollup.query.filter_by(resolution=3600, bucket=BASE).one()
+    assert (hour.count, hour.t1_n, hour.relay_inside_1_on) == (3, 2, 2)
+
+    # A rebuild from the stored rows gives the same result
+    Rollups.rebuild(BASE, BASE)
+    hour = MeasurementRollup.query.filter_by(resolution=3600, bucket=BASE).one()
+    assert (hour.count, hour.t1_min, hour.t1_max, hour.t1_sum, hour.relay_inside_1_on) == (3, 10.0, 20.0, 30.0, 2)
+
+def test_history_frame_and_resolution_choice(app):
+    for i in range(120):
+        MeasurementWriter.enqueue(_row(i, float(i), i < 80))
+    df = Rollups.history_frame(3600, BASE, BASE + timedelta(hours=2))
+    assert list(df['t1']) == [29.5, 89.5]
+    assert list(df['t1_min']) == [0.0, 60.0]
+    assert list(df['relay_inside_1']) == [True, False]  # On for only 20 of the second hour's 60 minutes
+    assert list(df['relay_inside_1_frac']) == [1.0, pytest.approx(20 / 60)]
+
+    assert Rollups.pick_resolution(BASE, BASE + timedelta(days=90), 2000) == 3600
+    assert Rollups.pick_resolution(BASE, BASE + timedelta(days=7), 2000) == 60
+    assert Rollups.pick_resolution(BASE, BASE + timedelta(hours=24), 2000) is None
+
+def test_downsample_db_rebuilds_rollups(app):
+    app.config['LOGIN_DISABLED'] = True
+    for i in range(10):
+        MeasurementWriter.enqueue(_row(i, float(i), True))
+    response = app.test_client().post('/api/maintenance/downsample_db', json={'factor': 2})
+    assert response.get_json()['success']
+    assert Measurement.query.count() == 5
+    hour = MeasurementRollup.query.filter_by(resolution=3600, bucket=BASE).one()
+    assert (hour.count, hour.relay_inside_1_on, hour.t1_sum) == (5, 5, 1.0 + 3.0 + 5.0 + 7.0 + 9.0)
@@ -0,0 +1,30 @@
+import numpy as np
+from app import seriescodec
+
+def test_round_trip_with_gaps_and_bits():
+    epoch_ms = 1735750800000 + np.arange(13) * 1500
+    values = np.linspace(0, 1, 13)
+    values[4] = np.nan
+    relays = np.arange(13) % 3 == 0
+    payload = seriescodec.encode(epoch_ms, {'sensors': {'t1': values}, 'relays': {'inside_1': relays}}, {'resolution': None})
+
+    header, decoded_ms, groups = seriescodec.decode(payload)
+    assert header['resolution'] is None and header['t_unit_ms'] == 1
+    assert header['columns'][0]['dtype'] == 'u2'
+    assert list(decoded_ms) == list(epoch_ms)
+    np.testing.assert_allclose(groups['sensors']['t1'], values.astype(np.float32))
+    assert list(groups['relays']['inside_1']) == list(relays)
+    # Every column starts 4-byte aligned so the browser can view it as a typed array in place
+    assert all(c['offset'] % 4 == 0 for c in header['columns'])
+    assert (4 + len(payload[4:4 + int.from_bytes(payload[:4], 'little')])) % 4 == 0
+
+def test_timestamp_widths():
+    header, decoded_ms, _ = seriescodec.decode(seriescodec.encode(np.array([5, 70005, 70010]), {}))
+    assert header['columns'][0]['dtype'] == 'u4'
+    assert list(decoded_ms) == [5, 70005, 70010]
+
+    # Gaps over ~49 days fall back to whole seconds
+    epoch_ms = np.array([0, 1000, 100 * 86400 * 1000])
+    header, decoded_ms, _ = seriescodec.decode(seriescodec.encode(epoch_ms, {}))
+    assert header['t_unit_ms'] == 1000
+    assert list(decoded_ms) == list(epoch_ms)